@@ -88,6 +88,20 @@ DATABASES = {
     }
 }
 
+# Caches
+# https://docs.djangoproject.com/en/5.2/ref/settings/#caches
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # File based so the import worker and the web workers see the same entries
+    'sap_progress': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv("SAP_PROGRESS_CACHE_DIR", BASE_DIR / 'cache' / 'sap_progress'),
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -129,6 +143,62 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Behind nginx, set to its internal location for MEDIA_ROOT (deploy/nginx: /protected-media/) so downloads
+# are handed off with X-Accel-Redirect; left empty, Django streams them itself
+PROTECTED_MEDIA_ACCEL_PREFIX = os.getenv("PROTECTED_MEDIA_ACCEL_PREFIX", "")
+
+# Uploads are hashed as they stream in; supporting documents and data files are stored once per content
+FILE_UPLOAD_HANDLERS = [
+    'core_APP.blob_store.SHA256UploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Resumable uploads (link data): part files live here until completed
+CHUNKED_UPLOAD_DIR = os.getenv("CHUNKED_UPLOAD_DIR", os.path.join(BASE_DIR, 'chunked_uploads'))
+CHUNKED_UPLOAD_CHUNK_SIZE = int(os.getenv("CHUNKED_UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = int(os.getenv("CHUNKED_UPLOAD_MAX_CHUNK_SIZE", 32 * 1024 * 1024))
+CHUNKED_UPLOAD_MAX_SIZE = int(os.getenv("CHUNKED_UPLOAD_MAX_SIZE", 1024 * 1024 * 1024))
+# Unfinished uploads untouched for this long are removed by `manage.py purge_chunked_uploads`
+CHUNKED_UPLOAD_EXPIRY_HOURS = int(os.getenv("CHUNKED_UPLOAD_EXPIRY_HOURS", 24))
+# Uploaded trial balance / balance sheet files are parsed by `manage.py ingest_uploads`, this many rows per INSERT batch
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 2000))
+# An upload still 'processing' this long after it was claimed lost its worker and is ingested again
+# (the file loads all or nothing), up to INGEST_MAX_ATTEMPTS claims before it is marked failed
+INGEST_CLAIM_TIMEOUT_SECONDS = int(os.getenv("INGEST_CLAIM_TIMEOUT_SECONDS", 3600))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", 3))
+# SAP HANA imports fetch this many rows per round trip (cursor.fetchmany)
+SAP_FETCH_SIZE = int(os.getenv("SAP_FETCH_SIZE", 5000))
+# Callable opening a HANA DB-API connection from hdbcli connect() arguments. Point it at
+# core_APP.hana_standin.connect to run against the local SQLite stand-in instead of HANA Cloud
+HANA_CONNECTION_FACTORY = os.getenv("HANA_CONNECTION_FACTORY", "core_APP.hana_pool.hdbcli_connect")
+HANA_STANDIN_DIR = os.getenv("HANA_STANDIN_DIR", BASE_DIR / "hana_standin")
+# Pooled HANA connections per SAP link, and how long a request waits for a free one (seconds)
+HANA_POOL_MAX_SIZE = int(os.getenv("HANA_POOL_MAX_SIZE", 4))
+HANA_POOL_TIMEOUT = int(os.getenv("HANA_POOL_TIMEOUT", 30))
+# Idle pooled connections are closed after this many seconds
+HANA_POOL_IDLE_TIMEOUT = int(os.getenv("HANA_POOL_IDLE_TIMEOUT", 300))
+# Connections idle longer than this are pinged before reuse
+HANA_POOL_CHECK_AFTER = int(os.getenv("HANA_POOL_CHECK_AFTER", 30))
+HANA_POOL_PING_SQL = "SELECT 1 FROM DUMMY"
+# SAP table/column metadata is cached this long (append ?refresh=1 to the column endpoints to reload)
+SAP_METADATA_CACHE_SECONDS = int(os.getenv("SAP_METADATA_CACHE_SECONDS", 900))
+# Live SAP import progress: the import worker publishes it to this cache and the Link Data page's
+# event stream reads it, so it must be shared by the web and worker processes
+SAP_PROGRESS_CACHE = "sap_progress"
+# Seconds between progress updates, how often the event stream checks, and how long one stream lasts.
+# Keep streams under the gunicorn worker timeout (gunicorn.conf.py); the browser reconnects after each
+SAP_PROGRESS_INTERVAL = float(os.getenv("SAP_PROGRESS_INTERVAL", 1))
+SAP_PROGRESS_POLL_SECONDS = float(os.getenv("SAP_PROGRESS_POLL_SECONDS", 1))
+SAP_PROGRESS_STREAM_SECONDS = int(os.getenv("SAP_PROGRESS_STREAM_SECONDS", 20))
+SAP_PROGRESS_TTL = 24 * 60 * 60
+# A job still 'running' this long after it started lost its worker and is run again (tables re-sync
+# from their watermarks), up to SAP_IMPORT_MAX_ATTEMPTS claims before it is marked failed
+SAP_IMPORT_JOB_TIMEOUT_SECONDS = int(os.getenv("SAP_IMPORT_JOB_TIMEOUT_SECONDS", 4 * 60 * 60))
+SAP_IMPORT_MAX_ATTEMPTS = int(os.getenv("SAP_IMPORT_MAX_ATTEMPTS", 3))
+# Tables an "import all" job syncs at once, each on its own HANA connection, committing batch by batch.
+# SQLite takes one writer at a time, so there the tables run one after another.
+SAP_IMPORT_WORKERS = int(os.getenv("SAP_IMPORT_WORKERS", 1 if DATABASES["default"]["ENGINE"].endswith("sqlite3") else 4))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -147,6 +217,21 @@ EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Email Outbox (delivered by `manage.py send_outbox`)
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", 50))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", 5))
+EMAIL_OUTBOX_RETRY_BASE_SECONDS = int(os.getenv("EMAIL_OUTBOX_RETRY_BASE_SECONDS", 30))
+# Mail left 'sending' this long belongs to a worker that died mid-batch and is claimed again
+EMAIL_OUTBOX_LEASE_SECONDS = int(os.getenv("EMAIL_OUTBOX_LEASE_SECONDS", 600))
+# Per-GL notifications are collected per recipient for this long and sent as one digest (0 = off)
+EMAIL_DIGEST_WINDOW_SECONDS = int(os.getenv("EMAIL_DIGEST_WINDOW_SECONDS", 300))
+
+# Review trail GL datalist is cached (default cache) until a trail is written, or for at most this long
+REVIEW_TRAIL_GL_CODES_CACHE_SECONDS = int(os.getenv("REVIEW_TRAIL_GL_CODES_CACHE_SECONDS", 300))
+# GL code autocomplete index checks the GL account master for new codes at most this often
+GL_AUTOCOMPLETE_REFRESH_SECONDS = int(os.getenv("GL_AUTOCOMPLETE_REFRESH_SECONDS", 30))
+GL_AUTOCOMPLETE_MAX_RESULTS = int(os.getenv("GL_AUTOCOMPLETE_MAX_RESULTS", 50))
+
 # ElasticSearch
 ELASTIC_URL = os.getenv("ELASTIC_URL", "http://localhost:9200")
 ELASTIC_INDEX = os.getenv("ELASTIC_INDEX", "rag_docs")
\ No newline at end of file
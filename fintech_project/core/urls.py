@@ -17,8 +17,6 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 from django.urls import include
-from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -32,5 +30,5 @@ urlpatterns = [
     path('team-management/', include('core_APP.modules.team_management.team_management_urls'))
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Media is not served at MEDIA_URL: documents and uploads go through access-checked download
+# views, which hand the transfer to nginx with X-Accel-Redirect (PROTECTED_MEDIA_ACCEL_PREFIX)
\ No newline at end of file
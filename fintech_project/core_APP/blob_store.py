@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import os
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import IntegrityError, transaction
+
+from core_APP.models import StoredBlob
+
+
+logger = logging.getLogger(__name__)
+
+
+class SHA256UploadHandler(FileUploadHandler):
+    """
+    Hashes every uploaded file while its chunks stream in, ahead of the handlers that spool them
+    to memory or disk, so storing the upload never has to read it back just to hash it.
+
+    Digests end up on request.upload_digests, keyed by (field name, file name).
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._sha256.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        digests = self.request.__dict__.setdefault('upload_digests', {})
+        digests[(self.field_name, self.file_name)] = self._sha256.hexdigest()
+        # Let the next handler build the UploadedFile
+        return None
+
+
+def upload_digest(request, field_name, uploaded_file):
+    """SHA-256 of an uploaded file, from SHA256UploadHandler if it saw the upload, else by reading it."""
+    digest = getattr(request, 'upload_digests', {}).get((field_name, uploaded_file.name))
+    if digest:
+        return digest
+    sha256 = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def blob_name(sha256, file_name):
+    """Storage path of a blob: fanned out on the first hash byte, keeping the extension for content types."""
+    ext = os.path.splitext(file_name)[1].lower()
+    return f"blobs/{sha256[:2]}/{sha256}{ext}"
+
+
+def _add_reference(sha256, uploaded_file):
+    """Count one more reference on the blob, if there is one, holding its row lock until commit."""
+    blob = StoredBlob.objects.select_for_update().filter(sha256=sha256).first()
+    if blob is None:
+        return None
+    if blob.ref_count == 0 and not default_storage.exists(blob.file.name):
+        # A _free_blob deleted the bytes and then rolled back: put them back
+        blob.file = default_storage.save(blob.file.name, uploaded_file)
+    blob.ref_count += 1
+    blob.save(update_fields=['file', 'ref_count'])
+    return blob
+
+
+def store_blob(uploaded_file, sha256):
+    """
+    The StoredBlob holding `uploaded_file`'s bytes, with one more reference counted.
+
+    The bytes are written only when no blob has them yet. Call it inside the transaction
+    that saves the referencing row, so a rollback also rolls back the reference.
+    """
+    with transaction.atomic():
+        blob = _add_reference(sha256, uploaded_file)
+        if blob:
+            return blob
+
+    name = blob_name(sha256, uploaded_file.name)
+    # The path is fixed per content, so a copy left by a rolled back upload is simply reused
+    if not default_storage.exists(name):
+        name = default_storage.save(name, uploaded_file)
+    try:
+        with transaction.atomic():
+            return StoredBlob.objects.create(sha256=sha256, file=name, size=uploaded_file.size, ref_count=1)
+    except IntegrityError:
+        # A concurrent upload of the same bytes created the blob first
+        with transaction.atomic():
+            blob = _add_reference(sha256, uploaded_file)
+        if blob.file.name != name:
+            default_storage.delete(name)
+        return blob
+
+
+def release_blob(sha256):
+    """
+    Drop one reference to a blob. Once the transaction commits, the last reference's bytes
+    and row are deleted unless the blob has been referenced again by then.
+    """
+    if not sha256:
+        return
+    with transaction.atomic():
+        blob = StoredBlob.objects.select_for_update().filter(sha256=sha256).first()
+        if blob is None:
+            return
+        blob.ref_count = max(blob.ref_count - 1, 0)
+        blob.save(update_fields=['ref_count'])
+    if blob.ref_count == 0:
+        transaction.on_commit(lambda: _free_blob(sha256))
+
+
+def _free_blob(sha256):
+    # Bytes and row go together under the row lock: a store_blob waiting on it then finds
+    # no row and writes the bytes afresh, one that got in first left a reference to keep
+    with transaction.atomic():
+        blob = StoredBlob.objects.select_for_update().filter(sha256=sha256, ref_count=0).first()
+        if blob is None:
+            return
+        default_storage.delete(blob.file.name)
+        blob.delete()
+    logger.info(f"Freed blob {sha256}")
@@ -0,0 +1,161 @@
+import bisect
+import datetime
+import logging
+import threading
+import time
+from array import array
+
+from django.conf import settings
+
+from core_APP.models import GLAccount
+
+
+logger = logging.getLogger(__name__)
+
+
+# Rows saved inside a transaction that commits later carry an updated_at from before the commit:
+# each refresh re-reads this far behind the newest updated_at it has seen
+WATERMARK_OVERLAP = datetime.timedelta(minutes=5)
+
+
+def _grams(text):
+    """Every substring of one to three characters."""
+    return {text[i:i + n] for n in (1, 2, 3) for i in range(len(text) - n + 1)}
+
+
+class GLCodeIndex:
+    """
+    In-process autocomplete index over the GL account master.
+
+    Prefix lookups bisect a sorted list of lowercase codes. Substring lookups take the rarest
+    trigram of the query, check only the accounts in its posting list, and stop once `limit`
+    results are found. One- and two-character queries have posting lists of their own.
+
+    The index loads on first use. After that it only pulls accounts created or renamed since the
+    newest updated_at it has seen and applies them to the existing structures; when the master's
+    row count disagrees with the index, it also drops the accounts that were deleted. It checks
+    at most once every GL_AUTOCOMPLETE_REFRESH_SECONDS, or on the next search after expire().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._positions = {}    # GLAccount.id -> position in _entries/_lines
+        self._entries = []      # (code, name), in load order; None once deleted
+        self._lines = []        # "code name" lowercased, same order; '' once deleted
+        self._codes = []        # sorted (lowercase code, position)
+        self._grams = {}        # 1-3 character substring -> array of positions
+        self._watermark = None  # newest GLAccount.updated_at loaded
+        self._checked_at = None
+
+    def _is_fresh(self, now):
+        return self._checked_at is not None and now - self._checked_at < settings.GL_AUTOCOMPLETE_REFRESH_SECONDS
+
+    def _load(self):
+        now = time.monotonic()
+        if self._is_fresh(now):
+            return
+        with self._lock:
+            if self._is_fresh(now):
+                return
+            accounts = GLAccount.objects.all()
+            if self._watermark is not None:
+                accounts = accounts.filter(updated_at__gte=self._watermark - WATERMARK_OVERLAP)
+            rows = list(accounts.values_list('id', 'code', 'name', 'updated_at'))
+            if rows:
+                self._add(rows)
+                self._watermark = max(self._watermark or rows[0][3], *(row[3] for row in rows))
+            removed = 0
+            if GLAccount.objects.count() != len(self._positions):
+                removed = self._remove(self._positions.keys() - set(GLAccount.objects.values_list('id', flat=True)))
+            if rows or removed:
+                logger.info(
+                    f"GL code index: {len(rows)} accounts loaded, {removed} removed, {len(self._positions)} total"
+                )
+            self._checked_at = now
+
+    def _add(self, rows):
+        new_codes = []
+        moved = set()
+        for account_id, code, name, _ in rows:
+            line = f"{code} {name or ''}".lower()
+            position = self._positions.get(account_id)
+            if position is None:
+                position = len(self._entries)
+                self._positions[account_id] = position
+                self._entries.append((code, name or ''))
+                self._lines.append(line)
+                new_codes.append((code.lower(), position))
+                grams = _grams(line)
+            else:
+                if line == self._lines[position]:
+                    continue
+                # Renamed: only the new substrings need posting. Stale postings are harmless,
+                # search() checks every candidate against its current line.
+                grams = _grams(line) - _grams(self._lines[position])
+                if code != self._entries[position][0]:
+                    moved.add(position)
+                    new_codes.append((code.lower(), position))
+                self._entries[position] = (code, name or '')
+                self._lines[position] = line
+            for gram in grams:
+                self._grams.setdefault(gram, array('I')).append(position)
+
+        # Swap in a new sorted list so concurrent searches never see a half-updated one
+        if new_codes:
+            self._codes = sorted([c for c in self._codes if c[1] not in moved] + new_codes)
+
+    def _remove(self, account_ids):
+        """Drop deleted accounts; their positions stay allocated but match nothing."""
+        positions = {self._positions.pop(account_id) for account_id in account_ids}
+        if positions:
+            for position in positions:
+                self._entries[position] = None
+                self._lines[position] = ''
+            self._codes = [c for c in self._codes if c[1] not in positions]
+        return len(positions)
+
+    def expire(self):
+        """Make the next search pick up newly ingested accounts instead of waiting for the refresh window."""
+        self._checked_at = None
+
+    def _candidates(self, query):
+        if len(query) < 3:
+            return self._grams.get(query, ())
+        postings = [self._grams.get(query[i:i + 3]) for i in range(len(query) - 2)]
+        if not all(postings):
+            return ()
+        return min(postings, key=len)
+
+    def search(self, query, limit=20, within=None):
+        """
+        Up to `limit` (code, name) pairs: codes starting with `query` first (in code order),
+        then codes or names containing it. `within` optionally restricts results to a set of codes.
+        """
+        self._load()
+        query = query.strip().lower()
+        codes, entries, lines = self._codes, self._entries, self._lines
+        results = []
+        seen = set()
+
+        def take(position):
+            entry = entries[position]
+            # None: deleted by a refresh that ran after `codes` was read
+            if entry is not None and position not in seen and (within is None or entry[0] in within):
+                seen.add(position)
+                results.append(entry)
+            return len(results) >= limit
+
+        i = bisect.bisect_left(codes, (query,))
+        while i < len(codes) and codes[i][0].startswith(query):
+            if take(codes[i][1]):
+                return results
+            i += 1
+
+        if query:
+            for position in self._candidates(query):
+                if query in lines[position] and take(position):
+                    return results
+        return results
+
+
+gl_code_index = GLCodeIndex()
@@ -0,0 +1,218 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+def hana_connection_params(saplink):
+    """hdbcli connect() keyword arguments for a SAPLink."""
+    host_name = saplink.hana_host[:-4]
+    params = {
+        'address': host_name,
+        'port': int(saplink.hana_port),
+        'user': saplink.username,
+        'password': saplink.password,
+        'encrypt': True,
+        'sslValidateCertificate': False,  # For development only
+    }
+    if 'hanacloud.ondemand.com' in host_name:
+        params.update({
+            'sslCryptoProvider': 'openssl',
+            'sslTrustStore': None,  # Use system trust store
+        })
+    return params
+
+
+def _fingerprint(params):
+    return hashlib.sha256(repr(sorted(params.items())).encode()).hexdigest()
+
+
+def hdbcli_connect(**params):
+    from hdbcli import dbapi
+    return dbapi.connect(**params)
+
+
+def _close(*conns):
+    # Never under the pool lock: a close can block on the network as long as a connect can
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception:
+            logger.warning("Closing a pooled HANA connection failed", exc_info=True)
+
+
+class _LinkPool:
+    def __init__(self, fingerprint, lock):
+        self.fingerprint = fingerprint
+        self.idle = deque()      # (connection, returned_at), most recently returned last
+        self.in_use = {}         # id(connection) -> fingerprint it was opened with
+        self.connecting = 0      # slots reserved while a new connection is being opened
+        self.available = threading.Condition(lock)
+
+    def size(self):
+        return len(self.in_use) + self.connecting
+
+
+class HanaConnectionPool:
+    """
+    Process-wide pool of SAP HANA connections, one sub-pool per SAPLink id.
+
+    At most HANA_POOL_MAX_SIZE connections per link exist at once. A borrower waits up to
+    HANA_POOL_TIMEOUT seconds for one to come back, then gets PoolExhausted. Connections idle
+    for HANA_POOL_IDLE_TIMEOUT seconds are closed. One idle for more than HANA_POOL_CHECK_AFTER
+    seconds is pinged before it's handed out. Every acquire and release evicts idle connections
+    across all links, so a link nobody uses any more doesn't keep its sessions open. Changed
+    credentials (host, user, password...) retire the link's connections; invalidate() does the
+    same explicitly. Connections are taken out of the pool under its lock and closed after it.
+    """
+
+    def __init__(self, connect=None):
+        # None: the HANA_CONNECTION_FACTORY setting (hdbcli, or the local stand-in)
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._pools = {}
+
+    def _pool_for(self, key, fingerprint, stale):
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = _LinkPool(fingerprint, self._lock)
+        elif pool.fingerprint != fingerprint:
+            # Credentials changed: drop idle connections, in-use ones are closed on return
+            logger.info(f"HANA pool for {key}: connection settings changed, retiring connections")
+            stale += self._drain(pool)
+            pool.fingerprint = fingerprint
+        return pool
+
+    def _drain(self, pool):
+        """Take all of the pool's idle connections out, for closing once the lock is released."""
+        conns = [conn for conn, _ in pool.idle]
+        pool.idle.clear()
+        return conns
+
+    def _evict_idle(self, now):
+        """Take connections idle past HANA_POOL_IDLE_TIMEOUT out of every link's pool, oldest first."""
+        conns = []
+        for pool in self._pools.values():
+            while pool.idle and now - pool.idle[0][1] > settings.HANA_POOL_IDLE_TIMEOUT:
+                conns.append(pool.idle.popleft()[0])
+        return conns
+
+    def _is_alive(self, conn):
+        try:
+            if hasattr(conn, 'isconnected'):
+                return conn.isconnected()
+            cursor = conn.cursor()
+            try:
+                cursor.execute(settings.HANA_POOL_PING_SQL)
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self, saplink):
+        params = hana_connection_params(saplink)
+        fingerprint = _fingerprint(params)
+        key = str(saplink.pk)
+        deadline = time.monotonic() + settings.HANA_POOL_TIMEOUT
+        stale = []
+        try:
+            with self._lock:
+                pool = self._pool_for(key, fingerprint, stale)
+                while True:
+                    now = time.monotonic()
+                    stale += self._evict_idle(now)
+                    if pool.idle:
+                        conn, returned_at = pool.idle.pop()
+                        pool.in_use[id(conn)] = fingerprint
+                        break
+                    if pool.size() < settings.HANA_POOL_MAX_SIZE:
+                        conn = returned_at = None
+                        pool.connecting += 1
+                        break
+                    if deadline - now <= 0:
+                        raise PoolExhausted(f"No HANA connection for SAP link {key} within {settings.HANA_POOL_TIMEOUT}s")
+                    pool.available.wait(deadline - now)
+        finally:
+            _close(*stale)
+
+        if conn is not None and time.monotonic() - returned_at > settings.HANA_POOL_CHECK_AFTER and not self._is_alive(conn):
+            logger.info(f"HANA pool for {key}: replacing a dead connection")
+            with self._lock:
+                pool.in_use.pop(id(conn), None)
+                pool.connecting += 1
+            _close(conn)
+            conn = None
+
+        if conn is None:
+            # Connect outside the lock; the TLS handshake is the slow part
+            try:
+                conn = (self._connect or import_string(settings.HANA_CONNECTION_FACTORY))(**params)
+            finally:
+                with self._lock:
+                    pool.connecting -= 1
+                    if conn is not None:
+                        pool.in_use[id(conn)] = fingerprint
+                    else:
+                        pool.available.notify()
+        return conn
+
+    def release(self, saplink, conn, discard=False):
+        key = str(saplink.pk)
+        with self._lock:
+            now = time.monotonic()
+            stale = self._evict_idle(now)
+            pool = self._pools.get(key)
+            fingerprint = pool.in_use.pop(id(conn), None) if pool else None
+            if pool is not None:
+                pool.available.notify()
+            if discard or pool is None or fingerprint != pool.fingerprint:
+                stale.append(conn)
+            else:
+                pool.idle.append((conn, now))
+        _close(*stale)
+
+    @contextmanager
+    def connection(self, saplink):
+        """Borrow a connection for the block. It goes back to the pool unless the block broke it."""
+        conn = self.acquire(saplink)
+        try:
+            yield conn
+        except Exception:
+            self.release(saplink, conn, discard=not self._is_alive(conn))
+            raise
+        self.release(saplink, conn)
+
+    def invalidate(self, saplink_id):
+        """Close the link's idle connections and retire the ones in use (e.g. after its credentials change)."""
+        stale = []
+        with self._lock:
+            pool = self._pools.get(str(saplink_id))
+            if pool is not None:
+                stale = self._drain(pool)
+                pool.fingerprint = None
+        _close(*stale)
+
+    def close_all(self):
+        stale = []
+        with self._lock:
+            for pool in self._pools.values():
+                stale += self._drain(pool)
+            self._pools.clear()
+        _close(*stale)
+
+
+hana_pool = HanaConnectionPool()
@@ -0,0 +1,130 @@
+import datetime
+import itertools
+import sqlite3
+from pathlib import Path
+
+from django.conf import settings
+
+from core_APP.ingestion import INGEST_TARGETS, iter_csv_rows, map_headers
+from core_APP.modules.link_data.link_data_sap import SAP_LOCAL_FIELDS
+
+
+# Sample exports the stand-in tables are generated from
+STANDIN_SOURCES = {
+    'trial_balance': 'TrialBalance_clean.csv',
+    'balance_sheet': 'balance_sheet_reco_APL_5500_final.csv',
+}
+
+# SQLite declared type -> the DATA_TYPE_NAME HANA reports
+HANA_TYPE_NAMES = {
+    'TEXT': 'NVARCHAR',
+    'INTEGER': 'INTEGER',
+    'NUMERIC': 'DECIMAL',
+    'REAL': 'DOUBLE',
+    'TIMESTAMP': 'TIMESTAMP',
+}
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def standin_dir(directory=None):
+    return Path(directory or settings.HANA_STANDIN_DIR)
+
+
+def connect(directory=None, **params):
+    """
+    A DB-API connection standing in for SAP HANA, with the hdbcli connect() signature.
+
+    Every <SCHEMA>.sqlite3 file in HANA_STANDIN_DIR is attached as that schema, and the SYS
+    views the app reads (SYS.TABLES, SYS.TABLE_COLUMNS) plus DUMMY are built from them, so
+    metadata discovery, `SELECT ... FROM "SCHEMA"."TABLE"` and the pool's ping all work.
+    Host and credentials are ignored.
+    """
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    conn.execute('CREATE TABLE DUMMY (DUMMY TEXT)')
+    conn.execute("INSERT INTO DUMMY VALUES ('X')")
+    conn.execute("ATTACH ':memory:' AS SYS")
+    conn.execute('CREATE TABLE SYS.TABLES (SCHEMA_NAME TEXT, TABLE_NAME TEXT)')
+    conn.execute(
+        'CREATE TABLE SYS.TABLE_COLUMNS '
+        '(SCHEMA_NAME TEXT, TABLE_NAME TEXT, COLUMN_NAME TEXT, DATA_TYPE_NAME TEXT, POSITION INTEGER)'
+    )
+    for path in sorted(standin_dir(directory).glob('*.sqlite3')):
+        schema = path.stem
+        conn.execute(f'ATTACH ? AS {_quote(schema)}', [str(path)])
+        tables = conn.execute(f"SELECT name FROM {_quote(schema)}.sqlite_master WHERE type = 'table'").fetchall()
+        for (table,) in tables:
+            conn.execute('INSERT INTO SYS.TABLES VALUES (?, ?)', [schema, table])
+            conn.executemany('INSERT INTO SYS.TABLE_COLUMNS VALUES (?, ?, ?, ?, ?)', [
+                (schema, table, name, HANA_TYPE_NAMES.get(declared.upper(), declared.upper() or 'NVARCHAR'), position + 1)
+                for position, name, declared, *_ in conn.execute(f'PRAGMA {_quote(schema)}.table_info({_quote(table)})')
+            ])
+    conn.commit()
+    return conn
+
+
+def standin_mapping(table_type):
+    """{local field: stand-in column} for a target table; columns are the field names upper-cased like HANA's."""
+    return {field: field.upper() for field in SAP_LOCAL_FIELDS[table_type]}
+
+
+def _sample_rows(table_type):
+    """The sample export's rows as {model field: value}."""
+    _, header_map, code_field, _ = INGEST_TARGETS[table_type]
+    path = settings.BASE_DIR.parent / 'data' / STANDIN_SOURCES[table_type]
+    with open(path, 'rb') as fh:
+        rows = iter_csv_rows(fh)
+        for header in rows:
+            columns = map_headers(header, header_map)
+            if any(field == code_field for _, field in columns):
+                break
+        samples = [{field: row[i] for i, field in columns if i < len(row)} for row in rows]
+    return [row for row in samples if row.get(code_field)]
+
+
+def generate_rows(table_type, count):
+    """
+    `count` rows cycling through the sample export. Each pass gets its own fiscal year and GL code
+    suffix so every row has a distinct natural key; CHANGED_AT increases by a second per row.
+    """
+    _, _, code_field, _ = INGEST_TARGETS[table_type]
+    fields = SAP_LOCAL_FIELDS[table_type]
+    samples = _sample_rows(table_type)
+    start = datetime.datetime(2025, 1, 1)
+    for n, sample in zip(range(count), itertools.cycle(samples)):
+        cycle = n // len(samples)
+        row = dict(sample, fiscal_year=str(2000 + cycle % 100))
+        row[code_field] = f"{sample[code_field]}{cycle // 100 or ''}"
+        yield [row.get(field) or None for field in fields] + [
+            (start + datetime.timedelta(seconds=n)).isoformat(sep=' ')
+        ]
+
+
+def build_standin_table(schema, table_type, count, directory=None, chunk_size=10000):
+    """(Re)create <schema>.<TABLE> in the stand-in with `count` generated rows. Returns its path."""
+    directory = standin_dir(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'{schema}.sqlite3'
+    columns = list(standin_mapping(table_type).values())
+    table = _quote(table_type.upper())
+    db = sqlite3.connect(path)
+    try:
+        db.execute(f'DROP TABLE IF EXISTS {table}')
+        db.execute(
+            f'CREATE TABLE {table} ('
+            + ', '.join(f"{_quote(c)} {'NUMERIC' if c == 'AMOUNT' else 'TEXT'}" for c in columns)
+            + ', "CHANGED_AT" TIMESTAMP)'
+        )
+        rows = generate_rows(table_type, count)
+        insert = f'INSERT INTO {table} VALUES ({", ".join("?" * (len(columns) + 1))})'
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            db.executemany(insert, chunk)
+        db.commit()
+    finally:
+        db.close()
+    return path
@@ -0,0 +1,385 @@
+import csv
+import datetime
+import io
+import logging
+import os
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from core_APP.gl_index import gl_code_index
+from core_APP.models import BalanceSheet, GLAccount, GLReview, GLWorklistEntry, TrialBalance, UploadedFile
+from core_APP.modules.gl_reviews.gl_reviews_worklist import refresh_worklist
+
+
+logger = logging.getLogger(__name__)
+
+
+# Normalised source header -> model field. Headers are lowercased with whitespace (including the
+# line breaks of multi-line quoted headers) collapsed; the model field names are accepted as well.
+TRIAL_BALANCE_HEADERS = {
+    'gl': 'gl_code',
+    'gl code': 'gl_code',
+    'gl name': 'gl_name',
+    'gr gl': 'group_gl_code',
+    'gr gl name': 'group_gl_name',
+    'amount': 'amount',
+    'fs grouping main head': 'fs_main_head',
+    'fs grouping main sub head': 'fs_sub_head',
+    'fiscal year': 'fiscal_year',
+}
+
+BALANCE_SHEET_HEADERS = {
+    'bs/pl': 'BS_PL',
+    'status': 'status',
+    'g/l acct': 'gl_acct',
+    'g/l account number': 'gl_account_name',
+    'main head': 'main_head',
+    'sub head': 'sub_head',
+    'c/m/l': 'cml',
+    'frequency': 'frequency',
+    'responsible department': 'responsible_department',
+    'departement spoc': 'department_spoc',
+    'department spoc': 'department_spoc',
+    'departement reviewer': 'department_reviewer',
+    'department reviewer': 'department_reviewer',
+    'query type / action points': 'query_type_action_points',
+    'working needed': 'working_needed',
+    'confirmation (internal / external)': 'confirmation_type',
+    'recon / non recon': 'recon_status',
+    '% variance': 'variance_percent',
+    'flag (green / red)': 'flag_color',
+    'type of report': 'report_type',
+    'analysis requrired': 'analysis_required',
+    'analysis required': 'analysis_required',
+    'review check point at abex': 'review_checkpoint_abex',
+    'fiscal year': 'fiscal_year',
+}
+
+# table_type -> (model, header map, gl code field, gl name field)
+INGEST_TARGETS = {
+    'trial_balance': (TrialBalance, TRIAL_BALANCE_HEADERS, 'gl_code', 'gl_name'),
+    'balance_sheet': (BalanceSheet, BALANCE_SHEET_HEADERS, 'gl_acct', 'gl_account_name'),
+}
+
+
+class IngestionError(Exception):
+    pass
+
+
+def normalize_header(header):
+    return re.sub(r'\s+', ' ', str(header or '')).strip().lower()
+
+
+def map_headers(headers, header_map):
+    """[(column index, model field)] for the recognised columns of a header row."""
+    accepted = {**{field.lower(): field for field in header_map.values()}, **header_map}
+    mapped = []
+    for i, header in enumerate(headers):
+        field = accepted.get(normalize_header(header))
+        if field:
+            mapped.append((i, field))
+    return mapped
+
+
+# -------------------------------
+# Row sources (one row at a time, never the whole file)
+# -------------------------------
+
+def iter_csv_rows(fh):
+    # utf-8-sig drops the BOM Excel writes; newline='' lets csv handle quoted fields spanning lines
+    return csv.reader(io.TextIOWrapper(fh, encoding='utf-8-sig', errors='replace', newline=''))
+
+
+def iter_xlsx_rows(fh):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise IngestionError("XLSX ingestion needs openpyxl (pip install openpyxl).")
+    # read_only streams the sheet XML instead of building the whole workbook
+    workbook = load_workbook(fh, read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield ['' if value is None else value for value in row]
+    finally:
+        workbook.close()
+
+
+ROW_READERS = {
+    '.csv': iter_csv_rows,
+    '.txt': iter_csv_rows,
+    '.xlsx': iter_xlsx_rows,
+    '.xlsm': iter_xlsx_rows,
+}
+
+
+# -------------------------------
+# Row conversion
+# -------------------------------
+
+def _clean(value, field):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer() and field.name != 'amount':
+        # Spreadsheet cells hold GL codes and years as floats
+        value = int(value)
+    text = str(value).strip()
+    if not text:
+        return None
+    max_length = getattr(field, 'max_length', None)
+    return text[:max_length] if max_length else text
+
+
+def parse_amount(value):
+    if value in (None, ''):
+        return Decimal(0)
+    text = str(value).strip().replace(',', '')
+    if text.startswith('(') and text.endswith(')'):
+        text = '-' + text[1:-1]
+    try:
+        return Decimal(text).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount {value!r}")
+
+
+def build_instance(model, columns, row, user):
+    values = {}
+    for i, field_name in columns:
+        raw = row[i] if i < len(row) else None
+        if field_name == 'amount':
+            values['amount'] = parse_amount(raw)
+        else:
+            values[field_name] = _clean(raw, model._meta.get_field(field_name))
+    return model(user=user, **values)
+
+
+def _link_gl_accounts(model, batch, code_field, name_field):
+    """Point the batch at its GL accounts. Returns the GL codes whose worklist rows need refreshing."""
+    gl_account_ids, renamed = GLAccount.objects.ids_for(
+        {getattr(o, code_field) for o in batch}, {getattr(o, code_field): getattr(o, name_field) for o in batch},
+        overwrite_names=model.gl_name_authoritative,
+    )
+    for o in batch:
+        o.gl_account_id = gl_account_ids.get(getattr(o, code_field))
+    if model is TrialBalance:
+        # The newest TrialBalance decides which review a GL's worklist rows show
+        return gl_account_ids.keys()
+    return renamed
+
+
+def _upsert_batch(model, batch, code_field, name_field, fields):
+    """
+    Write a batch on the natural key (user, gl code, fiscal_year): existing rows get `fields`
+    updated in place, the rest are inserted. Within the batch the last row for a key wins.
+    Returns (rows written, GL codes whose worklist rows need refreshing).
+    """
+    rows = {(o.user_id, getattr(o, code_field), o.fiscal_year): o for o in batch}
+    # GL accounts first, in their own short transaction when no outer one is open
+    gl_codes = _link_gl_accounts(model, list(rows.values()), code_field, name_field)
+    unique_fields = ['user', code_field, 'fiscal_year']
+    update_fields = [field for field in fields if field not in unique_fields] + ['gl_account']
+
+    # The batch's own rows commit together (a savepoint inside an outer transaction)
+    with transaction.atomic():
+        dated = [o for o in rows.values() if o.fiscal_year is not None]
+        if dated:
+            model.objects.bulk_create(dated, update_conflicts=True, unique_fields=unique_fields, update_fields=update_fields)
+
+        # ON CONFLICT can't target the partial index on rows without a fiscal year: match those up front
+        undated = {(user_id, code): o for (user_id, code, fiscal_year), o in rows.items() if fiscal_year is None}
+        if undated:
+            existing = model.objects.filter(
+                user_id__in={user_id for user_id, _ in undated},
+                fiscal_year__isnull=True,
+                **{f"{code_field}__in": {code for _, code in undated}},
+            ).values_list('user_id', code_field, 'id')
+            updates = []
+            for user_id, code, pk in existing:
+                o = undated.get((user_id, code))
+                if o is not None and o._state.adding:
+                    o.pk = pk
+                    o._state.adding = False
+                    updates.append(o)
+            model.objects.bulk_create([o for o in undated.values() if o._state.adding])
+            if updates:
+                model.objects.bulk_update(updates, update_fields)
+    return len(rows), gl_codes
+
+
+def load_rows(table_type, user, columns, rows, batch_size=None, source='', progress=None):
+    """
+    Upsert source rows into the table_type's model in bulk batches, keeping only one batch in
+    memory; re-loading a period updates its rows in place. `columns` is the precompiled
+    [(row index, model field)] mapping. Returns (written, skipped): rows repeating a natural key
+    within a batch count once, rows without a GL code or with a bad amount are skipped, blank
+    rows ignored. Shared by file ingestion and the SAP import.
+    `progress`, if given, is called with rows_read / rows_written / rows_skipped after every batch.
+    Outside a transaction each batch commits on its own, worklist refresh included, so a load that
+    fails halfway leaves consistent batches behind; file ingestion wraps the call to load a file
+    all or nothing.
+    """
+    batch_size = batch_size or settings.INGEST_BATCH_SIZE
+    model, _, code_field, name_field = INGEST_TARGETS[table_type]
+    fields = list(dict.fromkeys(field for _, field in columns))
+
+    inserted = skipped = line = 0
+    batch = []
+    for line, row in enumerate(rows, start=1):
+        if not any(str(value).strip() for value in row if value is not None):
+            # Exports are often padded with empty rows
+            continue
+        try:
+            instance = build_instance(model, columns, row, user)
+        except ValueError as e:
+            logger.warning(f"{source}: skipped data row {line}: {e}")
+            skipped += 1
+            continue
+        if not getattr(instance, code_field):
+            skipped += 1
+            continue
+        batch.append(instance)
+        if len(batch) >= batch_size:
+            written, gl_codes = _upsert_batch(model, batch, code_field, name_field, fields)
+            refresh_worklist(gl_codes)
+            inserted += written
+            batch = []
+            if progress:
+                progress(rows_read=line, rows_written=inserted, rows_skipped=skipped)
+    if batch:
+        written, gl_codes = _upsert_batch(model, batch, code_field, name_field, fields)
+        refresh_worklist(gl_codes)
+        inserted += written
+    if progress:
+        progress(rows_read=line, rows_written=inserted, rows_skipped=skipped)
+    return inserted, skipped
+
+
+def ingest_rows(uploaded_file, rows, batch_size=None):
+    """Map the header (the first row with a recognised GL column) and load the rows after it."""
+    _, header_map, code_field, _ = INGEST_TARGETS[uploaded_file.table_type]
+    for row in rows:
+        columns = map_headers(row, header_map)
+        if any(field == code_field for _, field in columns):
+            break
+    else:
+        raise IngestionError(f"No {code_field} column found in the file.")
+    return load_rows(
+        uploaded_file.table_type, uploaded_file.user, columns, rows, batch_size, source=f"Upload {uploaded_file.id}",
+    )
+
+
+def ingest_upload(uploaded_file):
+    """
+    Parse one claimed (status 'processing') UploadedFile into its table, all or nothing,
+    and mark it 'done' or 'failed'.
+    """
+    ext = os.path.splitext(uploaded_file.file_name or uploaded_file.file.name)[1].lower()
+    reader = ROW_READERS.get(ext)
+    try:
+        if reader is None:
+            raise IngestionError(f"{ext or 'This file type'} files can't be ingested; upload CSV or XLSX.")
+        if uploaded_file.table_type not in INGEST_TARGETS:
+            raise IngestionError(f"Unknown table type {uploaded_file.table_type!r}.")
+        with uploaded_file.file.storage.open(uploaded_file.file.name, 'rb') as fh:
+            with transaction.atomic():
+                inserted, skipped = ingest_rows(uploaded_file, iter(reader(fh)))
+    except Exception as e:
+        logger.exception(f"Ingestion of upload {uploaded_file.id} failed")
+        uploaded_file.status = 'failed'
+        uploaded_file.error = str(e)
+        uploaded_file.processed_at = timezone.now()
+        uploaded_file.save(update_fields=['status', 'error', 'processed_at'])
+        return False
+
+    gl_code_index.expire()
+    uploaded_file.status = 'done'
+    uploaded_file.rows_ingested = inserted
+    uploaded_file.error = f"{skipped} rows skipped" if skipped else ''
+    uploaded_file.processed_at = timezone.now()
+    uploaded_file.save(update_fields=['status', 'rows_ingested', 'error', 'processed_at'])
+    logger.info(f"Ingested upload {uploaded_file.id}: {inserted} rows, {skipped} skipped")
+    return True
+
+
+def claim_next_upload():
+    """
+    Move the oldest pending upload to 'processing' and return it; None when there is nothing to do.
+    Uploads left 'processing' by a worker that died are claimed again once INGEST_CLAIM_TIMEOUT_SECONDS
+    have passed, or marked failed after INGEST_MAX_ATTEMPTS claims.
+    """
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=settings.INGEST_CLAIM_TIMEOUT_SECONDS)
+    with transaction.atomic():
+        candidates = (
+            UploadedFile.objects
+            .select_for_update(skip_locked=True, of=('self',))
+            .select_related('user')
+            .filter(Q(status='pending') | Q(status='processing', claimed_at__lt=stale))
+            .order_by('uploaded_at')
+        )
+        while True:
+            uploaded_file = candidates.first()
+            if uploaded_file is None:
+                return None
+            if uploaded_file.status == 'processing':
+                logger.warning(f"Upload {uploaded_file.id} was left processing since {uploaded_file.claimed_at}")
+                if uploaded_file.attempts >= settings.INGEST_MAX_ATTEMPTS:
+                    uploaded_file.status = 'failed'
+                    uploaded_file.error = f"The ingestion worker stopped while processing this file {uploaded_file.attempts} times."
+                    uploaded_file.processed_at = now
+                    uploaded_file.save(update_fields=['status', 'error', 'processed_at'])
+                    continue
+            uploaded_file.status = 'processing'
+            uploaded_file.claimed_at = now
+            uploaded_file.attempts += 1
+            uploaded_file.save(update_fields=['status', 'claimed_at', 'attempts'])
+            return uploaded_file
+
+
+def ingest_pending(limit=None):
+    """Ingest pending uploads one after another. Returns (done, failed)."""
+    done = failed = 0
+    while limit is None or done + failed < limit:
+        uploaded_file = claim_next_upload()
+        if uploaded_file is None:
+            break
+        if ingest_upload(uploaded_file):
+            done += 1
+        else:
+            failed += 1
+    return done, failed
+
+
+def dedupe_natural_keys(dry_run=False):
+    """
+    Collapse rows loaded before the natural-key constraints existed: per (user, GL code, fiscal
+    year) the newest row is kept. Reviews and worklist entries of a dropped TrialBalance are moved
+    to the kept one. Run before migrating to the constraints. Returns {table_type: rows removed}.
+    """
+    removed = {}
+    with transaction.atomic():
+        for table_type, (model, _, code_field, _) in INGEST_TARGETS.items():
+            groups = (
+                model.objects.values('user_id', code_field, 'fiscal_year')
+                .annotate(n=Count('id')).filter(n__gt=1).order_by()
+            )
+            removed[table_type] = 0
+            for group in groups:
+                ids = list(
+                    model.objects.filter(
+                        user_id=group['user_id'], fiscal_year=group['fiscal_year'], **{code_field: group[code_field]},
+                    ).order_by('-added_at', '-id').values_list('id', flat=True)
+                )
+                keep, drop = ids[0], ids[1:]
+                removed[table_type] += len(drop)
+                if dry_run:
+                    continue
+                if model is TrialBalance:
+                    GLReview.objects.filter(trial_balance_id__in=drop).update(trial_balance_id=keep)
+                    GLWorklistEntry.objects.filter(trial_balance_id__in=drop).update(trial_balance_id=keep)
+                model.objects.filter(id__in=drop).delete()
+    return removed
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core_APP.models import GLAccount
+
+
+class Command(BaseCommand):
+    help = "Populate the GL account master from existing GL rows and link their gl_account foreign keys."
+
+    def handle(self, *args, **options):
+        linked = GLAccount.objects.backfill()
+        self.stdout.write(f"GL accounts: {GLAccount.objects.count()}")
+        for model_name, count in linked.items():
+            self.stdout.write(f"  {model_name}: {count} rows linked")
+        self.stdout.write(self.style.SUCCESS("GL account backfill complete."))
@@ -0,0 +1,59 @@
+import resource
+import tempfile
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core_APP.hana_standin import STANDIN_SOURCES, build_standin_table, connect, standin_mapping
+from core_APP.models import CustomUser
+from core_APP.modules.link_data.link_data_sap import import_sap_table
+
+
+BENCH_SCHEMA = "BENCH"
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux; it is the process high-water mark, so sizes are run smallest first
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Import generated tables of increasing size from the local HANA stand-in and report rows/sec "
+        "and peak RSS. Every import is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+        parser.add_argument("--table", choices=sorted(STANDIN_SOURCES), default="trial_balance")
+        parser.add_argument("--fetch-size", type=int, default=settings.SAP_FETCH_SIZE)
+        parser.add_argument("--batch-size", type=int, default=settings.INGEST_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        table_type = options["table"]
+        self.stdout.write(
+            f"{table_type}: fetch {options['fetch_size']}, batch {options['batch_size']}\n"
+            f"{'rows':>10} {'written':>10} {'seconds':>9} {'rows/sec':>10} {'peak RSS MB':>12}"
+        )
+        for count in sorted(options["rows"]):
+            with tempfile.TemporaryDirectory() as directory:
+                build_standin_table(BENCH_SCHEMA, table_type, count, directory)
+                conn = connect(directory=directory)
+                try:
+                    with transaction.atomic():
+                        user = CustomUser.objects.create_user(username=f"bench-{uuid.uuid4().hex[:12]}", user_type=4)
+                        started = time.perf_counter()
+                        written, skipped = import_sap_table(
+                            conn, BENCH_SCHEMA, table_type, standin_mapping(table_type), user,
+                            fetch_size=options["fetch_size"], batch_size=options["batch_size"],
+                        )
+                        elapsed = time.perf_counter() - started
+                        transaction.set_rollback(True)
+                finally:
+                    conn.close()
+            self.stdout.write(
+                f"{count:>10} {written:>10} {elapsed:>9.2f} {count / elapsed:>10.0f} {peak_rss_mb():>12.1f}"
+            )
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from core_APP.ingestion import dedupe_natural_keys
+
+
+class Command(BaseCommand):
+    help = (
+        "Remove duplicate TrialBalance / BalanceSheet rows (same user, GL code and fiscal year), "
+        "keeping the newest. Run before migrating to the natural-key constraints."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only count the duplicates.")
+
+    def handle(self, *args, **options):
+        removed = dedupe_natural_keys(dry_run=options["dry_run"])
+        verb = "Would remove" if options["dry_run"] else "Removed"
+        for table_type, count in removed.items():
+            self.stdout.write(f"  {table_type}: {verb.lower()} {count} duplicate rows")
+        self.stdout.write(self.style.SUCCESS(f"{verb} {sum(removed.values())} duplicate rows."))
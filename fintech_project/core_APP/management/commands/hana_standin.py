@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core_APP.hana_standin import STANDIN_SOURCES, build_standin_table
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the local SAP HANA stand-in tables from data/*.csv. Use them by setting "
+        "HANA_CONNECTION_FACTORY=core_APP.hana_standin.connect."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--schema", default="FINANCE", help="Schema (SAP link 'database') to create the tables in.")
+        parser.add_argument("--rows", type=int, default=10000, help="Rows per table.")
+        parser.add_argument("--tables", nargs="+", choices=sorted(STANDIN_SOURCES), default=sorted(STANDIN_SOURCES))
+        parser.add_argument("--dir", default=None, help=f"Stand-in directory (default {settings.HANA_STANDIN_DIR}).")
+
+    def handle(self, *args, **options):
+        for table_type in options["tables"]:
+            path = build_standin_table(options["schema"], table_type, options["rows"], options["dir"])
+            self.stdout.write(f"  {options['schema']}.{table_type.upper()}: {options['rows']} rows in {path}")
+        self.stdout.write(self.style.SUCCESS("HANA stand-in ready."))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core_APP.modules.link_data.link_data_chunked import purge_stale_uploads
+
+
+class Command(BaseCommand):
+    help = "Delete resumable uploads that were never completed, along with their part files."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours", type=int, default=settings.CHUNKED_UPLOAD_EXPIRY_HOURS,
+            help="Only purge uploads untouched for at least this many hours.",
+        )
+
+    def handle(self, *args, **options):
+        purged = purge_stale_uploads(options["hours"])
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} stale uploads."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core_APP.modules.gl_reviews.gl_reviews_worklist import refresh_worklist, rebuild_worklist
+
+
+class Command(BaseCommand):
+    help = "Backfill or repair the GL worklist read model from the source tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument("gl_codes", nargs="*", help="Only rebuild these GL codes (default: all)")
+
+    def handle(self, *args, **options):
+        if options["gl_codes"]:
+            written = refresh_worklist(options["gl_codes"])
+        else:
+            written = rebuild_worklist()
+        self.stdout.write(self.style.SUCCESS(f"GL worklist rebuilt: {written} entries."))
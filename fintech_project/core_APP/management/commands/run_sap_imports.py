@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core_APP.modules.link_data.link_data_sap_jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued SAP \"import all\" jobs, syncing each job's tables in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Keep polling instead of exiting once the queue is drained.")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds to sleep between polls with --loop.")
+
+    def handle(self, *args, **options):
+        total_done = total_failed = 0
+        while True:
+            done, failed = run_pending_jobs()
+            total_done += done
+            total_failed += failed
+            if done or failed:
+                self.stdout.write(f"Imported {done}, failed {failed}")
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+
+        self.stdout.write(self.style.SUCCESS(f"SAP import queue drained: {total_done} done, {total_failed} failed."))
@@ -0,0 +1,43 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core_APP.outbox import OutboxConnectionError, deliver_pending, retry_delay
+
+
+class Command(BaseCommand):
+    help = "Deliver queued outbox mail in batches over a single SMTP connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.EMAIL_OUTBOX_BATCH_SIZE)
+        parser.add_argument("--max-attempts", type=int, default=settings.EMAIL_OUTBOX_MAX_ATTEMPTS)
+        parser.add_argument("--loop", action="store_true", help="Keep polling instead of exiting once the queue is drained.")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds to sleep between polls with --loop.")
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        outages = 0
+        while True:
+            try:
+                sent, failed = deliver_pending(options["batch_size"], options["max_attempts"])
+            except OutboxConnectionError as e:
+                if not options["loop"]:
+                    raise CommandError(str(e))
+                # Keep the worker alive through a mail server outage, backing off between tries
+                outages += 1
+                delay = retry_delay(outages).total_seconds()
+                self.stderr.write(f"{e}; retrying in {delay:.0f}s")
+                time.sleep(delay)
+                continue
+            outages = 0
+            total_sent += sent
+            total_failed += failed
+            if sent or failed:
+                self.stdout.write(f"Sent {sent}, failed {failed}")
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+
+        self.stdout.write(self.style.SUCCESS(f"Outbox drained: {total_sent} sent, {total_failed} failed attempts."))
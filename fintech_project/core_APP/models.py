@@ -1,6 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
+from django.utils import timezone
 import uuid
 
 # Create your models here.
@@ -34,7 +35,186 @@ class Department(models.Model):
         return self.name
 
 
-class ResponsibilityMatrix(models.Model):
+class GLAccountManager(models.Manager):
+
+    def ids_for(self, gl_codes, names=None, overwrite_names=False):
+        """
+        ({gl_code: GLAccount.id}, renamed codes), creating accounts for codes that are not in the
+        master yet. `names` fill in accounts that have no name; with `overwrite_names` (the balance
+        sheet, whose names the GL pages display) they replace whatever name the account had.
+        The worklist rows of the renamed codes show the old name until they are refreshed.
+        """
+        names = names or {}
+        gl_codes = {code for code in gl_codes if code}
+        ids = {}
+        renamed = []
+        for account in self.filter(code__in=gl_codes).order_by('code').only('id', 'code', 'name'):
+            ids[account.code] = account.id
+            name = names.get(account.code)
+            if name and name != account.name and (overwrite_names or not account.name):
+                account.name = name
+                account.updated_at = timezone.now()
+                renamed.append(account)
+        missing = sorted(gl_codes - ids.keys())
+        # Short and in code order: concurrent imports touching the same accounts (trial balance
+        # and balance sheet share GL codes) wait on each other briefly instead of deadlocking
+        with transaction.atomic():
+            if renamed:
+                self.bulk_update(renamed, ['name', 'updated_at'])
+            if missing:
+                self.bulk_create(
+                    [self.model(code=code, name=names.get(code) or None) for code in missing],
+                    ignore_conflicts=True,
+                )
+        if missing:
+            ids.update(self.filter(code__in=missing).values_list('code', 'id'))
+        return ids, [account.code for account in renamed]
+
+    def names_for(self, gl_codes):
+        """{gl_code: name} in one indexed lookup."""
+        return dict(self.filter(code__in=gl_codes).values_list('code', 'name'))
+
+    def name_for(self, gl_code, default=None):
+        return self.filter(code=gl_code).values_list('name', flat=True).first() or default
+
+    def backfill(self):
+        """
+        Build the master from every gl_code seen in TrialBalance, BalanceSheet,
+        ResponsibilityMatrix and ReviewTrail, then point their gl_account FKs at it.
+        Names prefer the balance sheet (reco file) over trial balance and trail names: balance
+        sheet names replace existing ones, the others only fill in missing names.
+        Returns the number of rows linked per model.
+        """
+        names = {}
+        balance_sheet_codes = set()
+        sources = [
+            (ReviewTrail, 'gl_code', 'gl_name'),
+            (TrialBalance, 'gl_code', 'gl_name'),
+            (BalanceSheet, 'gl_acct', 'gl_account_name'),
+        ]
+        for model, code_field, name_field in sources:
+            rows = (
+                model.objects
+                .filter(**{f'{code_field}__isnull': False})
+                .exclude(**{name_field: ''})
+                .exclude(**{f'{name_field}__isnull': True})
+                .values_list(code_field, name_field)
+                .order_by(code_field, 'pk')
+            )
+            found = dict(reversed(list(rows)))
+            names.update(found)
+            if model is BalanceSheet:
+                balance_sheet_codes = found.keys()
+
+        codes = set(names)
+        for model, code_field in [
+            (TrialBalance, 'gl_code'),
+            (BalanceSheet, 'gl_acct'),
+            (ResponsibilityMatrix, 'gl_code'),
+            (ReviewTrail, 'gl_code'),
+        ]:
+            codes.update(model.objects.exclude(**{f'{code_field}__isnull': True}).values_list(code_field, flat=True).distinct())
+        codes.discard('')
+
+        self.ids_for(codes)
+        renamed = [
+            account for account in self.filter(code__in=names.keys())
+            if account.name != names[account.code] and (not account.name or account.code in balance_sheet_codes)
+        ]
+        for account in renamed:
+            account.name = names[account.code]
+            account.updated_at = timezone.now()
+        self.bulk_update(renamed, ['name', 'updated_at'], batch_size=1000)
+
+        linked = {}
+        for model, code_field in [
+            (TrialBalance, 'gl_code'),
+            (BalanceSheet, 'gl_acct'),
+            (ResponsibilityMatrix, 'gl_code'),
+            (ReviewTrail, 'gl_code'),
+        ]:
+            account_id = self.filter(code=models.OuterRef(code_field)).values('id')[:1]
+            linked[model.__name__] = (
+                model.objects
+                .filter(gl_account__isnull=True)
+                .exclude(**{f'{code_field}__isnull': True})
+                .update(gl_account=models.Subquery(account_id))
+            )
+        return linked
+
+
+class GLAccount(models.Model):
+    """GL account master: one row per gl_code, referenced by integer key from the GL tables."""
+    code = models.CharField(max_length=50, unique=True)
+    name = models.CharField(max_length=255, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped on every rename too (bulk_update skips auto_now, so the manager sets it there)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = GLAccountManager()
+
+    class Meta:
+        db_table = 'gl_accounts'
+        ordering = ['code']
+        indexes = [
+            models.Index(fields=['updated_at'], name='gl_account_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.code} - {self.name or 'N/A'}"
+
+
+class GLAccountLinkMixin:
+    """
+    Keeps the gl_account FK in step with the model's gl_code string on save(). The master is
+    only consulted when the code (or, for the model whose names win, the name) has changed
+    since the row was loaded.
+    """
+    gl_code_field = 'gl_code'
+    gl_name_field = None
+    # This model's names replace the account's name rather than only filling in a missing one
+    gl_name_authoritative = False
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_gl = instance._gl_code_and_name()
+        return instance
+
+    def _gl_code_and_name(self):
+        # __dict__ so deferred fields aren't fetched
+        return (
+            self.__dict__.get(self.gl_code_field),
+            self.__dict__.get(self.gl_name_field) if self.gl_name_field else None,
+        )
+
+    def save(self, *args, **kwargs):
+        gl_code, name = self._gl_code_and_name()
+        loaded_code, loaded_name = getattr(self, '_loaded_gl', (None, None))
+        unchanged = (
+            self.gl_account_id and gl_code == loaded_code
+            and (not self.gl_name_authoritative or name == loaded_name)
+        )
+        renamed = []
+        if not gl_code:
+            self.gl_account_id = None
+        elif not unchanged:
+            ids, renamed = GLAccount.objects.ids_for(
+                [gl_code], {gl_code: name}, overwrite_names=self.gl_name_authoritative,
+            )
+            self.gl_account_id = ids[gl_code]
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and self.gl_code_field in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'gl_account'}
+        super().save(*args, **kwargs)
+        self._loaded_gl = (gl_code, name)
+        if renamed:
+            # Imported here: the worklist module imports these models
+            from core_APP.modules.gl_reviews.gl_reviews_worklist import refresh_worklist
+            refresh_worklist(renamed)
+
+
+class ResponsibilityMatrix(GLAccountLinkMixin, models.Model):
 
     USER_ROLE_CHOICES = (
         (2, 'Department Head'),
@@ -59,6 +239,7 @@ class ResponsibilityMatrix(models.Model):
     user_role = models.PositiveSmallIntegerField(choices=USER_ROLE_CHOICES, default=5)
 
     gl_code = models.CharField(max_length=50, null=True, blank=True)
+    gl_account = models.ForeignKey(GLAccount, on_delete=models.SET_NULL, null=True, blank=True, related_name="responsibilities")
     gl_code_status = models.PositiveSmallIntegerField(choices=GL_CODE_STATUS_CHOICES, null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
@@ -67,11 +248,60 @@ class ResponsibilityMatrix(models.Model):
         db_table = "responsibility_matrix"
         unique_together = ("user", "gl_code")
         ordering = ["user", "gl_code"]
+        indexes = [
+            models.Index(fields=["gl_code", "user_role"], name="rm_gl_code_role_idx"),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.gl_code}"
 
 
+class GLWorklistEntry(models.Model):
+    """
+    Read model behind the GL review pages: one row per ResponsibilityMatrix assignment with the
+    per-GL state those pages show, kept current by refresh_worklist() in the same transaction as
+    every write that changes it. `manage.py rebuild_worklist` rebuilds it from the source tables.
+    """
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="worklist_entries")
+    assignment = models.OneToOneField(ResponsibilityMatrix, on_delete=models.CASCADE, related_name="worklist_entry")
+    gl_code = models.CharField(max_length=50)
+    gl_name = models.CharField(max_length=255, null=True, blank=True)
+    department_name = models.CharField(max_length=255, null=True, blank=True)
+    user_role = models.PositiveSmallIntegerField(choices=ResponsibilityMatrix.USER_ROLE_CHOICES)
+
+    status_code = models.PositiveSmallIntegerField(default=1)
+    status_text = models.CharField(max_length=100, blank=True, default='')
+    fc_status = models.PositiveSmallIntegerField(default=1)
+    reviewer_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    preparer_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    is_actionable = models.BooleanField(default=False)
+    # 0 actionable, 1 decided by Tower Head, 2 everything else
+    sort_bucket = models.PositiveSmallIntegerField(default=2)
+
+    trial_balance_id = models.UUIDField(null=True, blank=True)
+    gl_review_id = models.UUIDField(null=True, blank=True)
+    reconciliation_notes = models.TextField(null=True, blank=True)
+    supporting_documents = models.JSONField(default=list)
+    document_count = models.PositiveIntegerField(default=0)
+
+    assigned_on = models.DateTimeField()
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "gl_worklist_entries"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "gl_code"], name="worklist_user_gl_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "user_role", "sort_bucket", "assigned_on"], name="worklist_user_queue_idx"),
+            models.Index(fields=["gl_code"], name="worklist_gl_code_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.gl_code} ({self.status_text})"
+
+
 class Conversation(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='conversations')
@@ -128,6 +358,24 @@ class LinkedData(models.Model):
         ordering = ['-linked_at']
 
 
+class StoredBlob(models.Model):
+    """
+    One stored copy of an uploaded file's bytes, keyed by their SHA-256.
+    Shared by every UploadedFile / GLSupportingDocument with the same content; ref_count counts them.
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    file = models.FileField(upload_to='blobs/', max_length=255)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'stored_blobs'
+
+    def __str__(self):
+        return f"{self.sha256} ({self.ref_count} refs)"
+
+
 class UploadedFile(models.Model):
     TABLE_TYPE_CHOICES = [
         ("trial_balance", "Trial Balance"),
@@ -135,9 +383,20 @@ class UploadedFile(models.Model):
     ]
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='uploaded_files')
-    file = models.FileField(upload_to='uploads/')
+    file = models.FileField(upload_to='uploads/', max_length=255)
+    # Content-addressed uploads point `file` at the blob's copy; file_name keeps the name it was uploaded as
+    blob = models.ForeignKey(StoredBlob, on_delete=models.PROTECT, related_name='uploaded_files', null=True, blank=True)
+    file_name = models.CharField(max_length=255, blank=True, default='')
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # pending -> processing -> done / failed, driven by `manage.py ingest_uploads`
     status = models.CharField(max_length=20, default='pending')
+    # When a worker last claimed it, and how many times; 'processing' past INGEST_CLAIM_TIMEOUT_SECONDS
+    # means that worker died (OOM, deploy) and the file is queued again
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    rows_ingested = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    processed_at = models.DateTimeField(null=True, blank=True)
 
     table_type = models.CharField(
         max_length=50,
@@ -147,6 +406,36 @@ class UploadedFile(models.Model):
     class Meta:
         db_table = 'uploaded_files'
         ordering = ['-uploaded_at']
+        indexes = [
+            models.Index(fields=['status', 'uploaded_at'], name='uploaded_file_queue_idx'),
+        ]
+
+
+class ChunkedUpload(models.Model):
+    """
+    A resumable upload in progress. Chunks are appended to a part file under CHUNKED_UPLOAD_DIR
+    and `received` is the last confirmed offset; completing it creates the UploadedFile.
+    """
+    STATUS_CHOICES = [
+        ("uploading", "Uploading"),
+        ("complete", "Complete"),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chunked_uploads')
+    file_name = models.CharField(max_length=255)
+    table_type = models.CharField(max_length=50, choices=UploadedFile.TABLE_TYPE_CHOICES)
+    total_size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="uploading")
+    uploaded_file = models.OneToOneField(UploadedFile, on_delete=models.SET_NULL, related_name='chunked_upload', null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'chunked_uploads'
+        indexes = [
+            models.Index(fields=['status', 'updated_at'], name='chunked_upload_status_idx'),
+        ]
 
 
 class SAPLink(models.Model):
@@ -214,6 +503,72 @@ class SAPLink(models.Model):
         super().save(*args, **kwargs)
 
 
+class SapImportJob(models.Model):
+    """One "import all" run over a SAP link's connected tables, picked up by `manage.py run_sap_imports`."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    saplink = models.ForeignKey(SAPLink, on_delete=models.CASCADE, related_name='import_jobs')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sap_import_jobs')
+    tables = models.JSONField(default=list)
+    # Re-read whole tables instead of only the rows past their watermarks
+    full = models.BooleanField(default=False)
+    # queued -> running -> done / failed; per-table progress lives in saplink.status["sync"]
+    status = models.CharField(max_length=20, default='queued')
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Set on every claim; 'running' past SAP_IMPORT_JOB_TIMEOUT_SECONDS means the worker died
+    started_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'sap_import_jobs'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='sap_import_job_queue_idx'),
+        ]
+
+
+class OutboundEmail(models.Model):
+    """Mail queued by request handlers and delivered by `manage.py send_outbox`."""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+        ('digested', 'Merged into digest'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, null=True, blank=True)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # When a worker took it to 'sending'; an expired claim means the worker died mid-batch
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    # Digest notifications: held until next_attempt_at, then folded into one mail per recipient
+    digest_key = models.CharField(max_length=255, null=True, blank=True)
+    gl_code = models.CharField(max_length=50, null=True, blank=True)
+    gl_action = models.CharField(max_length=100, null=True, blank=True)
+
+    class Meta:
+        db_table = 'email_outbox'
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_next_idx'),
+            models.Index(fields=['digest_key', 'status'], name='outbox_digest_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)} ({self.status})"
+
+
 # TIME TO BUILD UNIFIED DBs, MOTHERFUC--
 
 # CustomUser (Dept Head)
@@ -249,8 +604,9 @@ class SAPLink(models.Model):
 #            Frontend
 
 
-class TrialBalance(models.Model):
+class TrialBalance(GLAccountLinkMixin, models.Model):
     """Simplified, realistic Trial Balance model aligned with your SAP HANA schema."""
+    gl_name_field = 'gl_name'
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(
@@ -261,6 +617,7 @@ class TrialBalance(models.Model):
 
     # --- GL Information ---
     gl_code = models.CharField(max_length=50)
+    gl_account = models.ForeignKey(GLAccount, on_delete=models.SET_NULL, null=True, blank=True, related_name="trial_balances")
     gl_name = models.CharField(max_length=255, null=True, blank=True)
     group_gl_code = models.CharField(max_length=50, null=True, blank=True)
     group_gl_name = models.CharField(max_length=255, null=True, blank=True)
@@ -284,13 +641,28 @@ class TrialBalance(models.Model):
     class Meta:
         db_table = "trial_balances"
         ordering = ["-added_at"]
+        indexes = [
+            models.Index(fields=["gl_code", "user"], name="tb_gl_code_user_idx"),
+        ]
+        constraints = [
+            # One row per GL and period; ingestion upserts on this key
+            models.UniqueConstraint(fields=["user", "gl_code", "fiscal_year"], name="tb_user_gl_year_uniq"),
+            # NULLs never collide in a unique index, so rows without a fiscal year need their own
+            models.UniqueConstraint(
+                fields=["user", "gl_code"], condition=models.Q(fiscal_year__isnull=True), name="tb_user_gl_no_year_uniq",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.gl_code} - {self.gl_name} ({self.fs_main_head or 'Uncategorized'})"
     
 
-class BalanceSheet(models.Model):
+class BalanceSheet(GLAccountLinkMixin, models.Model):
     """Simplified, realistic Balance Sheet model aligned with your SAP HANA schema."""
+    gl_code_field = 'gl_acct'
+    gl_name_field = 'gl_account_name'
+    gl_name_authoritative = True
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -300,6 +672,7 @@ class BalanceSheet(models.Model):
     BS_PL = models.CharField(max_length=10, null=True, blank=True)
     status = models.CharField(max_length=50, null=True, blank=True)
     gl_acct = models.CharField(max_length=20)
+    gl_account = models.ForeignKey(GLAccount, on_delete=models.SET_NULL, null=True, blank=True, related_name="balance_sheets")
     gl_account_name = models.CharField(max_length=100, null=True, blank=True)
     main_head = models.CharField(max_length=100, null=True, blank=True)
     sub_head = models.CharField(max_length=100, null=True, blank=True)
@@ -326,6 +699,18 @@ class BalanceSheet(models.Model):
 
     class Meta:
         db_table = 'balance_sheet'
+        indexes = [
+            models.Index(fields=["gl_acct"], name="bs_gl_acct_idx"),
+            models.Index(fields=["responsible_department", "gl_acct"], name="bs_dept_gl_acct_idx"),
+            # Tier 3 grid default order (newest first), keyset on (added_at, id)
+            models.Index(fields=["user", "added_at", "id"], name="bs_user_added_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["user", "gl_acct", "fiscal_year"], name="bs_user_gl_year_uniq"),
+            models.UniqueConstraint(
+                fields=["user", "gl_acct"], condition=models.Q(fiscal_year__isnull=True), name="bs_user_gl_no_year_uniq",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.BS_PL} - {self.gl_acct} ({self.status})"
@@ -349,6 +734,9 @@ class GLReview(models.Model):
     class Meta:
         db_table = "gl_reviews"
         ordering = ["-reviewed_at"]
+        indexes = [
+            models.Index(fields=["trial_balance", "reviewer"], name="glr_tb_reviewer_idx"),
+        ]
 
     def __str__(self):
         return f"{self.trial_balance.gl_code} - {self.status}"
@@ -357,7 +745,9 @@ class GLReview(models.Model):
 class GLSupportingDocument(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     gl_review = models.ForeignKey(GLReview, on_delete=models.CASCADE, related_name="supporting_documents", null=True, blank=True)
-    file = models.FileField(upload_to="gl_supporting/")
+    file = models.FileField(upload_to="gl_supporting/", max_length=255)
+    blob = models.ForeignKey(StoredBlob, on_delete=models.PROTECT, related_name="gl_documents", null=True, blank=True)
+    file_name = models.CharField(max_length=255, blank=True, default="")
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -368,7 +758,9 @@ class GLSupportingDocument(models.Model):
         return f"Support for {self.trial_balance.gl_code}"
 
 
-class ReviewTrail(models.Model):
+class ReviewTrail(GLAccountLinkMixin, models.Model):
+    gl_name_field = 'gl_name'
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     reviewer = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -397,6 +789,7 @@ class ReviewTrail(models.Model):
     )
 
     gl_code = models.CharField(max_length=50, null=True, blank=True)
+    gl_account = models.ForeignKey(GLAccount, on_delete=models.SET_NULL, null=True, blank=True, related_name="review_trails")
     gl_name = models.CharField(max_length=255, null=True, blank=True)
     reconciliation_notes = models.TextField(null=True, blank=True)
 
@@ -412,3 +805,7 @@ class ReviewTrail(models.Model):
     class Meta:
         db_table = "review_trails"
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["gl_review", "created_at"], name="rt_review_created_idx"),
+            models.Index(fields=["gl_code", "created_at"], name="rt_gl_code_created_idx"),
+        ]
@@ -2,14 +2,29 @@ from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.db import transaction
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import condition, require_http_methods
 import logging
-from core_APP.models import BalanceSheet, ResponsibilityMatrix, TrialBalance, GLReview, GLSupportingDocument,   ReviewTrail
+from core_APP.models import BalanceSheet, GLAccount, ResponsibilityMatrix, TrialBalance, GLReview, GLSupportingDocument,   ReviewTrail
 from django.utils import timezone
 from django.conf import settings
-from django.core.mail import send_mail
+from core_APP.outbox import enqueue_notification
+from core_APP.blob_store import release_blob, store_blob, upload_digest
+from core_APP.protected_media import serve_protected
+from core_APP.gl_index import gl_code_index
 from core_APP.models import GLReview
-from django.http import JsonResponse
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, JsonResponse
+from .gl_reviews_worklist import (
+    build_user_gl_worklist, gl_queue_page, refresh_worklist, worklist_queryset, worklist_row,
+)
+from .gl_reviews_assignments import reconcile_tower_assignments, reconcile_bufc_assignments
+from .gl_reviews_workflow import apply_transition
+from .gl_reviews_balance_sheet import (
+    BS_GRID_COLUMNS, BS_GRID_FILTERS, balance_sheet_page, balance_sheet_queryset, balance_sheet_stats,
+)
+from .gl_reviews_trails import (
+    invalidate_trail_gl_codes, summarize_trails, trail_etag, trail_gl_codes, trail_last_modified, trail_page_etag,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -23,102 +38,7 @@ def gl_reviews_view(request):
     # USER TYPE 4: Preparer/Reviewer
     # -------------------------------
     if request.user.user_type == 4:
-        # Get Preparer GLs (user_role = 4)
-        preparer_assignments = ResponsibilityMatrix.objects.filter(
-            user=request.user,
-            gl_code__isnull=False,
-            user_role=4
-        ).select_related('department').order_by('gl_code')
-
-        # Get Reviewer GLs (user_role = 5)
-        reviewer_assignments = ResponsibilityMatrix.objects.filter(
-            user=request.user,
-            gl_code__isnull=False,
-            user_role=5
-        ).select_related('department').order_by('gl_code')
-
-        def prepare_gl_data(assignments, is_preparer=False):
-            """Helper to prepare GL data with linked reviews and documents."""
-            gl_data = []
-            for assignment in assignments:
-                balance_sheet = BalanceSheet.objects.filter(gl_acct=assignment.gl_code).first()
-
-                if is_preparer:
-                    trial_balance = TrialBalance.objects.filter(
-                        user=request.user,
-                        gl_code=assignment.gl_code
-                    ).first()
-                else:
-                    trial_balance = TrialBalance.objects.filter(gl_code=assignment.gl_code).first()
-
-                gl_review = None
-                supporting_docs = []
-                if trial_balance:
-                    if is_preparer:
-                        gl_review = GLReview.objects.filter(
-                            trial_balance=trial_balance,
-                            reviewer=request.user
-                        ).first()
-                    else:
-                        gl_review = GLReview.objects.filter(trial_balance=trial_balance).first()
-
-                    if gl_review:
-                        supporting_docs = GLSupportingDocument.objects.filter(
-                            gl_review=gl_review
-                        ).order_by('-uploaded_at')
-
-                status_code = assignment.gl_code_status or 1
-                status_display = assignment.get_gl_code_status_display() if assignment.gl_code_status else 'Pending'
-
-                # if gl_review:
-                #    status_code = gl_review.status
-                #    status_display = gl_review.get_status_display()
-
-                assigned_on = assignment.created_at
-                assigned_on_formatted = assigned_on.strftime("%B %d, %Y at %I:%M %p") if assigned_on else 'N/A'
-
-                gl_code = assignment.gl_code
-                trial_bal_field = TrialBalance.objects.filter(gl_code=gl_code).first()
-                gl_rev = GLReview.objects.filter(trial_balance=trial_bal_field).first()
-
-                preparer_assignment_status = None
-                if not is_preparer:
-                    # if reviewer, there has to be a preparer assignment
-                    preparer_assignment = ResponsibilityMatrix.objects.filter(
-                        gl_code=assignment.gl_code,
-                        user_role=4
-                    ).first()
-                    if preparer_assignment:
-                        preparer_assignment_status = preparer_assignment.gl_code_status
-
-                gl_data.append({
-                    'assignment_id': str(assignment.id),
-                    'gl_code': assignment.gl_code,
-                    'gl_name': balance_sheet.gl_account_name if balance_sheet else 'N/A',
-                    'department': assignment.department.name if assignment.department else 'N/A',
-                    'user_role': assignment.get_user_role_display(),
-                    'status': status_display,
-                    'status_code': status_code,
-                    'assigned_on': assigned_on_formatted,
-                    'assigned_on_datetime': assigned_on,
-                    'reconciliation_notes': gl_rev.reconciliation_notes if gl_review else 'N/A',
-                    'trial_balance_id': str(trial_balance.id) if trial_balance else None,
-                    'gl_review_id': str(gl_review.id) if gl_review else None,
-                    'supporting_documents': [
-                        {
-                            'id': str(doc.id),
-                            'file_name': doc.file.name.split('/')[-1] if doc.file else 'Unknown',
-                            'file_url': doc.file.url if doc.file else '#',
-                            'uploaded_at': doc.uploaded_at.strftime("%B %d, %Y at %I:%M %p") if doc.uploaded_at else 'N/A',
-                        }
-                        for doc in supporting_docs
-                    ],
-                    'preparer_assignment_status': preparer_assignment_status,
-                })
-            return gl_data
-
-        preparer_gls = prepare_gl_data(preparer_assignments, is_preparer=True)
-        reviewer_gls = prepare_gl_data(reviewer_assignments, is_preparer=False)
+        preparer_gls, reviewer_gls = build_user_gl_worklist(request.user)
 
         return render(
             request,
@@ -131,120 +51,10 @@ def gl_reviews_view(request):
     # -------------------------------
     if request.user.user_type == 2:
         # Init Tower Head ResponsibilityMatrix rows
-        main_tower_assignment = ResponsibilityMatrix.objects.filter(
-            user_role=2
-        ).select_related('department').first()
-
-        gl_reviews_qs = GLReview.objects.all().select_related('trial_balance', 'trial_balance__user').order_by('-reviewed_at')
-
-        for review in gl_reviews_qs:
-            trial_balance = review.trial_balance
-            assignment = ResponsibilityMatrix.objects.filter(
-                user=request.user,
-                gl_code=trial_balance.gl_code
-            )
-            if not assignment.exists():
-                if main_tower_assignment.gl_code:
-                     # create new assignment
-                     print("CREATING NEW TOWER ASSIGNMENT")
-                     new_tower_assignment = ResponsibilityMatrix.objects.create(
-                        user=request.user,
-                        gl_code=trial_balance.gl_code,
-                        gl_code_status=1,
-                        department=main_tower_assignment.department,
-                        user_role=2
-                     )
-                     new_tower_assignment.save()
-                else:
-                    print("MAIN TOWER HAS NO GL CODE, ASSIGNING TO SELF")
-                    main_tower_assignment.gl_code = trial_balance.gl_code
-                    main_tower_assignment.gl_code_status = 1
-                    main_tower_assignment.save()
-
-        # Get Tower Head Assignments
-        tower_assignments = ResponsibilityMatrix.objects.filter(
-            user=request.user,
-            user_role=2,
-            gl_code__isnull=False
-        ).select_related('department').order_by('-created_at')
-
-        gl_reviews = []
-
-        for assignment in tower_assignments:
-            trial_balance = TrialBalance.objects.filter(
-                gl_code=assignment.gl_code
-            ).first()
-
-            gl_review = GLReview.objects.filter(
-                trial_balance=trial_balance
-            ).first() if trial_balance else None
-
-            balance_sheet = BalanceSheet.objects.filter(
-                gl_acct=assignment.gl_code
-            ).first()
-
-            supporting_docs = GLSupportingDocument.objects.filter(
-                gl_review=gl_review
-            ).order_by('-uploaded_at') if gl_review else []
-
-            fc_assignment = ResponsibilityMatrix.objects.filter(
-                gl_code=assignment.gl_code,
-                user_role=3
-            ).first()
-
-            fc_status = fc_assignment.gl_code_status if fc_assignment else 1
-            
-            # Actionable if FC Status is 'Approved by FC' (5)
-            is_actionable = (fc_status == 3)
-            
-            last_status_text = ""
-            if gl_review.reviewer.user_type == 4:
-                # could be preparer/reviewer
-                print("GL CODE: ", assignment.gl_code)
-                reviewer_assignment = ResponsibilityMatrix.objects.filter(
-                    gl_code=trial_balance.gl_code,
-                    user_role=5
-                ).first()
-                if reviewer_assignment:
-                    if reviewer_assignment.gl_code_status == 4:
-                        last_status_text = "GL Review-I (Preparer)"
-                    else:
-                        last_status_text = "GL Review-II (Reviewer)"
-                else:
-                    last_status_text = "GL Review-I (Preparer)"
-            else:
-                last_status_text = "GL Review-III (Finance Controller)"
-
-            gl_reviews.append({
-                'assignment_id': str(assignment.id),
-                'gl_code': assignment.gl_code,
-                'gl_name': balance_sheet.gl_account_name if balance_sheet else 'N/A',
-                'department': assignment.department.name if assignment.department else 'N/A',
-                'fc_status': fc_status,
-                'status': last_status_text,
-                'status_code': assignment.gl_code_status or 1,
-                'assigned_on': assignment.created_at.strftime("%B %d, %Y at %I:%M %p"),
-                'reconciliation_notes': gl_review.reconciliation_notes if gl_review else 'N/A',
-                'supporting_documents': [
-                    {
-                        'id': str(doc.id),
-                        'file_name': doc.file.name.split('/')[-1],
-                        'file_url': doc.file.url,
-                        'uploaded_at': doc.uploaded_at.strftime("%B %d, %Y at %I:%M %p"),
-                    }
-                    for doc in supporting_docs
-                ],
-                'is_actionable': is_actionable
-            })
-        
-        def tower_sort_key(x):
-            if x['is_actionable']:
-                return 0
-            if x['status_code'] in (7, 8):
-                return 1
-            return 2
+        reconcile_tower_assignments(request.user)
 
-        gl_reviews.sort(key=tower_sort_key)
+        # Actionable first, then Tower Head decisions, then the rest
+        gl_reviews = [worklist_row(entry) for entry in worklist_queryset(request.user)]
 
         return render(request, 'gl_reviews/gl_reviews_t1.html', {'gl_reviews': gl_reviews})
 
@@ -253,102 +63,10 @@ def gl_reviews_view(request):
     # USER TYPE 3: FC
     # -------------------------------
     if request.user.user_type == 3:
-        # Init UBFC ResponsibilityMatrix rows
-        main_ubfc_assignment = ResponsibilityMatrix.objects.filter(
-            user_role=3
-        ).select_related('department').first()
+        # Init UBFC ResponsibilityMatrix rows, reset to pending after Reviewer approves the GL Review
+        reconcile_bufc_assignments(request.user)
 
-        gl_reviews_qs = GLReview.objects.filter(
-            reviewer=request.user
-        ).select_related('trial_balance', 'trial_balance__user').order_by('-reviewed_at')
-
-        for review in gl_reviews_qs:
-            trial_balance = review.trial_balance
-            assignment = ResponsibilityMatrix.objects.filter(
-                user=request.user,
-                gl_code=trial_balance.gl_code
-            )
-            if not assignment.exists():
-                # there will always be a ubfc_assignment (blank one created early on)
-                if main_ubfc_assignment.gl_code:
-                    # create new assignment
-                    print("CREATING NEW UBFC ASSIGNMENT")
-                    new_ubfc_assignment = ResponsibilityMatrix.objects.create(
-                        user=request.user,
-                        gl_code=trial_balance.gl_code,
-                        gl_code_status=1,
-                        department=main_ubfc_assignment.department,
-                        user_role=3
-                    )
-                    new_ubfc_assignment.save()
-                else:
-                    print("MAIN UBFC HAS NO GL CODE, ASSIGNING TO SELF")
-                    main_ubfc_assignment.gl_code = trial_balance.gl_code
-                    main_ubfc_assignment.gl_code_status = 1
-                    main_ubfc_assignment.save()
-
-            refetch_bufc_assignment = ResponsibilityMatrix.objects.filter(
-                user=request.user,
-                gl_code=trial_balance.gl_code
-            ).first()
-            reviewer_assignment = ResponsibilityMatrix.objects.filter(
-                gl_code=trial_balance.gl_code,
-                user_role=5
-            ).first()
-            if reviewer_assignment.gl_code_status == 3:
-                refetch_bufc_assignment.gl_code_status = 1 # reset to pending after Reviewer approves the GL Review
-                refetch_bufc_assignment.save()
-            print(f"GL CODE: {trial_balance.gl_code}, BUFC STATUS: {refetch_bufc_assignment.gl_code_status}, REVIEWER STATUS: {reviewer_assignment.gl_code_status}")
-
-        ubfc_assignments = ResponsibilityMatrix.objects.filter(
-            user=request.user,
-            gl_code__isnull=False
-        ).select_related('department').order_by('-created_at')
-
-        gl_reviews = []
-
-        for assignment in ubfc_assignments:
-            trial_balance = TrialBalance.objects.filter(
-                gl_code=assignment.gl_code
-            ).first()
-
-            gl_review = GLReview.objects.filter(
-                trial_balance=trial_balance
-            ).first() if trial_balance else None
-
-            balance_sheet = BalanceSheet.objects.filter(
-                gl_acct=assignment.gl_code
-            ).first()
-
-            supporting_docs = GLSupportingDocument.objects.filter(
-                gl_review=gl_review
-            ).order_by('-uploaded_at') if gl_review else []
-
-            reviewer_assignment = ResponsibilityMatrix.objects.filter(
-                gl_code=assignment.gl_code,
-                user_role=5
-            ).first()
-
-            gl_reviews.append({
-                'assignment_id': str(assignment.id),
-                'gl_code': assignment.gl_code,
-                'gl_name': balance_sheet.gl_account_name if balance_sheet else 'N/A',
-                'department': assignment.department.name if assignment.department else 'N/A',
-                'reviewer_assignment_status': reviewer_assignment.gl_code_status if reviewer_assignment else None,
-                'status': assignment.get_gl_code_status_display(),
-                'status_code': assignment.gl_code_status or 1,
-                'assigned_on': assignment.created_at.strftime("%B %d, %Y at %I:%M %p"),
-                'reconciliation_notes': gl_review.reconciliation_notes if gl_review else 'N/A',
-                'supporting_documents': [
-                    {
-                        'id': str(doc.id),
-                        'file_name': doc.file.name.split('/')[-1],
-                        'file_url': doc.file.url,
-                        'uploaded_at': doc.uploaded_at.strftime("%B %d, %Y at %I:%M %p"),
-                    }
-                    for doc in supporting_docs
-                ],
-            })
+        gl_reviews = [worklist_row(entry) for entry in worklist_queryset(request.user)]
 
         print(f"[INFO] {request.user} — GL Reviews fetched: {len(gl_reviews)}")
 
@@ -362,8 +80,13 @@ def remove_gl_supporting_document(request, document_id):
         return redirect("gl_reviews_page")
     
     try:
-        document = GLSupportingDocument.objects.get(id=document_id)
-        document.delete()
+        document = GLSupportingDocument.objects.select_related('gl_review__trial_balance').get(id=document_id)
+        with transaction.atomic():
+            document.delete()
+            # The stored bytes go only once no other document or upload shares them
+            release_blob(document.blob_id)
+            if document.gl_review:
+                refresh_worklist([document.gl_review.trial_balance.gl_code])
         messages.success(request, "Document removed successfully.")
     except GLSupportingDocument.DoesNotExist:
         logger.error(request, "Document not found.")
@@ -371,6 +94,21 @@ def remove_gl_supporting_document(request, document_id):
     return redirect("gl_reviews_page")
 
 
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def download_gl_supporting_document(request, document_id):
+    """Supporting document download for users with a ResponsibilityMatrix row on the document's GL."""
+    document = GLSupportingDocument.objects.select_related('gl_review__trial_balance').filter(id=document_id).first()
+    if not document or not document.file or not document.gl_review:
+        raise Http404("Document not found.")
+
+    gl_code = document.gl_review.trial_balance.gl_code
+    if not (request.user.is_superuser or ResponsibilityMatrix.objects.filter(user=request.user, gl_code=gl_code).exists()):
+        raise PermissionDenied("You do not have access to documents for this GL.")
+
+    return serve_protected(request, document.file, document.file_name or document.file.name.split('/')[-1])
+
+
 @login_required
 def upload_gl_supporting_document(request):
     """Upload a supporting document for a GL review (Preparer only)."""
@@ -406,11 +144,10 @@ def upload_gl_supporting_document(request):
         ).first()
         
         if not trial_balance:
-            balance_sheet = BalanceSheet.objects.filter(gl_acct=gl_code).first()
             trial_balance = TrialBalance.objects.create(
                 user=request.user,
                 gl_code=gl_code,
-                gl_name=balance_sheet.gl_account_name if balance_sheet else '',
+                gl_name=GLAccount.objects.name_for(gl_code, default=''),
                 amount=0,
             )
         
@@ -430,10 +167,14 @@ def upload_gl_supporting_document(request):
         
         # Create GLSupportingDocument
         with transaction.atomic():
+            blob = store_blob(uploaded_file, upload_digest(request, 'supporting_document', uploaded_file))
             GLSupportingDocument.objects.create(
                 gl_review=gl_review,
-                file=uploaded_file,
+                blob=blob,
+                file=blob.file.name,
+                file_name=uploaded_file.name,
             )
+            refresh_worklist([gl_code])
         
         messages.success(request, f"Supporting document uploaded successfully for GL Code {gl_code}.")
         
@@ -482,7 +223,7 @@ def submit_gl_review_preparer(request):
             trial_balance = TrialBalance.objects.create(
                 user=request.user,
                 gl_code=gl_code,
-                gl_name=BalanceSheet.objects.filter(gl_acct=gl_code).values_list('gl_account_name', flat=True).first() or '',
+                gl_name=GLAccount.objects.name_for(gl_code, default=''),
                 amount=0,
             )
         
@@ -519,11 +260,14 @@ def submit_gl_review_preparer(request):
                 gl_review=gl_review,
                 previous_trail=None,
                 gl_code=gl_code,
-                gl_name=BalanceSheet.objects.filter(gl_acct=gl_code).values_list('gl_account_name', flat=True).first() or '',
+                gl_name=GLAccount.objects.name_for(gl_code, default=''),
                 reconciliation_notes=reconciliation_notes,
                 action='Submitted'
             )
             review_trail.save()
+            invalidate_trail_gl_codes()
+
+            refresh_worklist([gl_code])
         
         messages.success(
             request,
@@ -550,126 +294,46 @@ def submit_gl_review_reviewer(request):
     reconciliation_notes = request.POST.get("reconciliation_notes")
     action = request.POST.get("action")  # either 'approve' or 'reject'
 
-    
     if not assignment_id or not gl_code:
         messages.error(request, "Missing required information.")
         return redirect("gl_reviews_page")
-    
+
     if not reconciliation_notes:
         messages.error(request, "Reconciliation notes are required.")
         return redirect("gl_reviews_page")
-    
-    trial_balance = TrialBalance.objects.filter(
-        gl_code=gl_code
-    ).first()
-    if not trial_balance:
-        print("TRIAL BALANCE NOT FOUND")
-        messages.error(request, "Trial balance not found.")
-        return redirect("gl_reviews_page")
-    print("FOUND TRIAL BALANCE:", trial_balance.id)
-    
-    gl_review = GLReview.objects.filter(
-        trial_balance=trial_balance,
-    ).first()
 
-    if not gl_review:
-        print("GL REVIEW NOT FOUND")
-        messages.error(request, "GL review not found.")
+    action = 'approve' if action == 'approve' else 'reject'
+    result = apply_transition(request.user, 'reviewer', action, [assignment_id], reconciliation_notes, gl_code=gl_code)
+    if not result.processed:
+        _, reason = result.skipped[0]
+        messages.error(request, f"{reason}.")
         return redirect("gl_reviews_page")
-    
-    previous_trail = ReviewTrail.objects.filter(
-        gl_review=gl_review
-    ).order_by('-created_at').first()
-    if not previous_trail:
-        print("PREVIOUS TRAIL NOT FOUND")
-        messages.error(request, "Previous trail not found.")
-        return redirect("gl_reviews_page")
-    print("FOUND PREVIOUS TRAIL:", previous_trail.id)
-    
-    assignment = ResponsibilityMatrix.objects.get(
-        id=assignment_id,
-        gl_code=gl_code
-    )
-    preparer_assignment = ResponsibilityMatrix.objects.filter(
-        gl_code=assignment.gl_code,
-        user_role=4,
-    ).first()
-    if action == 'approve':
-        assignment.gl_code_status = 3  # Approved
-        # get FC
-        fc = ResponsibilityMatrix.objects.filter(
-            user_role=3,
-            department=assignment.department
-        ).first()
-        print("FC: ", fc.id)
-        preparer_assignment.gl_code_status = 3  # Approved
-    else:
-        assignment.gl_code_status = 4  # Rejected
-        preparer_assignment.gl_code_status = 4  # Rejected
-
-    assignment.save()
-    preparer_assignment.save()
-    
-    gl_review.reconciliation_notes = reconciliation_notes
-    if action == 'approve':
-        # fc is responsibility mat
-        gl_review.reviewer = fc.user
-    else:
-        gl_review.reviewer = previous_trail.reviewer
-    gl_review.save()
-
-    review_trail = ReviewTrail.objects.create(
-        reviewer=request.user,
-        reviewer_responsibility_matrix=assignment,
-        gl_review=gl_review,
-        previous_trail=previous_trail,
-        reconciliation_notes=reconciliation_notes,
-        gl_code=gl_code,
-        action='Approved' if action == 'approve' else 'Rejected'
-    )
-    review_trail.save()
-
-    # Update Previous Reviewer/Preparer Status on Rejection
-    if action == 'reject':
-        if previous_trail and previous_trail.reviewer_responsibility_matrix:
-            prev_matrix = previous_trail.reviewer_responsibility_matrix
-            prev_matrix.gl_code_status = 4 # Rejected
-            prev_matrix.save()
-            print(f"Updated Previous Matrix {prev_matrix.id} to Rejected")
-        
-        # Current reviewer status? Stay as Submitted or Pending?
-        # If I rejected it, I am Submitted with it until it comes back.
-        # But for now, let's leave my status as 'Rejected' (4) to indicate I pushed it back? 
-        # Or 'Submitted' (2)? Existing code sets it to 4. 
-        # "Only if Reviewer rejects, the status should affect him [Preparer]." - satisfied by prev_matrix update.
-
 
+    outcome = result.processed[0]
     messages.success(
         request,
-        f"GL Review submitted successfully for GL Code {gl_code}. Status updated to '{assignment.get_gl_code_status_display()}'."
+        f"GL Review submitted successfully for GL Code {gl_code}. Status updated to '{outcome.assignment.get_gl_code_status_display()}'."
     )
 
-
     if action == 'approve':
         # send mail to FC
-        fc_email = fc.user.email
-        send_mail(
+        enqueue_notification(
+            outcome.notify.email,
+            gl_code,
+            'Available for your approval',
             'GL Review Available',
             f'GL Review for GL Code {gl_code} is available for your approval.',
             settings.EMAIL_HOST_USER,
-            [fc_email],
-            fail_silently=False,
         )
-    # find next
     else:
         # mail previous
-        prev_reviewer = previous_trail.reviewer
-        send_mail(
+        enqueue_notification(
+            outcome.notify.email,
+            gl_code,
+            'Rejected by Reviewer',
             'GL Review Rejected',
             f'Your GL Review for GL Code {gl_code} has been rejected.',
             settings.EMAIL_HOST_USER,
-            [prev_reviewer.email],
-            fail_silently=False,
         )
 
     return redirect("gl_reviews_page")
@@ -686,117 +350,46 @@ def submit_gl_review_bufc(request):
     reconciliation_notes = request.POST.get("reconciliation_notes")
     action = request.POST.get("action")  # either 'approve' or 'reject'
 
-    
     if not assignment_id or not gl_code:
         messages.error(request, "Missing required information.")
         return redirect("gl_reviews_page")
-    
+
     if not reconciliation_notes:
         messages.error(request, "Reconciliation notes are required.")
         return redirect("gl_reviews_page")
-    
-    trial_balance = TrialBalance.objects.filter(
-        gl_code=gl_code
-    ).first()
-    if not trial_balance:
-        print("TRIAL BALANCE NOT FOUND")
-        messages.error(request, "Trial balance not found.")
-        return redirect("gl_reviews_page")
-    print("FOUND TRIAL BALANCE:", trial_balance.id)
-    
-    gl_review = GLReview.objects.filter(
-        trial_balance=trial_balance,
-    ).first()
 
-    if not gl_review:
-        print("GL REVIEW NOT FOUND")
-        messages.error(request, "GL review not found.")
-        return redirect("gl_reviews_page")
-    
-    previous_trail = ReviewTrail.objects.filter(
-        gl_review=gl_review
-    ).order_by('-created_at').first()
-    if not previous_trail:
-        print("PREVIOUS TRAIL NOT FOUND")
-        messages.error(request, "Previous trail not found.")
+    action = 'approve' if action == 'approve' else 'reject'
+    result = apply_transition(request.user, 'fc', action, [assignment_id], reconciliation_notes, gl_code=gl_code)
+    if not result.processed:
+        _, reason = result.skipped[0]
+        messages.error(request, f"{reason}.")
         return redirect("gl_reviews_page")
-    print("FOUND PREVIOUS TRAIL:", previous_trail.id)
-    
-    assignment = ResponsibilityMatrix.objects.get(
-        id=assignment_id,
-        gl_code=gl_code
-    )
-    reviewer_assignment = ResponsibilityMatrix.objects.filter(
-        gl_code=assignment.gl_code,
-        user_role=5,
-    ).first()
-    if action == 'approve':
-        assignment.gl_code_status = 3  # Approved
-        reviewer_assignment.gl_code_status = 5  # Approved by FC
-    else:
-        assignment.gl_code_status = 4  # Rejected
-        reviewer_assignment.gl_code_status = 6  # Rejected by FC
-
-    assignment.save()
-    reviewer_assignment.save()
-
-    dh = ResponsibilityMatrix.objects.filter(
-        user_role=2,
-        department=assignment.department
-    ).first()
-    print("Dept. Head (DH): ", dh.id)
-    
-    gl_review.reconciliation_notes = reconciliation_notes
-    if action == 'approve':      
-        gl_review.reviewer = dh.user
-    else:
-        gl_review.reviewer = previous_trail.reviewer
-    gl_review.save()
-
-    review_trail = ReviewTrail.objects.create(
-        reviewer=request.user,
-        reviewer_responsibility_matrix=assignment,
-        gl_review=gl_review,
-        previous_trail=previous_trail,
-        reconciliation_notes=reconciliation_notes,
-        gl_code=gl_code,
-        action='Approved' if action == 'approve' else 'Rejected'
-    )
-    review_trail.save()
-
-    # Update Previous Reviewer/Preparer Status on Rejection
-    if action == 'reject':
-        if previous_trail and previous_trail.reviewer_responsibility_matrix:
-            prev_matrix = previous_trail.reviewer_responsibility_matrix
-            prev_matrix.gl_code_status = 6 # Rejected by FC
-            prev_matrix.save()
-            print(f"Updated Previous Matrix {prev_matrix.id} to Rejected by FC")
 
+    outcome = result.processed[0]
     messages.success(
         request,
-        f"GL Review submitted successfully for GL Code {gl_code}. Status updated to '{assignment.get_gl_code_status_display()}'."
+        f"GL Review submitted successfully for GL Code {gl_code}. Status updated to '{outcome.assignment.get_gl_code_status_display()}'."
     )
 
     if action == 'approve':
-        # send mail to FC
-        fc_email = dh.user.email
-        send_mail(
+        # send mail to Dept. Head
+        enqueue_notification(
+            outcome.notify.email,
+            gl_code,
+            'Available for your approval',
             'GL Review Available',
             f'GL Review for GL Code {gl_code} is available for your approval.',
             settings.EMAIL_HOST_USER,
-            [fc_email],
-            fail_silently=False,
         )
-    # find next
     else:
         # mail previous
-        prev_reviewer = previous_trail.reviewer
-        send_mail(
+        enqueue_notification(
+            outcome.notify.email,
+            gl_code,
+            'Rejected by Finance Controller',
             'GL Review Rejected',
             f'Your GL Review for GL Code {gl_code} has been rejected by the Finance Controller.',
             settings.EMAIL_HOST_USER,
-            [prev_reviewer.email],
-            fail_silently=False,
         )
 
     return redirect("gl_reviews_page")
@@ -808,176 +401,143 @@ def submit_gl_review_tower(request):
     """
     Submit a GL review for Tower Head (User Type 2).
     """
-    try:
-        assignment_id = request.POST.get("assignment_id")
-        gl_code = request.POST.get("gl_code")
-        action = request.POST.get("action")  # 'approve' or 'reject'
-
-        assignment_ids = request.POST.getlist("assignment_ids[]")
-
-        print("[1] Raw POST data")
-        print("    action:", action)
-        print("    assignment_id:", assignment_id)
-        print("    assignment_ids:", assignment_ids)
-
-        if not assignment_ids and assignment_id:
-            assignment_ids = [assignment_id]
-            print("[1.1] Single assignment fallback used")
-
-        if not assignment_ids:
-            print("[ERROR] No assignment IDs found")
-            messages.error(request, "No GLs selected.")
-            return redirect("gl_reviews_page")
-
-        processed_count = 0
-
-        for idx, a_id in enumerate(assignment_ids, start=1):
-            print(f"[2.{idx}] Processing assignment_id:", a_id)
-
-            try:
-                assignment = ResponsibilityMatrix.objects.get(
-                    id=a_id,
-                    user=request.user
-                )
-            except ResponsibilityMatrix.DoesNotExist:
-                print(f"[ERROR] Assignment not found or not owned by user: {a_id}")
-                continue
-
-            current_gl_code = assignment.gl_code
-            print(f"[3.{idx}] GL Code:", current_gl_code)
-
-            # Verify FC approval
-            fc_assignment = ResponsibilityMatrix.objects.filter(
-                gl_code=current_gl_code,
-                user_role=3
-            ).first()
-
-            if not fc_assignment:
-                print(f"[WARN] No FC assignment found for GL:", current_gl_code)
-                continue
-
-            print(f"[4.{idx}] FC status:", fc_assignment.gl_code_status)
-
-            if fc_assignment.gl_code_status != 3:
-                print(f"[SKIP] GL not approved by FC. Status:", fc_assignment.gl_code_status)
-                continue
-
-            trial_balance = TrialBalance.objects.filter(
-                gl_code=current_gl_code
-            ).first()
-
-            if not trial_balance:
-                print(f"[ERROR] No TrialBalance found for GL:", current_gl_code)
-                continue
-
-            print(f"[5.{idx}] TrialBalance ID:", trial_balance.id)
-
-            gl_review = GLReview.objects.filter(
-                trial_balance=trial_balance
-            ).first()
-
-            if not gl_review:
-                print(f"[ERROR] No GLReview found for GL:", current_gl_code)
-                continue
-
-            print(f"[6.{idx}] GLReview ID:", gl_review.id)
+    assignment_id = request.POST.get("assignment_id")
+    action = request.POST.get("action")  # 'approve' or 'reject'
+    assignment_ids = request.POST.getlist("assignment_ids[]")
 
-            previous_trail = ReviewTrail.objects.filter(
-                gl_review=gl_review
-            ).order_by('-created_at').first()
+    if not assignment_ids and assignment_id:
+        assignment_ids = [assignment_id]
 
-            print(f"[7.{idx}] Previous trail ID:",
-                  previous_trail.id if previous_trail else None)
-            print(f"[8.{idx}] Performing action:", action)
+    if not assignment_ids:
+        messages.error(request, "No GLs selected.")
+        return redirect("gl_reviews_page")
 
-            if action == 'approve':
-                assignment.gl_code_status = 7
-                fc_assignment.gl_code_status = 7
-                fc_assignment.save()
-                print(f"[9.{idx}] Tower Head APPROVED → status set to 7")
+    if action not in ('approve', 'reject'):
+        messages.error(request, "Invalid action.")
+        return redirect("gl_reviews_page")
 
-            elif action == 'reject':
-                assignment.gl_code_status = 8
-                fc_assignment.gl_code_status = 8
-                fc_assignment.save()
-                print(f"[9.{idx}] Tower Head REJECTED → FC status set to 8")
+    notes = f"Bulk Action: {action.title()}" if len(assignment_ids) > 1 else "Tower Head Review"
 
-            else:
-                print(f"[ERROR] Invalid action:", action)
-                continue
+    try:
+        result = apply_transition(request.user, 'tower', action, assignment_ids, notes)
+    except Exception as e:
+        logger.exception(f"submit_gl_review_tower failed: {e}")
+        messages.error(request, "Something went wrong while processing GL reviews.")
+        return redirect("gl_reviews_page")
 
-            assignment.save()
-            print(f"[10.{idx}] Assignment saved:", assignment.id)
+    for gl_code, reason in result.skipped:
+        logger.warning(f"Tower Head {action} skipped {gl_code}: {reason}")
+
+    # let the FC know; bulk decisions reach them as one digest per FC
+    decision = 'Approved by Tower Head' if action == 'approve' else 'Rejected by Tower Head'
+    for outcome in result.processed:
+        enqueue_notification(
+            outcome.notify.email,
+            outcome.assignment.gl_code,
+            decision,
+            f'GL Review {decision}',
+            f'GL Review for GL Code {outcome.assignment.gl_code} has been {decision.lower()}.',
+            settings.EMAIL_HOST_USER,
+        )
 
-            gl_review.reviewer = request.user
-            gl_review.save()
-            print(f"[11.{idx}] GLReview reviewer updated to Tower Head")
+    messages.success(
+        request,
+        f"Successfully processed {len(result.processed)} GL reviews."
+    )
+    return redirect("gl_reviews_page")
 
-            ReviewTrail.objects.create(
-                reviewer=request.user,
-                reviewer_responsibility_matrix=assignment,
-                gl_review=gl_review,
-                previous_trail=previous_trail,
-                reconciliation_notes=(
-                    f"Bulk Action: {action.title()}"
-                    if len(assignment_ids) > 1
-                    else "Tower Head Review"
-                ),
-                gl_code=current_gl_code,
-                action='Approved' if action == 'approve' else 'Rejected'
-            )
 
-            print(f"[12.{idx}] ReviewTrail created successfully")
+QUEUE_PAGE_SIZE = 50
+QUEUE_MAX_PAGE_SIZE = 200
+BS_GRID_PAGE_SIZE = 100
+BS_GRID_MAX_PAGE_SIZE = 500
 
-            processed_count += 1
 
-        print("Processed count:", processed_count)
+@login_required
+@require_http_methods(["GET"])
+def gl_review_queue_api(request):
+    """
+    The current user's GL review queue as JSON, one keyset page at a time.
 
-        messages.success(
-            request,
-            f"Successfully processed {processed_count} GL reviews."
+    Query params: cursor (from the previous page's next_cursor), limit, status_code,
+    department (name), actionable (true/false) and, for Preparer/Reviewer users, role (4/5).
+    """
+    params = request.GET
+    try:
+        limit = min(int(params.get('limit', QUEUE_PAGE_SIZE)), QUEUE_MAX_PAGE_SIZE)
+        status_code = int(params['status_code']) if params.get('status_code') else None
+        role = int(params['role']) if params.get('role') else None
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        actionable = params.get('actionable')
+        if actionable is not None:
+            actionable = actionable.lower() in ('1', 'true', 'yes')
+
+        results, next_cursor = gl_queue_page(
+            request.user,
+            cursor=params.get('cursor'),
+            limit=limit,
+            role=role,
+            status_code=status_code,
+            department=params.get('department', '').strip() or None,
+            actionable=actionable,
         )
-        return redirect("gl_reviews_page")
-
-    except Exception as e:
-        print("[ERROR] submit_gl_review_tower crashed")
-        print("Exception:", repr(e))
-        import traceback
-        traceback.print_exc()
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
 
-        messages.error(request, "Something went wrong while processing GL reviews.")
-        return redirect("gl_reviews_page")
+    return JsonResponse({'success': True, 'results': results, 'next_cursor': next_cursor})
 
 
 @login_required
 def balance_sheet_view(request):
-    """Detailed balance sheet view for Tier 3 navigation."""
+    """
+    Detailed balance sheet view for Tier 3 navigation.
+    Renders only the page shell; stats and rows come from balance_sheet_grid_api as the table scrolls.
+    """
+    return render(request, 'gl_reviews/balance_sheet.html', {
+        'columns': BS_GRID_COLUMNS,
+        'filters': list(BS_GRID_FILTERS),
+        'page_size': BS_GRID_PAGE_SIZE,
+    })
 
-    sheets = (
-        BalanceSheet.objects
-        .filter(user=request.user)
-        .order_by('-added_at')
-    )
 
-    stats = {
-        "total": sheets.count(),
-        "open_items": sheets.filter(recon_status__iexact='open').count(),
-        "flagged": sheets.exclude(flag_color__isnull=True).exclude(flag_color='').count(),
-        "analysis_required": sheets.filter(analysis_required__iexact='yes').count(),
-    }
+@login_required
+@require_http_methods(["GET"])
+def balance_sheet_grid_api(request):
+    """
+    The user's balance sheet rows as JSON, one keyset page at a time.
 
-    context = {
-        "balance_sheets": sheets,
-        "stats": stats,
+    Query params: cursor, limit, sort (comma separated columns, "-" for descending) and
+    filter_<column>=value for any of BS_GRID_FILTERS. The first page (no cursor) also
+    carries the stat cards for the filtered rows.
+    """
+    params = request.GET
+    filters = {
+        key[len('filter_'):]: value.strip()
+        for key, value in params.items() if key.startswith('filter_') and value.strip()
     }
-    return render(request, 'gl_reviews/balance_sheet.html', context)
+    try:
+        limit = min(int(params.get('limit', BS_GRID_PAGE_SIZE)), BS_GRID_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        rows, next_cursor = balance_sheet_page(
+            request.user, cursor=params.get('cursor'), limit=limit, sort=params.get('sort'), filters=filters,
+        )
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    response = {'success': True, 'results': rows, 'next_cursor': next_cursor}
+    if not params.get('cursor'):
+        response['stats'] = balance_sheet_stats(balance_sheet_queryset(request.user, filters))
+    return JsonResponse(response)
 
 
 @login_required
+@condition(etag_func=trail_etag, last_modified_func=trail_last_modified)
 def get_review_trail(request, gl_code):
     """
     Fetch the review trail history for a specific GL code.
-    Returns JSON data for the timeline.
+    Returns JSON data for the timeline; 304 when the GL has no new trail since the client's copy.
     """
     trails = ReviewTrail.objects.filter(gl_code=gl_code).select_related('reviewer', 'previous_trail').order_by('created_at')
     
@@ -1000,11 +560,40 @@ def get_review_trail(request, gl_code):
             'timestamp': trail.created_at.isoformat(),
         }
         trail_data.append(trail_entry)
-        
-    return JsonResponse({'trails': trail_data})
+
+    summary = summarize_trails([gl_code]).get(gl_code)
+    return JsonResponse({
+        'trails': trail_data,
+        'summary': {
+            'current_stage': summary.current_stage,
+            'rejection_count': summary.rejection_count,
+            'cycle_time_seconds': summary.cycle_time.total_seconds(),
+        } if summary else None,
+    })
+
+
+@login_required
+@require_http_methods(["GET"])
+def gl_code_autocomplete(request):
+    """
+    GL codes/names matching `q` (code prefix first, then substring), at most `limit` of them.
+    `scope=trail` restricts results to GLs that have a review trail.
+    """
+    try:
+        limit = min(int(request.GET.get('limit', 20)), settings.GL_AUTOCOMPLETE_MAX_RESULTS)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': "limit must be an integer"}, status=400)
+
+    within = None
+    if request.GET.get('scope') == 'trail':
+        within = set(trail_gl_codes())
+
+    matches = gl_code_index.search(request.GET.get('q', ''), limit=max(limit, 1), within=within)
+    return JsonResponse({'results': [{'code': code, 'name': name} for code, name in matches]})
 
 
 @login_required
+@condition(etag_func=trail_page_etag)
 def review_trail_page(request):
     """
     Dedicated page for searching and viewing Review Trails.
@@ -1012,13 +601,6 @@ def review_trail_page(request):
     gl_code = request.GET.get('gl_code', '').strip()
     context = {'gl_code': gl_code}
     
-    # Get all unique GL codes for datalist
-    # Combine ReviewTrail gl_codes and maybe existing GLs
-    # For efficiency let's just grab from ReviewTrail and ResponsibilityMatrix
-    gl_codes = set(ReviewTrail.objects.values_list('gl_code', flat=True).distinct())
-    # You might want to add Assignment GLs too if they haven't started trailing yet, 
-    # but the request implies showing trails.
-    context['all_gl_codes'] = sorted([g for g in gl_codes if g])
 
     if gl_code:
         trails_qs = ReviewTrail.objects.filter(gl_code=gl_code).select_related('reviewer').order_by('created_at')
@@ -1032,8 +614,7 @@ def review_trail_page(request):
         
         if not gl_name:
              # Fallback lookup
-             bs = BalanceSheet.objects.filter(gl_acct=gl_code).first()
-             if bs: gl_name = bs.gl_account_name
+             gl_name = GLAccount.objects.name_for(gl_code)
 
         context['gl_name'] = gl_name
         
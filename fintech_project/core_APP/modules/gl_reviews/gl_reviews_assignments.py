@@ -0,0 +1,128 @@
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Q, Subquery
+
+from core_APP.models import GLAccount, ResponsibilityMatrix, GLReview
+
+from .gl_reviews_worklist import refresh_worklist
+
+
+logger = logging.getLogger(__name__)
+
+
+def reviewed_gl_codes(reviews_qs):
+    """Distinct gl_codes behind a GLReview queryset, in the queryset's order, in one query."""
+    codes = reviews_qs.values_list('trial_balance__gl_code', flat=True)
+    return list(dict.fromkeys(code for code in codes if code))
+
+
+def reconcile_role_assignments(user, user_role, gl_codes):
+    """
+    Make sure `user` holds a ResponsibilityMatrix row for every code in `gl_codes`.
+
+    Missing rows are found by set difference and created with one bulk_create; rows a
+    concurrent page load created in the meantime are skipped rather than raising.
+    The first missing code is written onto the blank bootstrap row of this role
+    (the one created by department management) if it has no GL yet.
+    The new GLs' worklist entries are refreshed in the same transaction.
+    Returns the number of assignments added.
+    """
+    main_assignment = ResponsibilityMatrix.objects.filter(
+        user_role=user_role
+    ).select_related('department').first()
+    if not main_assignment:
+        logger.warning(f"No role {user_role} ResponsibilityMatrix row found, skipping reconciliation")
+        return 0
+
+    existing = set(
+        ResponsibilityMatrix.objects.filter(
+            user=user,
+            gl_code__in=gl_codes
+        ).values_list('gl_code', flat=True)
+    )
+    missing = [code for code in gl_codes if code not in existing]
+    if not missing:
+        return 0
+
+    gl_account_ids, _ = GLAccount.objects.ids_for(missing)
+
+    to_create = missing
+    with transaction.atomic():
+        bootstrapped = 0
+        if not main_assignment.gl_code:
+            try:
+                with transaction.atomic():
+                    # Only if it is still blank; a concurrent load may have filled it meanwhile
+                    bootstrapped = ResponsibilityMatrix.objects.filter(
+                        Q(gl_code__isnull=True) | Q(gl_code=''), id=main_assignment.id,
+                    ).update(
+                        gl_code=missing[0],
+                        gl_account_id=gl_account_ids[missing[0]],
+                        gl_code_status=1
+                    )
+            except IntegrityError:
+                # The bootstrap row's user already holds this code (inserted concurrently): leave it blank
+                pass
+            if bootstrapped:
+                to_create = missing[1:]
+
+        # ignore_conflicts doesn't report the rows it dropped: count the user's rows around the insert
+        held = ResponsibilityMatrix.objects.filter(user=user, gl_code__in=to_create)
+        before = held.count()
+        ResponsibilityMatrix.objects.bulk_create([
+            ResponsibilityMatrix(
+                user=user,
+                gl_code=gl_code,
+                gl_account_id=gl_account_ids[gl_code],
+                gl_code_status=1,
+                department=main_assignment.department,
+                user_role=user_role,
+            )
+            for gl_code in to_create
+        ], ignore_conflicts=True)
+        created = bootstrapped + held.count() - before
+        refresh_worklist(missing)
+    return created
+
+
+def reset_bufc_after_reviewer_approval(user, gl_codes):
+    """
+    Reset the user's FC assignments to Pending when the GL's reviewer has approved it.
+
+    Applied as a single UPDATE; rows that are already Pending are left untouched.
+    The reset GLs' worklist entries are refreshed in the same transaction.
+    """
+    reviewer_status = ResponsibilityMatrix.objects.filter(
+        gl_code=OuterRef('gl_code'),
+        user_role=5
+    ).order_by('user', 'gl_code').values('gl_code_status')[:1]
+
+    to_reset = dict(
+        ResponsibilityMatrix.objects
+        .filter(user=user, gl_code__in=gl_codes)
+        .exclude(gl_code_status=1)
+        .annotate(reviewer_status=Subquery(reviewer_status))
+        .filter(reviewer_status=3)
+        .values_list('id', 'gl_code')
+    )
+    if not to_reset:
+        return 0
+    with transaction.atomic():
+        ResponsibilityMatrix.objects.filter(id__in=to_reset).update(gl_code_status=1)
+        refresh_worklist(to_reset.values())
+    return len(to_reset)
+
+
+def reconcile_tower_assignments(user):
+    """Tower Head sees every GL under review."""
+    gl_codes = reviewed_gl_codes(GLReview.objects.order_by('-reviewed_at'))
+    return reconcile_role_assignments(user, 2, gl_codes)
+
+
+def reconcile_bufc_assignments(user):
+    """FC sees the GLs currently routed to them; reviewer approvals put them back to Pending."""
+    gl_codes = reviewed_gl_codes(GLReview.objects.filter(reviewer=user).order_by('-reviewed_at'))
+    created = reconcile_role_assignments(user, 3, gl_codes)
+    reset_bufc_after_reviewer_approval(user, gl_codes)
+    return created
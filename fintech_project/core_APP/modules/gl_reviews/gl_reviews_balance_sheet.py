@@ -0,0 +1,102 @@
+from django.db.models import Count, Q, Value
+from django.db.models.functions import Coalesce
+
+from core_APP.models import BalanceSheet
+from .gl_reviews_worklist import clean_cursor_values, decode_cursor, encode_cursor, keyset_filter
+
+
+# Grid columns (API names are the model field names), in table order
+BS_GRID_COLUMNS = [
+    'gl_acct', 'gl_account_name', 'main_head', 'sub_head', 'responsible_department', 'department_spoc',
+    'department_reviewer', 'recon_status', 'variance_percent', 'flag_color', 'fiscal_year', 'added_at',
+]
+
+# Filterable columns -> lookup. Enumerated columns match exactly, free text by substring
+BS_GRID_FILTERS = {
+    'gl_acct': 'startswith',
+    'gl_account_name': 'icontains',
+    'main_head': 'iexact',
+    'sub_head': 'iexact',
+    'responsible_department': 'exact',
+    'department_spoc': 'icontains',
+    'department_reviewer': 'icontains',
+    'recon_status': 'iexact',
+    'flag_color': 'iexact',
+    'fiscal_year': 'exact',
+    'analysis_required': 'iexact',
+}
+
+BS_GRID_DEFAULT_SORT = '-added_at'
+
+BS_STATS = {
+    'total': Count('id'),
+    'open_items': Count('id', filter=Q(recon_status__iexact='open')),
+    'flagged': Count('id', filter=Q(flag_color__isnull=False) & ~Q(flag_color='')),
+    'analysis_required': Count('id', filter=Q(analysis_required__iexact='yes')),
+}
+
+
+def parse_sort(sort):
+    """
+    Keyset ordering for a `sort` param such as "main_head,-gl_acct": [(sort key, descending)], id last.
+    Text columns sort on a NULL-free key so the keyset comparison stays well defined.
+    Raises ValueError for unknown columns.
+    """
+    ordering = []
+    for part in (sort or BS_GRID_DEFAULT_SORT).split(','):
+        column = part.strip().lstrip('-')
+        if column not in BS_GRID_COLUMNS:
+            raise ValueError(f"Cannot sort by {column!r}")
+        key = column if column == 'added_at' else f'sort_{column}'
+        ordering.append((key, part.strip().startswith('-')))
+    if not any(key == 'id' for key, _ in ordering):
+        ordering.append(('id', ordering[-1][1]))
+    return ordering
+
+
+def balance_sheet_queryset(user, filters=None):
+    qs = BalanceSheet.objects.filter(user=user)
+    for column, value in (filters or {}).items():
+        if column not in BS_GRID_FILTERS:
+            raise ValueError(f"Cannot filter by {column!r}")
+        qs = qs.filter(**{f"{column}__{BS_GRID_FILTERS[column]}": value})
+    return qs
+
+
+def balance_sheet_stats(qs):
+    """The Tier 3 stat cards from one conditional-aggregate query."""
+    return qs.aggregate(**BS_STATS)
+
+
+def balance_sheet_row(sheet):
+    row = {column: getattr(sheet, column) for column in BS_GRID_COLUMNS}
+    row['id'] = str(sheet.id)
+    row['added_at'] = sheet.added_at.isoformat()
+    return row
+
+
+def balance_sheet_page(user, cursor=None, limit=100, sort=None, filters=None):
+    """
+    One page of the user's balance sheet rows and the cursor for the next (None on the last page).
+    The cursor carries the sort it was issued for; reusing it under another sort is an error.
+    """
+    sort = sort or BS_GRID_DEFAULT_SORT
+    ordering = parse_sort(sort)
+    qs = balance_sheet_queryset(user, filters).annotate(**{
+        key: Coalesce(key[len('sort_'):], Value(''))
+        for key, _ in ordering if key.startswith('sort_')
+    })
+    if cursor:
+        values = decode_cursor(cursor)
+        if not values or values[0] != sort:
+            raise ValueError("Cursor was issued for a different sort")
+        qs = qs.filter(keyset_filter(ordering, clean_cursor_values(BalanceSheet, ordering, values[1:])))
+    qs = qs.order_by(*[f"-{key}" if descending else key for key, descending in ordering])
+
+    sheets = list(qs[:limit + 1])
+    next_cursor = None
+    if len(sheets) > limit:
+        sheets = sheets[:limit]
+        last = sheets[-1]
+        next_cursor = encode_cursor([sort] + [getattr(last, key) for key, _ in ordering])
+    return [balance_sheet_row(sheet) for sheet in sheets], next_cursor
@@ -0,0 +1,200 @@
+import hashlib
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Max
+
+from core_APP.models import ResponsibilityMatrix, ReviewTrail
+
+
+TRAIL_GL_CODES_CACHE_KEY = 'gl_reviews:trail_gl_codes'
+
+
+def trail_gl_codes():
+    """Sorted distinct gl_codes that have a review trail, cached until invalidate_trail_gl_codes()."""
+    gl_codes = cache.get(TRAIL_GL_CODES_CACHE_KEY)
+    if gl_codes is None:
+        rows = ReviewTrail.objects.filter(gl_code__isnull=False).values_list('gl_code', flat=True).distinct()
+        gl_codes = sorted(code for code in rows if code)
+        cache.set(TRAIL_GL_CODES_CACHE_KEY, gl_codes, settings.REVIEW_TRAIL_GL_CODES_CACHE_SECONDS)
+    return gl_codes
+
+
+def invalidate_trail_gl_codes():
+    """Drop the cached datalist once the transaction that wrote new ReviewTrail rows commits."""
+    transaction.on_commit(lambda: cache.delete(TRAIL_GL_CODES_CACHE_KEY))
+
+
+def trail_state(request, gl_code):
+    """
+    (latest created_at, trail count) for a GL from one aggregate over rt_gl_code_created_idx.
+    Memoized on the request so the ETag and Last-Modified checks share one query.
+    """
+    memo = request.__dict__.setdefault('_trail_state', {})
+    if gl_code not in memo:
+        state = ReviewTrail.objects.filter(gl_code=gl_code).aggregate(latest=Max('created_at'), count=Count('id'))
+        memo[gl_code] = (state['latest'], state['count'])
+    return memo[gl_code]
+
+
+def _etag(*parts):
+    return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _has_pending_messages(request):
+    # len() doesn't consume them. A 304 sent after a POST-redirect would leave the messages queued
+    # for the page instead of rendered on it, so such requests skip the conditional response.
+    return len(get_messages(request)) > 0
+
+
+def trail_etag(request, gl_code):
+    if _has_pending_messages(request):
+        return None
+    latest, count = trail_state(request, gl_code)
+    return _etag('trail', request.user.pk, gl_code, latest.isoformat() if latest else '', count)
+
+
+def trail_last_modified(request, gl_code):
+    if _has_pending_messages(request):
+        return None
+    return trail_state(request, gl_code)[0]
+
+
+def trail_page_etag(request):
+    """The trail page also depends on who is logged in (navbar)."""
+    if _has_pending_messages(request):
+        return None
+    gl_code = request.GET.get('gl_code', '').strip()
+    latest, count = trail_state(request, gl_code) if gl_code else (None, 0)
+    return _etag('trail-page', request.user.pk, gl_code, latest.isoformat() if latest else '', count)
+
+
+# -------------------------------
+# Trail chains (previous_trail linked lists)
+# -------------------------------
+
+# Stage holding the GL after the latest trail: (actor's user_role, action) -> text shown to the Tower Head
+STAGE_AFTER = {
+    (4, 'Submitted'): "GL Review-II (Reviewer)",
+    (5, 'Approved'): "GL Review-III (Finance Controller)",
+    (5, 'Rejected'): "GL Review-I (Preparer)",
+    (3, 'Approved'): "GL Review-III (Finance Controller)",
+    (3, 'Rejected'): "GL Review-II (Reviewer)",
+    (2, 'Approved'): "GL Review-III (Finance Controller)",
+    (2, 'Rejected'): "GL Review-III (Finance Controller)",
+}
+
+
+class TrailChain(namedtuple('TrailChain', ['trails'])):
+    """One previous_trail linked list, oldest trail first. Trails carry `actor_role` (their matrix row's user_role)."""
+    __slots__ = ()
+
+    @property
+    def tip(self):
+        return self.trails[-1]
+
+    @property
+    def gl_code(self):
+        return self.tip.gl_code
+
+
+# chains: every chain of the GL, oldest tip first; cycle_time: first trail to latest trail
+TrailSummary = namedtuple('TrailSummary', ['gl_code', 'chains', 'current_stage', 'rejection_count', 'cycle_time'])
+
+
+def _chain_sql(seed):
+    trails = connection.ops.quote_name(ReviewTrail._meta.db_table)
+    matrix = connection.ops.quote_name(ResponsibilityMatrix._meta.db_table)
+    # UNION (not UNION ALL) so a corrupted, circular chain still terminates
+    return f"""
+        WITH RECURSIVE chain(id) AS (
+            SELECT t.id FROM {trails} t WHERE {seed}
+            UNION
+            SELECT p.previous_trail_id FROM {trails} p JOIN chain c ON p.id = c.id
+            WHERE p.previous_trail_id IS NOT NULL
+        )
+        SELECT t.*, rm.user_role AS actor_role
+        FROM {trails} t
+        JOIN chain c ON c.id = t.id
+        LEFT JOIN {matrix} rm ON rm.id = t.reviewer_responsibility_matrix_id
+    """
+
+
+def fetch_trail_chains(tip_ids=None, gl_codes=None):
+    """
+    Complete trail chains in one recursive-CTE query, walking previous_trail back from each tip.
+
+    Tips are either the given trail ids or, for `gl_codes`, every trail of those GLs that no
+    later trail points back to (one chain per submission round). Returns TrailChains, oldest tip first.
+    """
+    if tip_ids is not None:
+        ids = [ReviewTrail._meta.pk.get_db_prep_value(tip_id, connection) for tip_id in tip_ids]
+        if not ids:
+            return []
+        seed = f"t.id IN ({', '.join(['%s'] * len(ids))})"
+        params = ids
+    else:
+        gl_codes = list(gl_codes or [])
+        if not gl_codes:
+            return []
+        trails = connection.ops.quote_name(ReviewTrail._meta.db_table)
+        seed = (
+            f"t.gl_code IN ({', '.join(['%s'] * len(gl_codes))}) "
+            f"AND NOT EXISTS (SELECT 1 FROM {trails} n WHERE n.previous_trail_id = t.id)"
+        )
+        params = gl_codes
+
+    by_id = {trail.id: trail for trail in ReviewTrail.objects.raw(_chain_sql(seed), params)}
+    referenced = {trail.previous_trail_id for trail in by_id.values()}
+    if tip_ids is not None:
+        wanted = {uuid.UUID(str(tip_id)) for tip_id in tip_ids}
+        tips = [trail for trail_id, trail in by_id.items() if trail_id in wanted]
+    else:
+        tips = [trail for trail_id, trail in by_id.items() if trail_id not in referenced]
+
+    chains = []
+    for tip in sorted(tips, key=lambda t: t.created_at):
+        trails, seen, trail = [], set(), tip
+        while trail is not None and trail.id not in seen:
+            seen.add(trail.id)
+            trails.append(trail)
+            trail = by_id.get(trail.previous_trail_id)
+        chains.append(TrailChain(list(reversed(trails))))
+    return chains
+
+
+def current_stage(chain):
+    """Review stage the GL sits in after the chain's latest trail, or None if it can't be told."""
+    return STAGE_AFTER.get((chain.tip.actor_role, chain.tip.action))
+
+
+def _distinct_trails(chains):
+    # Chains only share trails if two trails were ever linked to the same previous one
+    return {trail.id: trail for chain in chains for trail in chain.trails}.values()
+
+
+def rejection_count(chains):
+    return sum(1 for trail in _distinct_trails(chains) if trail.action == 'Rejected')
+
+
+def cycle_time(chains):
+    """Time from the GL's first trail to its latest one (a timedelta), None without trails."""
+    trails = _distinct_trails(chains)
+    if not trails:
+        return None
+    return max(t.created_at for t in trails) - min(t.created_at for t in trails)
+
+
+def summarize_trails(gl_codes):
+    """{gl_code: TrailSummary} for every GL in `gl_codes` with at least one trail, in one query."""
+    grouped = {}
+    for chain in fetch_trail_chains(gl_codes=gl_codes):
+        grouped.setdefault(chain.gl_code, []).append(chain)
+    return {
+        gl_code: TrailSummary(gl_code, chains, current_stage(chains[-1]), rejection_count(chains), cycle_time(chains))
+        for gl_code, chains in grouped.items()
+    }
@@ -2,14 +2,18 @@ from django.urls import path
 from .gl_reviews import (
     gl_reviews_view, 
     balance_sheet_view, 
+    balance_sheet_grid_api,
     upload_gl_supporting_document, 
     submit_gl_review_preparer, 
     submit_gl_review_reviewer,
     remove_gl_supporting_document,
+    download_gl_supporting_document,
     get_review_trail,
     review_trail_page,
     submit_gl_review_bufc,
     submit_gl_review_tower,
+    gl_review_queue_api,
+    gl_code_autocomplete,
 )
 
 
@@ -18,6 +22,7 @@ urlpatterns = [
     path('remove_gl_supporting_document/<str:document_id>', remove_gl_supporting_document, name='remove_gl_supporting_document'),
     path('tier3/', balance_sheet_view, name='reports_tier3'),
     path('upload-document/', upload_gl_supporting_document, name='upload_gl_supporting_document'),
+    path('documents/<uuid:document_id>/', download_gl_supporting_document, name='download_gl_supporting_document'),
     # --- gl review submit apis ---
     path('submit-review/', submit_gl_review_preparer, name='submit_gl_review_preparer'),
     path('submit-review/reviewer/', submit_gl_review_reviewer, name='submit_gl_review_reviewer'),
@@ -26,5 +31,8 @@ urlpatterns = [
     path('submit-review/bufc/', submit_gl_review_bufc, name='submit_gl_review_bufc'),
     path('trail/<str:gl_code>/', get_review_trail, name='get_review_trail'),
     path('trail-search/', review_trail_page, name='review_trail_page'),
+    path('api/queue/', gl_review_queue_api, name='gl_review_queue_api'),
+    path('api/gl-codes/', gl_code_autocomplete, name='gl_code_autocomplete'),
+    path('api/balance-sheet/', balance_sheet_grid_api, name='balance_sheet_grid_api'),
 ]
 
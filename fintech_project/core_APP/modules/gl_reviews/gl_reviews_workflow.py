@@ -0,0 +1,219 @@
+import logging
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from core_APP.models import ResponsibilityMatrix, TrialBalance, GLReview, ReviewTrail
+
+from .gl_reviews_trails import invalidate_trail_gl_codes
+from .gl_reviews_worklist import refresh_worklist
+
+
+logger = logging.getLogger(__name__)
+
+
+# stage:               who acts (reviewer = GL Review-II, fc = GL Review-III, tower = Tower Head)
+# status:              new gl_code_status of the actor's own assignment
+# counterpart_role:    the other ResponsibilityMatrix row that moves with it ...
+# counterpart_status:  ... and its new gl_code_status
+# requires_status:     counterpart must currently be in this status, otherwise the GL is skipped
+# route_to:            next GLReview.reviewer: 'role' (first route_role user in the department),
+#                      'previous' (whoever wrote the previous trail) or 'self'
+# previous_status:     on rejection, status pushed back onto the previous trail's matrix row
+# requires_trail:      a previous ReviewTrail must exist
+# keeps_notes:         GLReview.reconciliation_notes is left untouched
+Transition = namedtuple('Transition', [
+    'stage', 'action', 'status', 'counterpart_role', 'counterpart_status', 'requires_status',
+    'route_to', 'route_role', 'previous_status', 'requires_trail', 'keeps_notes', 'trail_action',
+])
+
+TRANSITIONS = {
+    ('reviewer', 'approve'): Transition('reviewer', 'approve', 3, 4, 3, None, 'role', 3, None, True, False, 'Approved'),
+    ('reviewer', 'reject'): Transition('reviewer', 'reject', 4, 4, 4, None, 'previous', None, 4, True, False, 'Rejected'),
+    ('fc', 'approve'): Transition('fc', 'approve', 3, 5, 5, None, 'role', 2, None, True, False, 'Approved'),
+    ('fc', 'reject'): Transition('fc', 'reject', 4, 5, 6, None, 'previous', None, 6, True, False, 'Rejected'),
+    ('tower', 'approve'): Transition('tower', 'approve', 7, 3, 7, 3, 'self', None, None, False, True, 'Approved'),
+    ('tower', 'reject'): Transition('tower', 'reject', 8, 3, 8, 3, 'self', None, None, False, True, 'Rejected'),
+}
+
+# One processed GL: the actor's assignment, its GLReview, the new trail and who should be told about it
+# (the next reviewer, or the counterpart's owner when the GL stays with the actor)
+TransitionOutcome = namedtuple('TransitionOutcome', ['assignment', 'gl_review', 'trail', 'notify'])
+TransitionResult = namedtuple('TransitionResult', ['processed', 'skipped'])
+
+
+def get_transition(stage, action):
+    try:
+        return TRANSITIONS[(stage, action)]
+    except KeyError:
+        raise ValueError(f"Invalid action '{action}' for stage '{stage}'")
+
+
+def _first_by(rows, key):
+    index = {}
+    for row in rows:
+        index.setdefault(key(row), row)
+    return index
+
+
+def _group_ids(pairs):
+    """[(id, value), ...] -> {value: [id, ...]}"""
+    groups = {}
+    for row_id, value in pairs:
+        groups.setdefault(value, []).append(row_id)
+    return groups
+
+
+def apply_transition(actor, stage, action, assignment_ids, notes=None, gl_code=None):
+    """
+    Move every GL behind `assignment_ids` (owned by `actor`) through one workflow transition.
+
+    All rows are read with select_for_update inside a single transaction, then written back
+    with one UPDATE per target status and one bulk ReviewTrail insert, so the query count
+    does not depend on how many GLs are selected. The worklist read model is refreshed in the
+    same transaction. GLs that cannot make the transition are returned in `skipped` as
+    (gl_code or assignment id, reason) instead of failing the whole batch.
+    """
+    transition = get_transition(stage, action)
+    skipped = []
+    processed = []
+
+    with transaction.atomic():
+        # of=('self',): department is a nullable FK, and PostgreSQL can't lock the nullable
+        # side of the outer join select_related() adds for it
+        assignment_qs = ResponsibilityMatrix.objects.select_for_update(of=('self',)).filter(
+            id__in=assignment_ids,
+            user=actor,
+            gl_code__isnull=False
+        )
+        if gl_code:
+            assignment_qs = assignment_qs.filter(gl_code=gl_code)
+        assignments = list(assignment_qs.select_related('department'))
+        found_ids = {str(a.id) for a in assignments}
+        skipped.extend((a_id, "Assignment not found") for a_id in map(str, assignment_ids) if a_id not in found_ids)
+        if not assignments:
+            return TransitionResult(processed, skipped)
+
+        gl_codes = {a.gl_code for a in assignments}
+
+        counterparts = _first_by(
+            ResponsibilityMatrix.objects.select_for_update(of=('self',))
+            .filter(gl_code__in=gl_codes, user_role=transition.counterpart_role)
+            .select_related('user')
+            .order_by('user', 'gl_code'),
+            lambda rm: rm.gl_code
+        )
+
+        trial_balances = _first_by(
+            TrialBalance.objects.filter(gl_code__in=gl_codes).order_by('-added_at').only('id', 'gl_code', 'added_at'),
+            lambda tb: tb.gl_code
+        )
+
+        last_trail = ReviewTrail.objects.filter(gl_review=OuterRef('pk')).order_by('-created_at').values('id')[:1]
+        gl_reviews = _first_by(
+            GLReview.objects.select_for_update()
+            .filter(trial_balance_id__in=[tb.id for tb in trial_balances.values()])
+            .annotate(last_trail_id=Subquery(last_trail))
+            .order_by('-reviewed_at'),
+            lambda r: r.trial_balance_id
+        )
+
+        previous_trails = ReviewTrail.objects.select_related(
+            'reviewer', 'reviewer_responsibility_matrix'
+        ).in_bulk([r.last_trail_id for r in gl_reviews.values() if r.last_trail_id])
+
+        route_users = {}
+        if transition.route_to == 'role':
+            route_rows = ResponsibilityMatrix.objects.filter(
+                user_role=transition.route_role,
+                department_id__in={a.department_id for a in assignments}
+            ).select_related('user').order_by('user', 'gl_code')
+            route_users = {
+                department_id: rm.user
+                for department_id, rm in _first_by(route_rows, lambda rm: rm.department_id).items()
+            }
+
+        status_updates = {}
+        reviews_to_update = []
+        new_trails = []
+
+        for assignment in assignments:
+            code = assignment.gl_code
+            counterpart = counterparts.get(code)
+            trial_balance = trial_balances.get(code)
+            gl_review = gl_reviews.get(trial_balance.id) if trial_balance else None
+            previous_trail = previous_trails.get(gl_review.last_trail_id) if gl_review else None
+
+            if not counterpart:
+                skipped.append((code, "No counterpart assignment found"))
+                continue
+            if transition.requires_status and counterpart.gl_code_status != transition.requires_status:
+                skipped.append((code, f"Not ready, current status: {counterpart.get_gl_code_status_display()}"))
+                continue
+            if not trial_balance:
+                skipped.append((code, "Trial balance not found"))
+                continue
+            if not gl_review:
+                skipped.append((code, "GL review not found"))
+                continue
+            if transition.requires_trail and not previous_trail:
+                skipped.append((code, "Previous trail not found"))
+                continue
+
+            if transition.route_to == 'role':
+                next_reviewer = route_users.get(assignment.department_id)
+                if not next_reviewer:
+                    skipped.append((code, "No next reviewer found for the department"))
+                    continue
+                notify = next_reviewer
+            elif transition.route_to == 'previous':
+                next_reviewer = previous_trail.reviewer
+                if not next_reviewer:
+                    skipped.append((code, "Previous reviewer no longer exists"))
+                    continue
+                notify = next_reviewer
+            else:
+                next_reviewer = actor
+                notify = counterpart.user
+
+            status_updates[assignment.id] = transition.status
+            status_updates[counterpart.id] = transition.counterpart_status
+            if transition.previous_status and previous_trail.reviewer_responsibility_matrix_id:
+                status_updates[previous_trail.reviewer_responsibility_matrix_id] = transition.previous_status
+            assignment.gl_code_status = transition.status
+
+            gl_review.reviewer = next_reviewer
+            if not transition.keeps_notes:
+                gl_review.reconciliation_notes = notes
+            reviews_to_update.append(gl_review)
+
+            trail = ReviewTrail(
+                reviewer=actor,
+                reviewer_responsibility_matrix=assignment,
+                gl_review=gl_review,
+                previous_trail=previous_trail,
+                reconciliation_notes=notes,
+                gl_code=code,
+                gl_account_id=assignment.gl_account_id,
+                action=transition.trail_action,
+            )
+            new_trails.append(trail)
+            processed.append(TransitionOutcome(assignment, gl_review, trail, notify))
+
+        # One UPDATE per target status / next reviewer rather than one per row
+        for status, rm_ids in _group_ids(status_updates.items()).items():
+            ResponsibilityMatrix.objects.filter(id__in=rm_ids).update(gl_code_status=status)
+        review_groups = _group_ids((r.id, r.reviewer_id) for r in reviews_to_update)
+        for reviewer_id, review_ids in review_groups.items():
+            fields = {'reviewer_id': reviewer_id}
+            if not transition.keeps_notes:
+                fields['reconciliation_notes'] = notes
+            GLReview.objects.filter(id__in=review_ids).update(**fields)
+        ReviewTrail.objects.bulk_create(new_trails)
+        if new_trails:
+            invalidate_trail_gl_codes()
+        refresh_worklist(outcome.assignment.gl_code for outcome in processed)
+
+    logger.info(f"{stage} {action} by {actor}: {len(processed)} processed, {len(skipped)} skipped")
+    return TransitionResult(processed, skipped)
@@ -0,0 +1,367 @@
+import base64
+import binascii
+import json
+import uuid
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import transaction
+from django.db.models import Prefetch, Q
+from django.urls import reverse
+
+from core_APP.models import (
+    GLAccount, ResponsibilityMatrix, TrialBalance, GLReview, GLSupportingDocument, GLWorklistEntry,
+)
+
+from .gl_reviews_trails import summarize_trails
+
+
+def _first_by(rows, key):
+    """Keep the first row seen for each key (rows must already be in `.first()` order)."""
+    index = {}
+    for row in rows:
+        index.setdefault(key(row), row)
+    return index
+
+
+def serialize_supporting_documents(docs):
+    return [
+        {
+            'id': str(doc.id),
+            'file_name': doc.file_name or (doc.file.name.split('/')[-1] if doc.file else 'Unknown'),
+            'file_url': reverse('download_gl_supporting_document', args=[doc.id]) if doc.file else '#',
+            'uploaded_at': doc.uploaded_at.strftime("%B %d, %Y at %I:%M %p") if doc.uploaded_at else 'N/A',
+        }
+        for doc in docs
+    ]
+
+
+def load_gl_reviews(gl_codes):
+    """
+    Latest TrialBalance per gl_code and its latest GLReview (with supporting documents
+    prefetched), both overall and per user, in three queries.
+    Returns (tb_any, tb_own, review_any, review_own):
+      tb_any[gl_code], tb_own[(user_id, gl_code)],
+      review_any[trial_balance_id], review_own[(reviewer_id, trial_balance_id)]
+    """
+    trial_balances = list(
+        TrialBalance.objects
+        .filter(gl_code__in=gl_codes)
+        .order_by('-added_at')
+        .only('id', 'user_id', 'gl_code', 'added_at')
+    )
+    tb_any = _first_by(trial_balances, lambda tb: tb.gl_code)
+    tb_own = _first_by(trial_balances, lambda tb: (tb.user_id, tb.gl_code))
+
+    tb_ids = {tb.id for tb in tb_any.values()} | {tb.id for tb in tb_own.values()}
+    reviews = list(
+        GLReview.objects
+        .filter(trial_balance_id__in=tb_ids)
+        .select_related('reviewer')
+        .order_by('-reviewed_at')
+        .prefetch_related(Prefetch(
+            'supporting_documents',
+            queryset=GLSupportingDocument.objects.order_by('-uploaded_at'),
+        ))
+    )
+    review_any = _first_by(reviews, lambda r: r.trial_balance_id)
+    review_own = _first_by(reviews, lambda r: (r.reviewer_id, r.trial_balance_id))
+    return tb_any, tb_own, review_any, review_own
+
+
+def last_stage_text(gl_review, reviewer_status):
+    """
+    Which review stage the GL last went through, as shown to the Tower Head.
+    Fallback for GLs whose trail chain doesn't tell (see gl_reviews_trails.current_stage).
+    """
+    if not gl_review or not gl_review.reviewer:
+        return ''
+    if gl_review.reviewer.user_type != 4:
+        return "GL Review-III (Finance Controller)"
+    if reviewer_status is None or reviewer_status == 4:
+        return "GL Review-I (Preparer)"
+    return "GL Review-II (Reviewer)"
+
+
+def _is_actionable(user_role, status_code, fc_status, preparer_status):
+    if user_role == 2:
+        return fc_status == 3
+    if user_role == 3:
+        return status_code in (1, 8)
+    if user_role == 4:
+        return status_code in (1, 4)
+    return status_code in (1, 4, 6) and preparer_status == 2
+
+
+# -------------------------------
+# Read model maintenance
+# -------------------------------
+
+REFRESH_CHUNK_SIZE = 500
+
+
+def _build_entries(gl_codes):
+    """Unsaved GLWorklistEntry rows for every assignment on `gl_codes`, from a fixed number of bulk reads."""
+    assignments = list(
+        ResponsibilityMatrix.objects
+        .filter(gl_code__in=gl_codes)
+        .select_related('department')
+        .order_by('user', 'gl_code')
+    )
+    gl_names = GLAccount.objects.names_for(gl_codes)
+    role_status = {}
+    for assignment in assignments:
+        role_status.setdefault((assignment.gl_code, assignment.user_role), assignment.gl_code_status)
+
+    tb_any, tb_own, review_any, review_own = load_gl_reviews(gl_codes)
+    trail_summaries = summarize_trails(
+        {a.gl_code for a in assignments if a.user_role == 2}
+    )
+
+    entries = []
+    for assignment in assignments:
+        gl_code = assignment.gl_code
+        if assignment.user_role == 4:
+            trial_balance = tb_own.get((assignment.user_id, gl_code))
+            gl_review = review_own.get((assignment.user_id, trial_balance.id)) if trial_balance else None
+        else:
+            trial_balance = tb_any.get(gl_code)
+            gl_review = review_any.get(trial_balance.id) if trial_balance else None
+
+        # Notes always come from the latest review on the latest TrialBalance
+        latest_tb = tb_any.get(gl_code)
+        latest_review = review_any.get(latest_tb.id) if latest_tb else None
+
+        status_code = assignment.gl_code_status or 1
+        fc_status = role_status.get((gl_code, 3)) or 1
+        reviewer_status = role_status.get((gl_code, 5))
+        preparer_status = role_status.get((gl_code, 4))
+        is_actionable = _is_actionable(assignment.user_role, status_code, fc_status, preparer_status)
+
+        if assignment.user_role == 2:
+            summary = trail_summaries.get(gl_code)
+            status_text = (summary and summary.current_stage) or last_stage_text(gl_review, reviewer_status)
+        else:
+            status_text = assignment.get_gl_code_status_display() if assignment.gl_code_status else 'Pending'
+
+        documents = serialize_supporting_documents(gl_review.supporting_documents.all() if gl_review else [])
+        entries.append(GLWorklistEntry(
+            user_id=assignment.user_id,
+            assignment=assignment,
+            gl_code=gl_code,
+            gl_name=gl_names.get(gl_code),
+            department_name=assignment.department.name if assignment.department else None,
+            user_role=assignment.user_role,
+            status_code=status_code,
+            status_text=status_text,
+            fc_status=fc_status,
+            reviewer_status=reviewer_status,
+            preparer_status=preparer_status,
+            is_actionable=is_actionable,
+            sort_bucket=0 if is_actionable else 1 if status_code in (7, 8) else 2,
+            trial_balance_id=trial_balance.id if trial_balance else None,
+            gl_review_id=gl_review.id if gl_review else None,
+            reconciliation_notes=latest_review.reconciliation_notes if gl_review and latest_review else None,
+            supporting_documents=documents,
+            document_count=len(documents),
+            assigned_on=assignment.created_at,
+        ))
+    return entries
+
+
+def refresh_worklist(gl_codes):
+    """
+    Recompute the GLWorklistEntry rows of every assignment on `gl_codes`.
+
+    A GL's entries depend on each other (the Tower Head row shows the FC status and so on),
+    so every user's row for a code is rebuilt together: read in bulk, then replaced with one
+    DELETE and one bulk INSERT per chunk. Call it inside the transaction that made the change.
+    Returns the number of entries written.
+    """
+    gl_codes = sorted({code for code in gl_codes if code})
+    written = 0
+    for start in range(0, len(gl_codes), REFRESH_CHUNK_SIZE):
+        chunk = gl_codes[start:start + REFRESH_CHUNK_SIZE]
+        with transaction.atomic():
+            entries = _build_entries(chunk)
+            # Also drop entries whose assignment has since moved to another gl_code
+            GLWorklistEntry.objects.filter(
+                Q(gl_code__in=chunk) | Q(assignment_id__in=[e.assignment_id for e in entries])
+            ).delete()
+            GLWorklistEntry.objects.bulk_create(entries)
+        written += len(entries)
+    return written
+
+
+def rebuild_worklist():
+    """Rebuild the whole read model from the source tables. Returns the number of entries written."""
+    gl_codes = set(
+        ResponsibilityMatrix.objects
+        .filter(gl_code__isnull=False)
+        .values_list('gl_code', flat=True)
+        .distinct()
+    )
+    with transaction.atomic():
+        GLWorklistEntry.objects.exclude(gl_code__in=gl_codes).delete()
+        return refresh_worklist(gl_codes)
+
+
+# -------------------------------
+# Reads
+# -------------------------------
+
+# Page / keyset ordering per user_type: (field, descending)
+# Tower Head: actionable first, then Tower Head decisions, then the rest
+QUEUE_ORDERING = {
+    2: [('sort_bucket', False), ('assigned_on', True), ('id', True)],
+    3: [('assigned_on', True), ('id', True)],
+    4: [('gl_code', False), ('id', False)],
+}
+
+
+def queue_ordering(user):
+    return QUEUE_ORDERING.get(user.user_type, QUEUE_ORDERING[3])
+
+
+def queue_order_by(user):
+    return [f"-{field}" if descending else field for field, descending in queue_ordering(user)]
+
+
+def worklist_queryset(user, role=None):
+    """The user's GLWorklistEntry rows for their GL review page, in page order."""
+    qs = GLWorklistEntry.objects.filter(user=user)
+    if user.user_type == 2:
+        qs = qs.filter(user_role=2)
+    elif user.user_type == 4:
+        qs = qs.filter(user_role__in=[role] if role in (4, 5) else [4, 5])
+    return qs.order_by(*queue_order_by(user))
+
+
+def worklist_row(entry):
+    """Template/API row for one GLWorklistEntry."""
+    return {
+        'assignment_id': str(entry.assignment_id),
+        'gl_code': entry.gl_code,
+        'gl_name': entry.gl_name or 'N/A',
+        'department': entry.department_name or 'N/A',
+        'user_role': entry.get_user_role_display(),
+        'status': entry.status_text,
+        'status_code': entry.status_code,
+        'fc_status': entry.fc_status,
+        'reviewer_assignment_status': entry.reviewer_status,
+        'preparer_assignment_status': entry.preparer_status if entry.user_role == 5 else None,
+        'is_actionable': entry.is_actionable,
+        'assigned_on': entry.assigned_on.strftime("%B %d, %Y at %I:%M %p"),
+        'assigned_on_datetime': entry.assigned_on,
+        'reconciliation_notes': entry.reconciliation_notes or 'N/A',
+        'trial_balance_id': str(entry.trial_balance_id) if entry.trial_balance_id else None,
+        'gl_review_id': str(entry.gl_review_id) if entry.gl_review_id else None,
+        'supporting_documents': entry.supporting_documents,
+        'document_count': entry.document_count,
+    }
+
+
+def build_user_gl_worklist(user):
+    """Preparer/reviewer GL lists for a user_type 4 user, from one SELECT. Returns (preparer_gls, reviewer_gls)."""
+    preparer_gls = []
+    reviewer_gls = []
+    for entry in worklist_queryset(user):
+        (preparer_gls if entry.user_role == 4 else reviewer_gls).append(worklist_row(entry))
+    return preparer_gls, reviewer_gls
+
+
+# -------------------------------
+# Keyset-paginated review queue
+# -------------------------------
+
+def _cursor_value(value):
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_cursor_value(v) for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Raises ValueError on a malformed cursor."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def clean_cursor_values(model, ordering, values):
+    """
+    Cursor values converted to the types of the `ordering` fields of `model`, so a well-formed
+    cursor carrying the wrong kind of value is a ValueError rather than a failing query.
+    Keys that aren't model fields are the text sort annotations.
+    """
+    if len(values) != len(ordering):
+        raise ValueError("Invalid cursor")
+    cleaned = []
+    for (key, _), value in zip(ordering, values):
+        try:
+            field = model._meta.get_field(key)
+        except FieldDoesNotExist:
+            field = None
+        if isinstance(value, (list, dict)) or (field is None and not isinstance(value, str)):
+            raise ValueError("Invalid cursor")
+        if field is not None:
+            try:
+                value = field.to_python(value)
+            except ValidationError:
+                raise ValueError("Invalid cursor")
+            if value is None and not field.null:
+                raise ValueError("Invalid cursor")
+        cleaned.append(value)
+    return cleaned
+
+
+def keyset_filter(ordering, values):
+    """Rows strictly after `values` in `ordering`: (a > x) OR (a = x AND b > y) OR ..."""
+    if len(values) != len(ordering):
+        raise ValueError("Invalid cursor")
+    condition = Q()
+    for i, (field, descending) in enumerate(ordering):
+        step = Q(**{f"{field}__{'lt' if descending else 'gt'}": values[i]})
+        for j, (prev_field, _) in enumerate(ordering[:i]):
+            step &= Q(**{prev_field: values[j]})
+        condition |= step
+    return condition
+
+
+def gl_queue_page(user, cursor=None, limit=50, role=None, status_code=None, department=None, actionable=None):
+    """
+    One page of the review queue plus the cursor for the next one (None on the last page).
+    A single indexed SELECT on the worklist read model, whatever the page size or queue length.
+    """
+    ordering = queue_ordering(user)
+    qs = worklist_queryset(user, role)
+    if status_code is not None:
+        qs = qs.filter(status_code=status_code)
+    if department:
+        qs = qs.filter(department_name=department)
+    if actionable is not None:
+        qs = qs.filter(is_actionable=actionable)
+    if cursor:
+        qs = qs.filter(keyset_filter(ordering, clean_cursor_values(GLWorklistEntry, ordering, decode_cursor(cursor))))
+
+    entries = list(qs[:limit + 1])
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_cursor([getattr(entries[-1], field) for field, _ in ordering])
+
+    results = []
+    for entry in entries:
+        row = worklist_row(entry)
+        del row['assigned_on_datetime']
+        results.append(row)
+    return results, next_cursor
@@ -1,5 +1,4 @@
 import logging
-from hdbcli import dbapi
 import os
 from django.shortcuts import render
 from django.contrib.auth import authenticate, login
@@ -7,15 +6,26 @@ from django.shortcuts import redirect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from core_APP.modules.link_data.link_data_forms import UploadedFileForm, SAPLinkForm
-from core_APP.models import LinkedData, UploadedFile, SAPLink
+from core_APP.models import ChunkedUpload, LinkedData, UploadedFile, SAPLink, SapImportJob
 from django.db import transaction
 from django.db.models import OuterRef, Subquery
-from django.http import JsonResponse
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 import json
 import traceback
-from core_APP.models import TrialBalance, BalanceSheet
+from core_APP.hana_pool import PoolExhausted
+from core_APP.blob_store import store_blob, upload_digest
+from core_APP.protected_media import serve_protected
+from .link_data_sap import SAP_LOCAL_FIELDS, local_fields_for, schema_columns, table_columns
+from .link_data_sap_jobs import enqueue_import_all, enqueue_table_import, job_events, read_progress
+from .link_data_chunked import (
+    ChunkError, append_chunk, discard_part, open_assembled, part_sha256, start_upload,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -104,19 +114,157 @@ def handle_upload(request):
                 return redirect("link_data_page")
 
             with transaction.atomic():
-                uf = form.save(commit=False)
-                uf.user = request.user
-                uf.save()
-
-                LinkedData.objects.create(
-                    user=request.user,
-                    data_source=data_source,
-                    data_id=str(uf.id),
+                save_uploaded_file(
+                    request.user, uploaded, form.cleaned_data["table_type"], data_source,
+                    upload_digest(request, "file", uploaded),
                 )
             return redirect("link_data_page")
     return redirect("link_data_page")
 
 
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def download_uploaded_file(request, file_id):
+    """An uploaded source file, for the user who uploaded it."""
+    uploaded = UploadedFile.objects.filter(id=file_id).first()
+    if not uploaded or not uploaded.file:
+        raise Http404("File not found.")
+    if uploaded.user_id != request.user.id and not request.user.is_superuser:
+        raise PermissionDenied("You do not have access to this file.")
+    return serve_protected(request, uploaded.file, uploaded.file_name or uploaded.file.name.split("/")[-1])
+
+
+def save_uploaded_file(user, uploaded, table_type, data_source, sha256):
+    """Store the bytes once per content and record the UploadedFile and its LinkedData row. Call inside a transaction."""
+    blob = store_blob(uploaded, sha256)
+    uf = UploadedFile.objects.create(
+        user=user,
+        blob=blob,
+        file=blob.file.name,
+        file_name=os.path.basename(uploaded.name),
+        table_type=table_type,
+    )
+    LinkedData.objects.create(
+        user=user,
+        data_source=data_source,
+        data_id=str(uf.id),
+    )
+    return uf
+
+
+def _chunked_upload_state(upload):
+    return {
+        "upload_id": str(upload.id),
+        "offset": upload.received,
+        "total_size": upload.total_size,
+        "status": upload.status,
+        "chunk_size": settings.CHUNKED_UPLOAD_CHUNK_SIZE,
+    }
+
+
+@login_required
+@require_http_methods(["POST"])
+def chunked_upload_start(request):
+    """
+    Start a resumable upload: POST file_name, table_type and total_size (bytes).
+    Returns the upload_id and the offset (0) to send the first chunk from.
+    """
+    file_name = os.path.basename(request.POST.get("file_name", "").strip())
+    table_type = request.POST.get("table_type")
+    data_source = EXT_TO_SOURCE.get(os.path.splitext(file_name)[1].lower())
+    try:
+        total_size = int(request.POST.get("total_size", ""))
+    except ValueError:
+        return JsonResponse({"error": "total_size must be a number of bytes."}, status=400)
+
+    if not data_source:
+        return JsonResponse({"error": "Unsupported file type."}, status=400)
+    if table_type not in dict(UploadedFile.TABLE_TYPE_CHOICES):
+        return JsonResponse({"error": "Invalid table type."}, status=400)
+    if not 0 < total_size <= settings.CHUNKED_UPLOAD_MAX_SIZE:
+        return JsonResponse({"error": f"Files must be 1 to {settings.CHUNKED_UPLOAD_MAX_SIZE} bytes."}, status=400)
+
+    upload = ChunkedUpload.objects.create(
+        user=request.user, file_name=file_name, table_type=table_type, total_size=total_size,
+    )
+    start_upload(upload)
+    return JsonResponse(_chunked_upload_state(upload), status=201)
+
+
+@login_required
+@require_http_methods(["GET", "POST"])
+def chunked_upload_chunk(request, upload_id):
+    """
+    GET: the upload's confirmed offset, to resume an interrupted upload from.
+    POST: append the raw request body (application/octet-stream) at ?offset=, optionally
+    verified against an X-Chunk-SHA256 header. A wrong offset gets 409 with the offset to resume from.
+    """
+    if request.method == "GET":
+        upload = ChunkedUpload.objects.filter(id=upload_id, user=request.user).first()
+        if not upload:
+            return JsonResponse({"error": "Upload not found."}, status=404)
+        return JsonResponse(_chunked_upload_state(upload))
+
+    try:
+        offset = int(request.GET.get("offset", ""))
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        return JsonResponse({"error": "offset must be a number of bytes."}, status=400)
+
+    with transaction.atomic():
+        # The row lock keeps two retries of the same chunk from writing at once
+        upload = ChunkedUpload.objects.select_for_update().filter(id=upload_id, user=request.user).first()
+        if not upload:
+            return JsonResponse({"error": "Upload not found."}, status=404)
+        if upload.status != "uploading":
+            return JsonResponse({"error": "Upload is already complete."}, status=409)
+        try:
+            append_chunk(upload, offset, request, length, request.headers.get("X-Chunk-SHA256"))
+        except ChunkError as e:
+            status = 409 if offset != e.offset else 400
+            return JsonResponse({"error": str(e), "offset": e.offset}, status=status)
+        upload.save(update_fields=["received", "updated_at"])
+
+    return JsonResponse(_chunked_upload_state(upload))
+
+
+@login_required
+@require_http_methods(["POST"])
+def chunked_upload_complete(request, upload_id):
+    """
+    Finish an upload once every byte has arrived. The assembled file is hashed and, when the
+    client sent `sha256`, checked against it before it becomes an UploadedFile.
+    """
+    with transaction.atomic():
+        upload = ChunkedUpload.objects.select_for_update().filter(id=upload_id, user=request.user).first()
+        if not upload:
+            return JsonResponse({"error": "Upload not found."}, status=404)
+        if upload.status != "uploading":
+            return JsonResponse({"error": "Upload is already complete."}, status=409)
+        if upload.received != upload.total_size:
+            return JsonResponse(
+                {"error": "Upload is not finished.", "offset": upload.received}, status=409,
+            )
+
+        sha256 = part_sha256(upload)
+        expected = request.POST.get("sha256", "").strip().lower()
+        if expected and expected != sha256:
+            # The assembled bytes are wrong somewhere; start over rather than resume
+            discard_part(upload)
+            upload.delete()
+            return JsonResponse({"error": "Checksum mismatch, upload the file again."}, status=422)
+
+        data_source = EXT_TO_SOURCE[os.path.splitext(upload.file_name)[1].lower()]
+        with open_assembled(upload) as assembled:
+            upload.uploaded_file = save_uploaded_file(request.user, assembled, upload.table_type, data_source, sha256)
+        upload.status = "complete"
+        upload.save(update_fields=["uploaded_file", "status", "updated_at"])
+        # Left over when the blob already existed (otherwise it was moved into place)
+        transaction.on_commit(lambda: discard_part(upload))
+
+    return JsonResponse({**_chunked_upload_state(upload), "uploaded_file_id": str(upload.uploaded_file_id), "sha256": sha256})
+
+
 @login_required
 def link_data_connect_erp(request):
     """Handle SAP ERP connection submission."""
@@ -155,7 +303,7 @@ def link_data_connect_api(request):
 def link_sap_erp_to_unified_db(request, saplink_id, table_name):
     """
     Connect to SAP HANA, fetch column metadata (GET)
-    or import mapped data to local DB (POST).
+    or queue an import of the mapped data into the local DB (POST).
     """
     user = request.user
     try:
@@ -169,127 +317,32 @@ def link_sap_erp_to_unified_db(request, saplink_id, table_name):
         if saplink.system_type != 'sap_hana':
             return JsonResponse({"error": "Only SAP HANA connections are supported."}, status=400)
 
-        print("saplink.hana_host:", saplink.hana_host)
-        host_name = saplink.hana_host[:-4]
-        port = int(saplink.hana_port)
-        print(f"Connecting to: {host_name}:{port}")
-
-        connection_params = {
-            'address': host_name,
-            'port': port,
-            'user': saplink.username,
-            'password': saplink.password,
-            'encrypt': True,
-            'sslValidateCertificate': False,  # For development only
-        }
-
-        if 'hanacloud.ondemand.com' in host_name:
-            connection_params.update({
-                'sslCryptoProvider': 'openssl',
-                'sslTrustStore': None,  # Use system trust store
-            })
-
         # Handle GET: fetch SAP column metadata
         if request.method == "GET":
-            conn = dbapi.connect(**connection_params)
-            cursor = conn.cursor()
-            cursor.execute(f"""
-                SELECT COLUMN_NAME, DATA_TYPE_NAME
-                FROM SYS.TABLE_COLUMNS
-                WHERE SCHEMA_NAME = '{saplink.hana_database}'
-                AND TABLE_NAME = '{table_name.upper()}'
-                ORDER BY POSITION
-            """)
-            columns = [{"name": r[0], "type": r[1]} for r in cursor.fetchall()]
-            cursor.close()
-            conn.close()
-
-            # Define local Django fields for mapping
-            if table_name == "trial_balance":
-                local_fields = [
-                    "gl_code", "gl_name", "group_gl_code", "group_gl_name",
-                    "amount", "fs_main_head", "fs_sub_head", "fiscal_year",
-                ]
-            else:
-                local_fields = [
-                    "BS_PL","status","gl_acct","gl_account_name","main_head","sub_head",
-                    "cml","frequency","responsible_department","department_spoc","department_reviewer",
-                    "query_type_action_points","working_needed","confirmation_type","recon_status",
-                    "variance_percent","flag_color","report_type","analysis_required","review_checkpoint_abex","fiscal_year"
-                ]
-
-            return JsonResponse({"columns": columns, "local_fields": local_fields})
+            columns = table_columns(
+                saplink, saplink.hana_database, table_name.upper(), refresh=request.GET.get("refresh") == "1",
+            )
+
+            return JsonResponse({"columns": columns, "local_fields": local_fields_for(table_name)})
 
         # Handle POST: import data using mapping
         elif request.method == "POST":
-            body = json.loads(request.body.decode("utf-8"))
-            mapping = body.get("mapping", {})
-
-            conn = dbapi.connect(**connection_params)
-            cursor = conn.cursor()
-            cursor.execute(f'SELECT * FROM "{saplink.hana_database}"."{table_name.upper()}"')
-            rows = cursor.fetchall()
-            col_names = [desc[0] for desc in cursor.description]
-            cursor.close()
-            conn.close()
-
-            inserted_count = 0
+            if table_name not in SAP_LOCAL_FIELDS:
+                return JsonResponse({"error": "Unknown target table."}, status=400)
+            body = json.loads(request.body.decode("utf-8") or "{}")
+            # No mapping: re-sync with the mapping and watermark column saved by the last sync
+            mapping = body.get("mapping") or {}
+            watermark_column = body.get("watermark_column") or None
+
+            # The import runs in the run_sap_imports worker; the page follows it over the job's event stream
+            try:
+                job = enqueue_table_import(
+                    saplink, user, table_name, mapping, watermark_column, full=body.get("mode") == "full",
+                )
+            except ValueError as e:
+                return JsonResponse({"error": str(e)}, status=400)
 
-            with transaction.atomic():
-                if table_name == "trial_balance":
-                    objs = []
-                    for row in rows:
-                        row_dict = dict(zip(col_names, row))
-                        objs.append(TrialBalance(
-                            user=user,
-                            gl_code=row_dict.get(mapping.get("gl_code")),
-                            gl_name=row_dict.get(mapping.get("gl_name")),
-                            group_gl_code=row_dict.get(mapping.get("group_gl_code")),
-                            group_gl_name=row_dict.get(mapping.get("group_gl_name")),
-                            amount=row_dict.get(mapping.get("amount")) or 0,
-                            fs_main_head=row_dict.get(mapping.get("fs_main_head")),
-                            fs_sub_head=row_dict.get(mapping.get("fs_sub_head")),
-                            fiscal_year=row_dict.get(mapping.get("fiscal_year")),
-                        ))
-                    TrialBalance.objects.bulk_create(objs)
-                    inserted_count = len(objs)
-
-                elif table_name == "balance_sheet":
-                    objs = []
-                    for row in rows:
-                        row_dict = dict(zip(col_names, row))
-                        objs.append(BalanceSheet(
-                            user=user,
-                            BS_PL=row_dict.get(mapping.get("BS_PL")),
-                            status=row_dict.get(mapping.get("status")),
-                            gl_acct=row_dict.get(mapping.get("gl_acct")),
-                            gl_account_name=row_dict.get(mapping.get("gl_account_name")),
-                            main_head=row_dict.get(mapping.get("main_head")),
-                            sub_head=row_dict.get(mapping.get("sub_head")),
-                            cml=row_dict.get(mapping.get("cml")),
-                            frequency=row_dict.get(mapping.get("frequency")),
-                            responsible_department=row_dict.get(mapping.get("responsible_department")),
-                            department_spoc=row_dict.get(mapping.get("department_spoc")),
-                            department_reviewer=row_dict.get(mapping.get("department_reviewer")),
-                            query_type_action_points=row_dict.get(mapping.get("query_type_action_points")),
-                            working_needed=row_dict.get(mapping.get("working_needed")),
-                            confirmation_type=row_dict.get(mapping.get("confirmation_type")),
-                            recon_status=row_dict.get(mapping.get("recon_status")),
-                            variance_percent=row_dict.get(mapping.get("variance_percent")),
-                            flag_color=row_dict.get(mapping.get("flag_color")),
-                            report_type=row_dict.get(mapping.get("report_type")),
-                            analysis_required=row_dict.get(mapping.get("analysis_required")),
-                            review_checkpoint_abex=row_dict.get(mapping.get("review_checkpoint_abex")),
-                            fiscal_year=row_dict.get(mapping.get("fiscal_year")),
-                        ))
-                    BalanceSheet.objects.bulk_create(objs)
-                    inserted_count = len(objs)
-
-                # Update SAPLink status to "imported"
-                saplink.status[table_name] = "imported"
-                saplink.save(update_fields=["status"])
-
-            return JsonResponse({"success": True, "imported_count": inserted_count})
+            return JsonResponse(_job_urls(job, success=True, tables=job.tables), status=202)
 
         else:
             return JsonResponse({"error": "Invalid request method."}, status=405)
@@ -297,6 +350,9 @@ def link_sap_erp_to_unified_db(request, saplink_id, table_name):
     except SAPLink.DoesNotExist:
         return JsonResponse({"error": "SAP Link not found."}, status=404)
 
+    except PoolExhausted as e:
+        return JsonResponse({"error": str(e)}, status=503)
+
     except Exception as e:
         print("SAP HANA connection error:", traceback.format_exc())
         return JsonResponse({"error": str(e)}, status=500)
@@ -307,48 +363,91 @@ def get_sap_columns(request, saplink_id, table_name):
     """AJAX endpoint: fetch SAP table columns."""
     try:
         saplink = SAPLink.objects.get(id=saplink_id, link__user=request.user)
-        conn = dbapi.connect(
-            address=saplink.hana_host[:-4],
-            port=int(saplink.hana_port),
-            user=saplink.username,
-            password=saplink.password,
-            encrypt=True,
-            sslValidateCertificate=False,
+        columns = table_columns(
+            saplink, saplink.hana_database, table_name.upper(), refresh=request.GET.get("refresh") == "1",
         )
-        cursor = conn.cursor()
-        cursor.execute(f"""
-            SELECT TABLE_NAME, SCHEMA_NAME
-            FROM SYS.TABLES
-            WHERE SCHEMA_NAME = '{saplink.hana_database}'
-        """)
-        print([r[0] for r in cursor.fetchall()])
-        cursor.execute(f"""
-            SELECT COLUMN_NAME, DATA_TYPE_NAME
-            FROM SYS.TABLE_COLUMNS
-            WHERE SCHEMA_NAME = '{saplink.hana_database}'
-            AND TABLE_NAME = UPPER('{table_name}')
-            ORDER BY POSITION
-        """)
-        columns = [{"name": r[0], "type": r[1]} for r in cursor.fetchall()]
         columns = [d for d in columns if d.get('name') != 'ID']
 
-        print(columns)
-        cursor.close()
-        conn.close()
+        return JsonResponse({"columns": columns, "local_fields": local_fields_for(table_name)})
+    except PoolExhausted as e:
+        return JsonResponse({"error": str(e)}, status=503)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
 
-        if table_name == "trial_balance":
-            local_fields = [
-                "gl_code", "gl_name", "group_gl_code", "group_gl_name",
-                "amount", "fs_main_head", "fs_sub_head", "fiscal_year",
-            ]
-        else:
-            local_fields = [
-                "BS_PL","status","gl_acct","gl_account_name","main_head","sub_head",
-                "cml","frequency","responsible_department","department_spoc","department_reviewer",
-                "query_type_action_points","working_needed","confirmation_type","recon_status",
-                "variance_percent","flag_color","report_type","analysis_required","review_checkpoint_abex","fiscal_year"
-            ]
-
-        return JsonResponse({"columns": columns, "local_fields": local_fields})
+@login_required
+def get_sap_schema_columns(request, saplink_id):
+    """AJAX endpoint: columns of every table in the SAP link's schema, fetched in one round trip."""
+    try:
+        saplink = SAPLink.objects.get(id=saplink_id, link__user=request.user)
+        tables = schema_columns(saplink, saplink.hana_database, refresh=request.GET.get("refresh") == "1")
+        return JsonResponse({
+            "schema": saplink.hana_database,
+            "tables": {table: [d for d in columns if d["name"] != "ID"] for table, columns in tables.items()},
+            "local_fields": SAP_LOCAL_FIELDS,
+        })
+    except SAPLink.DoesNotExist:
+        return JsonResponse({"error": "SAP Link not found."}, status=404)
+    except PoolExhausted as e:
+        return JsonResponse({"error": str(e)}, status=503)
     except Exception as e:
-        return JsonResponse({"error": str(e)}, status=500)
\ No newline at end of file
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@login_required
+@require_http_methods(["POST"])
+def sap_import_all(request, saplink_id):
+    """Queue a background job that syncs every connected table of the SAP link in parallel."""
+    try:
+        saplink = SAPLink.objects.get(id=saplink_id, link__user=request.user)
+    except SAPLink.DoesNotExist:
+        return JsonResponse({"error": "SAP Link not found."}, status=404)
+    try:
+        job = enqueue_import_all(saplink, request.user)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse(_job_urls(job, success=True, tables=job.tables), status=202)
+
+
+def _job_urls(job, **extra):
+    return {
+        "job_id": str(job.id),
+        "status_url": reverse("sap_import_job_status", args=[job.id]),
+        "events_url": reverse("sap_import_job_events", args=[job.id]),
+        **extra,
+    }
+
+
+@login_required
+def sap_import_job_status(request, job_id):
+    """AJAX endpoint: state of an import job and of each of its tables."""
+    try:
+        job = SapImportJob.objects.select_related("saplink").get(id=job_id, user=request.user)
+    except SapImportJob.DoesNotExist:
+        return JsonResponse({"error": "Import job not found."}, status=404)
+    synced = (job.saplink.status or {}).get("sync", {})
+    return JsonResponse(_job_urls(
+        job,
+        status=job.status,
+        error=job.error,
+        created_at=job.created_at.isoformat(),
+        started_at=job.started_at.isoformat() if job.started_at else None,
+        finished_at=job.finished_at.isoformat() if job.finished_at else None,
+        tables={
+            table: {key: synced.get(table, {}).get(key) for key in ("state", "rows_written", "rows_skipped", "synced_at", "error")}
+            for table in job.tables
+        },
+        progress=read_progress(job.id).get("tables", {}),
+    ))
+
+
+@login_required
+def sap_import_job_events(request, job_id):
+    """Server-Sent Events with the live progress of an import job, ending once it has finished."""
+    if not SapImportJob.objects.filter(id=job_id, user=request.user).exists():
+        return JsonResponse({"error": "Import job not found."}, status=404)
+    response = StreamingHttpResponse(job_events(job_id), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # nginx would otherwise buffer the stream and deliver the events in one lump at the end
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,112 @@
+import datetime
+import hashlib
+import logging
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+
+from core_APP.models import ChunkedUpload
+
+
+logger = logging.getLogger(__name__)
+
+
+COPY_BLOCK_SIZE = 256 * 1024
+
+
+class ChunkError(ValueError):
+    """A chunk that can't be appended. `offset` is where the client has to resume from."""
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+class AssembledFile(File):
+    """A completed part file. FileSystemStorage moves it into place instead of copying it."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def part_path(upload):
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f"{upload.id}.part")
+
+
+def start_upload(upload):
+    """Create the empty part file for a new ChunkedUpload."""
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    open(part_path(upload), 'wb').close()
+
+
+def append_chunk(upload, offset, stream, length, sha256=None):
+    """
+    Write `length` bytes read from `stream` at `offset` of the part file, a block at a time.
+
+    The chunk must start at the last confirmed offset. Bytes past it, left by an attempt
+    that broke off, are overwritten and truncated. With `sha256` the chunk is verified while
+    it is written and discarded on mismatch. A body that ends early still keeps what arrived.
+    Updates upload.received (not saved) and returns it. Lock the row before calling.
+    """
+    if offset != upload.received:
+        raise ChunkError(f"Expected offset {upload.received}, got {offset}.", upload.received)
+    if length <= 0 or length > settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+        raise ChunkError(f"Chunks must be 1 to {settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE} bytes.", upload.received)
+    if offset + length > upload.total_size:
+        raise ChunkError("Chunk runs past the declared file size.", upload.received)
+
+    digest = hashlib.sha256()
+    written = 0
+    with open(part_path(upload), 'r+b') as fh:
+        fh.seek(offset)
+        while written < length:
+            block = stream.read(min(COPY_BLOCK_SIZE, length - written))
+            if not block:
+                break
+            digest.update(block)
+            fh.write(block)
+            written += len(block)
+        if sha256 and (written < length or digest.hexdigest() != sha256.lower()):
+            fh.truncate(offset)
+            raise ChunkError("Chunk checksum mismatch.", upload.received)
+        fh.truncate()
+        fh.flush()
+        os.fsync(fh.fileno())
+
+    upload.received = offset + written
+    return upload.received
+
+
+def part_sha256(upload):
+    """SHA-256 of the assembled part file, read back a block at a time."""
+    digest = hashlib.sha256()
+    with open(part_path(upload), 'rb') as fh:
+        for block in iter(lambda: fh.read(COPY_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def open_assembled(upload):
+    return AssembledFile(open(part_path(upload), 'rb'), name=upload.file_name)
+
+
+def discard_part(upload):
+    try:
+        os.remove(part_path(upload))
+    except FileNotFoundError:
+        pass
+
+
+def purge_stale_uploads(hours=None):
+    """Delete unfinished uploads (and their part files) untouched for CHUNKED_UPLOAD_EXPIRY_HOURS. Returns the count."""
+    hours = settings.CHUNKED_UPLOAD_EXPIRY_HOURS if hours is None else hours
+    cutoff = timezone.now() - datetime.timedelta(hours=hours)
+    stale = list(ChunkedUpload.objects.filter(status="uploading", updated_at__lt=cutoff))
+    for upload in stale:
+        discard_part(upload)
+    ChunkedUpload.objects.filter(id__in=[upload.id for upload in stale]).delete()
+    if stale:
+        logger.info(f"Purged {len(stale)} stale chunked uploads")
+    return len(stale)
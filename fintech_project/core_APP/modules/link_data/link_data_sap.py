@@ -0,0 +1,289 @@
+import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from core_APP.hana_pool import hana_pool
+from core_APP.ingestion import INGEST_TARGETS, load_rows
+from core_APP.models import SAPLink
+
+
+# Local fields a SAP column can be mapped to, per target table
+SAP_LOCAL_FIELDS = {
+    "trial_balance": [
+        "gl_code", "gl_name", "group_gl_code", "group_gl_name",
+        "amount", "fs_main_head", "fs_sub_head", "fiscal_year",
+    ],
+    "balance_sheet": [
+        "BS_PL", "status", "gl_acct", "gl_account_name", "main_head", "sub_head",
+        "cml", "frequency", "responsible_department", "department_spoc", "department_reviewer",
+        "query_type_action_points", "working_needed", "confirmation_type", "recon_status",
+        "variance_percent", "flag_color", "report_type", "analysis_required", "review_checkpoint_abex", "fiscal_year",
+    ],
+}
+
+
+def local_fields_for(table_name):
+    return SAP_LOCAL_FIELDS["trial_balance" if table_name == "trial_balance" else "balance_sheet"]
+
+
+def quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def compile_mapping(table_name, mapping):
+    """
+    ([SAP columns to select], [(row index, local field)]) for a {local field: SAP column} mapping.
+    Only mapped columns are selected, so row positions line up with the field list.
+    Raises ValueError when the GL code column isn't mapped.
+    """
+    _, _, code_field, _ = INGEST_TARGETS[table_name]
+    # The mapping form sends "none" for fields the user chose to skip
+    pairs = [
+        (field, mapping[field]) for field in local_fields_for(table_name) if mapping.get(field) not in (None, '', 'none')
+    ]
+    if not any(field == code_field for field, _ in pairs):
+        raise ValueError(f"Map a SAP column to {code_field} before importing.")
+    return [column for _, column in pairs], [(i, field) for i, (field, _) in enumerate(pairs)]
+
+
+# -------------------------------
+# Table metadata (cached; SYS.TABLE_COLUMNS is slow on HANA Cloud)
+# -------------------------------
+
+def _columns_cache_key(saplink, schema, table):
+    return f"sap_columns:{saplink.pk}:{schema}:{table}"
+
+
+def _schema_cache_key(saplink, schema):
+    return f"sap_schema_columns:{saplink.pk}:{schema}"
+
+
+def query_table_columns(conn, schema, table):
+    """[{"name", "type"}] of one table, in column order."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT COLUMN_NAME, DATA_TYPE_NAME FROM SYS.TABLE_COLUMNS "
+            "WHERE SCHEMA_NAME = ? AND TABLE_NAME = ? ORDER BY POSITION",
+            [schema, table],
+        )
+        return [{"name": name, "type": data_type} for name, data_type in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def query_schema_columns(conn, schema):
+    """{table: [{"name", "type"}]} for every table of a schema, in one query."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE_NAME FROM SYS.TABLE_COLUMNS "
+            "WHERE SCHEMA_NAME = ? ORDER BY TABLE_NAME, POSITION",
+            [schema],
+        )
+        tables = {}
+        for table, name, data_type in cursor.fetchall():
+            tables.setdefault(table, []).append({"name": name, "type": data_type})
+        return tables
+    finally:
+        cursor.close()
+
+
+def table_columns(saplink, schema, table, refresh=False):
+    """Columns of schema.table, from the cache unless `refresh` or older than SAP_METADATA_CACHE_SECONDS."""
+    key = _columns_cache_key(saplink, schema, table)
+    columns = None if refresh else cache.get(key)
+    if columns is None:
+        with hana_pool.connection(saplink) as conn:
+            columns = query_table_columns(conn, schema, table)
+        cache.set(key, columns, settings.SAP_METADATA_CACHE_SECONDS)
+        if refresh:
+            # The schema-wide entry may hold the old columns
+            cache.delete(_schema_cache_key(saplink, schema))
+    return columns
+
+
+def schema_columns(saplink, schema, refresh=False):
+    """
+    Columns of every table in the schema from one round trip. Also fills the per-table
+    entries, so table_columns() is served from the cache afterwards.
+    """
+    key = _schema_cache_key(saplink, schema)
+    tables = None if refresh else cache.get(key)
+    if tables is None:
+        with hana_pool.connection(saplink) as conn:
+            tables = query_schema_columns(conn, schema)
+        entries = {_columns_cache_key(saplink, schema, table): columns for table, columns in tables.items()}
+        entries[key] = tables
+        cache.set_many(entries, settings.SAP_METADATA_CACHE_SECONDS)
+    return tables
+
+
+def _select_from(schema, table, since_column=None, since=None):
+    """The FROM ... [WHERE since_column >= ?] part of a table read, and its parameters."""
+    sql = f"FROM {quote_identifier(schema)}.{quote_identifier(table)}"
+    if since_column and since is not None:
+        return f"{sql} WHERE {quote_identifier(since_column)} >= ?", [since]
+    return sql, []
+
+
+def count_rows(conn, schema, table, since_column=None, since=None):
+    """How many rows stream_rows() will read with the same arguments."""
+    from_sql, params = _select_from(schema, table, since_column, since)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT COUNT(*) {from_sql}", params)
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def stream_rows(conn, schema, table, columns, fetch_size=None, since_column=None, since=None):
+    """
+    Rows of `schema.table` (only `columns`), fetched fetch_size at a time from a DB-API connection.
+    With a `since_column` they come in its order; with `since`, only rows at or past it.
+    """
+    fetch_size = fetch_size or settings.SAP_FETCH_SIZE
+    from_sql, params = _select_from(schema, table, since_column, since)
+    if since_column:
+        from_sql += f" ORDER BY {quote_identifier(since_column)}"
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT {', '.join(quote_identifier(c) for c in columns)} {from_sql}", params)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def import_sap_table(conn, schema, table_name, mapping, user, fetch_size=None, batch_size=None):
+    """
+    Stream a HANA table into TrialBalance / BalanceSheet: fetchmany() batches in, bulk upsert
+    batches out, so memory stays bounded whatever the table size. `conn` is any DB-API 2.0
+    connection (hdbcli in production). Returns (written, skipped). Call inside a transaction.
+    """
+    columns, index_map = compile_mapping(table_name, mapping)
+    rows = stream_rows(conn, schema, table_name.upper(), columns, fetch_size)
+    return load_rows(table_name, user, index_map, rows, batch_size, source=f"SAP {schema}.{table_name}")
+
+
+# -------------------------------
+# Delta sync
+# -------------------------------
+
+def _json_watermark(value):
+    """A watermark value SAPLink.status (JSON) can hold and HANA converts back when compared."""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat(sep=' ') if isinstance(value, datetime.datetime) else value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def sync_sap_table(conn, saplink, table_name, mapping, user, watermark_column=None, full=False,
+                   fetch_size=None, batch_size=None, progress=None):
+    """
+    Upsert a HANA table into TrialBalance / BalanceSheet and record the sync in SAPLink.status.
+
+    With a `watermark_column` (a change timestamp or increasing key) only rows at or past the
+    watermark stored by the previous sync are read; re-reading the boundary rows is harmless since
+    they are upserted. `full` (or a different watermark column than last time) reads everything.
+    The mapping and watermark are kept under status["sync"][table_name], so the next sync can reuse
+    them. `progress` is called with total_rows up front, then as load_rows() reports.
+    Returns that entry.
+
+    Called outside a transaction (as the import jobs do), each batch commits on its own, so tables
+    synced in parallel only briefly share locks on the GL accounts they have in common. Rows stream
+    in watermark order and the watermark is saved after every committed batch: a sync that fails
+    halfway keeps those batches and the next one resumes after them. Without a watermark column
+    it re-reads the table, and upserts the rows already in.
+    """
+    previous = (saplink.status or {}).get("sync", {}).get(table_name) or {}
+    if not mapping:
+        # A re-sync: run with the mapping and watermark column the table was set up with
+        mapping = previous.get("mapping") or {}
+        watermark_column = watermark_column or previous.get("watermark_column")
+        if not mapping:
+            raise ValueError(f"{table_name} has no saved column mapping yet; connect it first.")
+    since = None
+    if watermark_column and not full and previous.get("watermark_column") == watermark_column:
+        since = previous.get("watermark")
+
+    columns, index_map = compile_mapping(table_name, mapping)
+    select = columns + [watermark_column] if watermark_column else columns
+    if progress:
+        # One COUNT(*) up front gives the ETA something to aim at
+        progress(total_rows=count_rows(conn, saplink.hana_database, table_name.upper(), watermark_column, since))
+    rows = stream_rows(conn, saplink.hana_database, table_name.upper(), select, fetch_size, watermark_column, since)
+
+    high = [None]
+    read = [0]
+    saved = [since]
+
+    def track(rows):
+        # Rows read, and the highest watermark value among them
+        for row in rows:
+            read[0] += 1
+            value = row[-1] if watermark_column else None
+            if value is not None and (high[0] is None or value > high[0]):
+                high[0] = value
+            yield row
+
+    def checkpoint(**fields):
+        # Called once a batch is in: every row up to the highest watermark read so far is written
+        watermark = _json_watermark(high[0]) if high[0] is not None else None
+        if watermark is not None and watermark != saved[0]:
+            update_table_status(saplink, table_name, {
+                "mapping": mapping, "watermark_column": watermark_column, "watermark": watermark,
+            })
+            saved[0] = watermark
+        if progress:
+            progress(**fields)
+
+    written, skipped = load_rows(
+        table_name, user, index_map, track(rows), batch_size,
+        source=f"SAP {saplink.hana_database}.{table_name}", progress=checkpoint,
+    )
+
+    now = timezone.now()
+    entry = {
+        "state": "done",
+        "mode": "incremental" if since is not None else "full",
+        "mapping": mapping,
+        "watermark_column": watermark_column,
+        "watermark": _json_watermark(high[0]) if high[0] is not None else since,
+        "rows_read": read[0],
+        "rows_written": written,
+        "rows_skipped": skipped,
+        "synced_at": now.isoformat(),
+        "error": "",
+    }
+    update_table_status(saplink, table_name, entry, imported=True, synced_at=now)
+    return entry
+
+
+def update_table_status(saplink, table_name, changes, imported=False, synced_at=None):
+    """
+    Merge `changes` into saplink.status["sync"][table_name]. The row is re-read under a lock, so
+    tables synced in parallel don't overwrite each other's entries; `saplink` is refreshed too.
+    """
+    with transaction.atomic():
+        link = SAPLink.objects.select_for_update().get(pk=saplink.pk)
+        status = link.status or {}
+        status.setdefault("sync", {}).setdefault(table_name, {}).update(changes)
+        update_fields = ["status"]
+        if imported:
+            status[table_name] = "imported"
+        if synced_at:
+            link.last_synced_at = synced_at
+            update_fields.append("last_synced_at")
+        link.status = status
+        link.save(update_fields=update_fields)
+    saplink.status, saplink.last_synced_at = link.status, link.last_synced_at
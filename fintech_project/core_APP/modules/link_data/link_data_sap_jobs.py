@@ -0,0 +1,298 @@
+import copy
+import datetime
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core_APP.gl_index import gl_code_index
+from core_APP.hana_pool import hana_pool
+from core_APP.models import SAPLink, SapImportJob
+from .link_data_sap import SAP_LOCAL_FIELDS, compile_mapping, sync_sap_table, update_table_status
+
+
+logger = logging.getLogger(__name__)
+
+
+def syncable_tables(saplink):
+    """Tables of the link that have a saved mapping, i.e. that a re-sync can run for."""
+    synced = (saplink.status or {}).get("sync", {})
+    return [table for table in SAP_LOCAL_FIELDS if synced.get(table, {}).get("mapping")]
+
+
+def enqueue_import(saplink, user, tables, full=False):
+    """Queue a job syncing `tables` of the link with their saved mappings."""
+    for table in tables:
+        update_table_status(saplink, table, {"state": "queued", "error": ""})
+    job = SapImportJob.objects.create(saplink=saplink, user=user, tables=tables, full=full)
+    # Event streams follow the job through the progress cache from the start
+    ImportProgress(job)
+    return job
+
+
+def enqueue_import_all(saplink, user):
+    """Queue a job syncing every connected table of the link. Raises ValueError when none is connected."""
+    tables = syncable_tables(saplink)
+    if not tables:
+        raise ValueError("Connect at least one table before importing all.")
+    return enqueue_import(saplink, user, tables)
+
+
+def enqueue_table_import(saplink, user, table_name, mapping=None, watermark_column=None, full=False):
+    """
+    Queue a job for one table. A new `mapping` (from the mapping form) is checked and saved first,
+    with its watermark column and a cleared watermark; without one the saved mapping is used.
+    Raises ValueError for an unusable mapping.
+    """
+    if mapping:
+        compile_mapping(table_name, mapping)
+        update_table_status(saplink, table_name, {
+            "mapping": mapping, "watermark_column": watermark_column or None, "watermark": None,
+        })
+    elif table_name not in syncable_tables(saplink):
+        raise ValueError(f"{table_name} has no saved column mapping yet; connect it first.")
+    return enqueue_import(saplink, user, [table_name], full=full)
+
+
+def claim_next_job():
+    """
+    Move the oldest queued job to 'running' and return it; None when there is nothing to do.
+    Jobs left 'running' by a worker that died are claimed again once SAP_IMPORT_JOB_TIMEOUT_SECONDS
+    have passed since they started, or marked failed after SAP_IMPORT_MAX_ATTEMPTS claims.
+    """
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=settings.SAP_IMPORT_JOB_TIMEOUT_SECONDS)
+    with transaction.atomic():
+        candidates = (
+            SapImportJob.objects
+            .select_for_update(skip_locked=True, of=('self',))
+            .select_related('saplink', 'user')
+            .filter(Q(status='queued') | Q(status='running', started_at__lt=stale))
+            .order_by('created_at')
+        )
+        while True:
+            job = candidates.first()
+            if job is None:
+                return None
+            if job.status == 'running':
+                logger.warning(f"SAP import job {job.id} was left running since {job.started_at}")
+                if job.attempts >= settings.SAP_IMPORT_MAX_ATTEMPTS:
+                    job.status = 'failed'
+                    job.error = f"The import worker stopped while running this job {job.attempts} times."
+                    job.finished_at = now
+                    job.save(update_fields=['status', 'error', 'finished_at'])
+                    for table in job.tables:
+                        update_table_status(job.saplink, table, {"state": "failed", "error": job.error})
+                    publish_job_status(job)
+                    continue
+            job.status = 'running'
+            job.started_at = now
+            job.attempts += 1
+            job.save(update_fields=['status', 'started_at', 'attempts'])
+            return job
+
+
+# -------------------------------
+# Live progress (read by the SSE stream in another process)
+# -------------------------------
+
+def progress_key(job_id):
+    return f"sap_import_progress:{job_id}"
+
+
+def read_progress(job_id):
+    """{"status", "error", "tables": {table: progress}} as last published; {} when nothing is cached."""
+    return caches[settings.SAP_PROGRESS_CACHE].get(progress_key(job_id)) or {}
+
+
+def publish_job_status(job):
+    """Record the job's status in its cached progress, for a job finished outside run_import_job()."""
+    progress = read_progress(job.id) or {"tables": {}}
+    progress.update(status=job.status, error=job.error)
+    caches[settings.SAP_PROGRESS_CACHE].set(progress_key(job.id), progress, settings.SAP_PROGRESS_TTL)
+
+
+class ImportProgress:
+    """
+    The job's status and per-table progress: rows read / written / skipped, rows per second and ETA.
+    Published to the SAP_PROGRESS_CACHE at most every SAP_PROGRESS_INTERVAL seconds, and at once
+    on state changes. Table threads of one job share an instance.
+    """
+
+    def __init__(self, job):
+        self.job_id = job.id
+        self.status = job.status
+        self.error = job.error
+        self.tables = {
+            table: {
+                "state": "queued", "rows_read": 0, "rows_written": 0, "rows_skipped": 0,
+                "total_rows": None, "rows_per_sec": None, "eta_seconds": None, "error": "",
+            }
+            for table in job.tables
+        }
+        self._started = {}
+        self._published_at = 0.0
+        self._lock = threading.Lock()
+        self.publish()
+
+    def reporter(self, table):
+        """The `progress` callback for one table's sync_sap_table()."""
+        return lambda **fields: self.update(table, **fields)
+
+    def update(self, table, **fields):
+        with self._lock:
+            entry = self.tables[table]
+            entry.update(fields)
+            now = time.monotonic()
+            if fields.get("state") == "running":
+                self._started[table] = now
+            elapsed = now - self._started.get(table, now)
+            if entry["rows_read"] and elapsed > 0:
+                entry["rows_per_sec"] = round(entry["rows_read"] / elapsed)
+                if entry["total_rows"] is not None:
+                    remaining = max(entry["total_rows"] - entry["rows_read"], 0)
+                    entry["eta_seconds"] = round(remaining / entry["rows_per_sec"]) if entry["rows_per_sec"] else None
+            if "state" in fields or now - self._published_at >= settings.SAP_PROGRESS_INTERVAL:
+                self._publish(now)
+
+    def finish(self, job):
+        with self._lock:
+            self.status, self.error = job.status, job.error
+            self._publish(time.monotonic())
+
+    def publish(self):
+        with self._lock:
+            self._publish(time.monotonic())
+
+    def _publish(self, now):
+        self._published_at = now
+        caches[settings.SAP_PROGRESS_CACHE].set(
+            progress_key(self.job_id),
+            {"status": self.status, "error": self.error, "tables": copy.deepcopy(self.tables)},
+            settings.SAP_PROGRESS_TTL,
+        )
+
+
+# -------------------------------
+# Running jobs
+# -------------------------------
+
+def _sync_table(job, table_name, progress):
+    """
+    One table of a job on its own pooled HANA connection. Not one long transaction: its batches
+    commit as they go, so parallel tables don't hold locks on shared GL accounts and worklist rows.
+    """
+    saplink = SAPLink.objects.get(pk=job.saplink_id)
+    update_table_status(saplink, table_name, {"state": "running"})
+    progress.update(table_name, state="running")
+    with hana_pool.connection(saplink) as conn:
+        sync = sync_sap_table(conn, saplink, table_name, {}, job.user, full=job.full, progress=progress.reporter(table_name))
+    progress.update(table_name, state="done", eta_seconds=0)
+    return sync
+
+
+def _sync_table_on_worker(job, table_name, progress):
+    try:
+        return _sync_table(job, table_name, progress)
+    finally:
+        # Each thread opened its own Django DB connection; don't leak it past the job
+        connections.close_all()
+
+
+def run_import_job(job):
+    """
+    Sync the job's tables in parallel, up to SAP_IMPORT_WORKERS at a time, and mark the job
+    'done' or 'failed'. Tables commit batch by batch, not all or nothing: a failing table doesn't
+    affect the others, but keeps the batches it wrote before failing (its error says how many rows,
+    and its watermark covers them), and the next sync of it resumes or re-reads the rest.
+    """
+    progress = ImportProgress(job)
+    workers = min(len(job.tables), settings.SAP_IMPORT_WORKERS)
+    futures = {}
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sap-import") as pool:
+            futures = {table: pool.submit(_sync_table_on_worker, job, table, progress) for table in job.tables}
+    errors = {}
+    for table in job.tables:
+        try:
+            if table in futures:
+                futures[table].result()
+            else:
+                _sync_table(job, table, progress)
+        except Exception as e:
+            logger.exception(f"SAP import job {job.id}: {table} failed")
+            error = str(e)
+            written = progress.tables[table]["rows_written"]
+            if written:
+                error += f" (partially imported: {written} rows were written before the failure; sync again to finish)"
+            errors[table] = error
+            update_table_status(job.saplink, table, {"state": "failed", "error": error})
+            progress.update(table, state="failed", error=error, eta_seconds=None)
+
+    gl_code_index.expire()
+    job.status = 'failed' if errors else 'done'
+    job.error = "\n".join(f"{table}: {error}" for table, error in errors.items())
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    progress.finish(job)
+    logger.info(f"SAP import job {job.id} {job.status} in {(job.finished_at - job.started_at).total_seconds():.1f}s")
+    return not errors
+
+
+def run_pending_jobs(limit=None):
+    """Run queued import jobs one after another. Returns (done, failed)."""
+    done = failed = 0
+    while limit is None or done + failed < limit:
+        job = claim_next_job()
+        if job is None:
+            break
+        if run_import_job(job):
+            done += 1
+        else:
+            failed += 1
+    return done, failed
+
+
+# -------------------------------
+# Server-Sent Events
+# -------------------------------
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _job_progress(job_id):
+    """The job's progress from the database, for when the cache has none (evicted or expired)."""
+    job = SapImportJob.objects.only('status', 'error').get(pk=job_id)
+    return {"status": job.status, "error": job.error, "tables": {}}
+
+
+def job_events(job_id, poll_seconds=None, max_seconds=None):
+    """
+    Server-Sent Events for an import job: `progress` whenever the published progress changes and
+    a final `done` (job status, per-table progress, error). Only the progress cache is polled; the
+    worker keeps the job status there too. Each stream ends after SAP_PROGRESS_STREAM_SECONDS,
+    shorter than the gunicorn worker timeout, and EventSource reconnects to pick up from there.
+    """
+    poll_seconds = poll_seconds or settings.SAP_PROGRESS_POLL_SECONDS
+    deadline = time.monotonic() + (max_seconds or settings.SAP_PROGRESS_STREAM_SECONDS)
+    yield "retry: 2000\n\n"
+    last = None
+    while True:
+        payload = read_progress(job_id) or _job_progress(job_id)
+        if payload["status"] in ('done', 'failed'):
+            yield sse_event("done", payload)
+            return
+        if payload != last:
+            yield sse_event("progress", payload)
+            last = payload
+        if time.monotonic() >= deadline:
+            return
+        time.sleep(poll_seconds)
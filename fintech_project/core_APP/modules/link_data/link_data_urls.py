@@ -6,15 +6,31 @@ from .link_data import (
     link_data_connect_api,
     link_sap_erp_to_unified_db,
     get_sap_columns,
+    get_sap_schema_columns,
+    sap_import_all,
+    sap_import_job_status,
+    sap_import_job_events,
+    chunked_upload_start,
+    chunked_upload_chunk,
+    chunked_upload_complete,
+    download_uploaded_file,
 )
 
 urlpatterns = [
     path('', link_data_view, name='link_data_page'),
     path('upload/', handle_upload, name='link_data_upload'),
+    path('upload/chunked/', chunked_upload_start, name='chunked_upload_start'),
+    path('upload/chunked/<uuid:upload_id>/', chunked_upload_chunk, name='chunked_upload_chunk'),
+    path('upload/chunked/<uuid:upload_id>/complete/', chunked_upload_complete, name='chunked_upload_complete'),
+    path('files/<uuid:file_id>/', download_uploaded_file, name='download_uploaded_file'),
     path('connect-erp/', link_data_connect_erp, name='link_data_connect_erp'),
     path('connect-api/', link_data_connect_api, name='link_data_connect_api'),
 
     path('link_sap_erp_to_unified_db/<uuid:saplink_id>/<str:table_name>/', link_sap_erp_to_unified_db, name='link_sap_erp_to_unified_db'),
 
     path('get_columns/<uuid:saplink_id>/<str:table_name>/', get_sap_columns, name='get_sap_columns'),
+    path('get_columns/<uuid:saplink_id>/', get_sap_schema_columns, name='get_sap_schema_columns'),
+    path('sap/<uuid:saplink_id>/import-all/', sap_import_all, name='sap_import_all'),
+    path('sap/jobs/<uuid:job_id>/', sap_import_job_status, name='sap_import_job_status'),
+    path('sap/jobs/<uuid:job_id>/events/', sap_import_job_events, name='sap_import_job_events'),
 ]
@@ -6,10 +6,11 @@ from django.db.models import Q
 from django.http import HttpResponseForbidden
 from django.shortcuts import redirect, render
 from django.conf import settings
-from django.core.mail import send_mail
+from core_APP.outbox import enqueue_mail, enqueue_notification
 
 
-from core_APP.models import CustomUser, ResponsibilityMatrix, BalanceSheet
+from core_APP.models import CustomUser, ResponsibilityMatrix, BalanceSheet, GLAccount
+from core_APP.modules.gl_reviews.gl_reviews_worklist import refresh_worklist
 
 
 class AddTeamMemberForm(forms.Form):
@@ -129,20 +130,16 @@ def team_management_view(request):
     # Prepare GL codes list for the form (from all users in the department's balance sheets)
     gl_codes_list = []
     
-    # Get unique GL codes from all balance sheets in this department
+    # Get unique GL codes from all balance sheets in this department, named from the GL master
     unique_gl_codes = BalanceSheet.objects.filter(
         responsible_department=department
-    ).values_list('gl_acct', flat=True).distinct()
-    
-    for gl_code in unique_gl_codes:
-        # Get the first BalanceSheet entry for this GL code in the department
-        bs = BalanceSheet.objects.filter(
-            responsible_department=department,
-            gl_acct=gl_code
-        ).first()
-        if bs:
-            display_name = f"{bs.gl_acct} - {bs.gl_account_name or 'N/A'}"
-            gl_codes_list.append((bs.gl_acct, display_name))
+    ).values_list('gl_acct', 'gl_account__name').distinct()
+
+    seen_gl_codes = set()
+    for gl_code, gl_name in unique_gl_codes:
+        if gl_code not in seen_gl_codes:
+            seen_gl_codes.add(gl_code)
+            gl_codes_list.append((gl_code, f"{gl_code} - {gl_name or 'N/A'}"))
     
     # Sort by GL code
     gl_codes_list.sort(key=lambda x: x[0])
@@ -181,12 +178,11 @@ def team_management_view(request):
                 
                 # Welcome Email
                 try:
-                    send_mail(
+                    enqueue_mail(
                         subject="Hello from Finnovate Project 2025",
                         message=f"Hi {selected_user.first_name},\n\nWelcome to Finnovate Project 2025! You were added by {request.user.first_name} {request.user.last_name} from {department} Department.\nWe are excited to have you on board.\n\nBest regards,\nFinnovate Project 2025",
                         from_email=settings.DEFAULT_FROM_EMAIL,
                         recipient_list=[selected_user.email],
-                        fail_silently=False,
                     )
                 except Exception as e:
                     print(f"Error sending welcome email: {e}")
@@ -250,6 +246,8 @@ def team_management_view(request):
                             else:
                                 messages.error(request, "Unable to find user role for assignment.")
                                 return redirect("team_management_page")
+
+                        refresh_worklist([selected_gl_code])
                     
                     messages.success(
                         request,
@@ -259,7 +257,7 @@ def team_management_view(request):
                     # Info Email
                     try:
                         # Get GL Name (if exists)
-                        gl_name = BalanceSheet.objects.filter(gl_acct=selected_gl_code).values_list("gl_account_name", flat=True).first() or "N/A"
+                        gl_name = GLAccount.objects.name_for(selected_gl_code, default="N/A")
 
                         subject = f"General Ledger Review  — {selected_gl_code}:({gl_name})"
                         message = f"""
@@ -277,13 +275,14 @@ def team_management_view(request):
                         Best regards,
                         Finnovate Project 2025
                         """
-                        # Send the email
-                        send_mail(
+                        # Send the email, folded into a digest when many GLs are assigned at once
+                        enqueue_notification(
+                            recipient=selected_user.email,
+                            gl_code=selected_gl_code,
+                            action=f"Assigned ({gl_name})",
                             subject=subject,
                             message=message.strip(),
                             from_email=settings.DEFAULT_FROM_EMAIL,
-                            recipient_list=[selected_user.email],
-                            fail_silently=False,
                         )
                     except Exception as e:
                         print(f"Error sending welcome email: {e}")
@@ -0,0 +1,206 @@
+import datetime
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core_APP.models import OutboundEmail
+
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxConnectionError(Exception):
+    """The mail server could not be reached; the batch was put back with a backed-off retry."""
+
+
+def enqueue_mail(subject, message, from_email, recipient_list):
+    """
+    Queue a mail for the outbox worker instead of talking SMTP in the request.
+
+    Same arguments as django.core.mail.send_mail. Recipients without an address are dropped.
+    Returns the OutboundEmail row, or None when there is nobody to send to.
+    """
+    recipients = [r for r in recipient_list if r]
+    if not recipients:
+        return None
+    return OutboundEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email,
+        recipients=recipients,
+    )
+
+
+def enqueue_notification(recipient, gl_code, action, subject, message, from_email=None):
+    """
+    Queue a per-GL notification that may be folded into a digest.
+
+    With EMAIL_DIGEST_WINDOW_SECONDS set, the notification waits for the window and every
+    notification the recipient collects meanwhile goes out as one summary mail.
+    A window of 0 sends it like any other outbox mail.
+    """
+    from_email = from_email or settings.DEFAULT_FROM_EMAIL
+    window = settings.EMAIL_DIGEST_WINDOW_SECONDS
+    if not window or not recipient:
+        return enqueue_mail(subject, message, from_email, [recipient])
+    return OutboundEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email,
+        recipients=[recipient],
+        digest_key=recipient,
+        gl_code=gl_code,
+        gl_action=action,
+        next_attempt_at=timezone.now() + datetime.timedelta(seconds=window),
+    )
+
+
+def _digest_body(items):
+    lines = [f"  {item.gl_code}: {item.gl_action}" for item in items]
+    return (
+        "Hi,\n\n"
+        f"Here is a summary of {len(items)} GL updates:\n\n"
+        + "\n".join(lines)
+        + "\n\nOpen GL Reviews for details.\n\nBest regards,\nFinnovate Project 2025"
+    )
+
+
+def collapse_digests():
+    """
+    Turn each recipient's held notifications into one mail once the oldest one is due.
+
+    A recipient with a single notification gets the original mail; otherwise all held
+    rows are marked 'digested' and replaced by one summary listing every GL code and action.
+    Returns the number of digest mails queued.
+    """
+    now = timezone.now()
+    due_keys = list(
+        OutboundEmail.objects
+        .filter(digest_key__isnull=False, status='pending', next_attempt_at__lte=now)
+        .values_list('digest_key', flat=True)
+        .distinct()
+    )
+    queued = 0
+    for key in due_keys:
+        with transaction.atomic():
+            items = list(
+                OutboundEmail.objects.select_for_update()
+                .filter(digest_key=key, status='pending')
+                .order_by('created_at')
+            )
+            if not items:
+                continue
+            if len(items) == 1:
+                OutboundEmail.objects.filter(id=items[0].id).update(digest_key=None, next_attempt_at=now)
+            else:
+                OutboundEmail.objects.create(
+                    subject=f"GL Review updates ({len(items)})",
+                    body=_digest_body(items),
+                    from_email=items[0].from_email,
+                    recipients=[key],
+                )
+                OutboundEmail.objects.filter(id__in=[item.id for item in items]).update(status='digested')
+            queued += 1
+    return queued
+
+
+def _claim_batch(batch_size):
+    """
+    Mark the next due batch as 'sending' so concurrent workers don't pick it up twice.
+    Rows a killed worker left 'sending' for longer than EMAIL_OUTBOX_LEASE_SECONDS are claimed
+    again; a mail may then go out twice, but none is lost.
+    """
+    now = timezone.now()
+    lease_expired = now - datetime.timedelta(seconds=settings.EMAIL_OUTBOX_LEASE_SECONDS)
+    with transaction.atomic():
+        due = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(digest_key__isnull=True)
+            .filter(Q(status='pending', next_attempt_at__lte=now) | Q(status='sending', claimed_at__lt=lease_expired))
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        OutboundEmail.objects.filter(id__in=[m.id for m in due]).update(status='sending', claimed_at=now)
+    for outgoing in due:
+        if outgoing.status == 'sending':
+            logger.warning(f"Outbox: reclaiming {outgoing.id}, left 'sending' since {outgoing.claimed_at}")
+        outgoing.status = 'sending'
+        outgoing.claimed_at = now
+    return due
+
+
+def retry_delay(attempts):
+    """Exponential backoff: base, 2x base, 4x base, ... capped at one hour."""
+    base = settings.EMAIL_OUTBOX_RETRY_BASE_SECONDS
+    return datetime.timedelta(seconds=min(base * 2 ** (attempts - 1), 3600))
+
+
+def deliver_pending(batch_size=None, max_attempts=None, connection=None):
+    """
+    Send one batch of due mails over a single SMTP connection.
+
+    Each message is sent on its own so one bad recipient does not fail the batch; failures
+    go back to 'pending' with a backed-off next_attempt_at until max_attempts is reached.
+    Returns (sent, failed) counts. Raises OutboxConnectionError when the server can't be
+    reached; the batch is then retried after one backoff step without using up attempts.
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    max_attempts = max_attempts or settings.EMAIL_OUTBOX_MAX_ATTEMPTS
+
+    collapse_digests()
+    batch = _claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+
+    sent = failed = 0
+    connection = connection or get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        retry_at = timezone.now() + retry_delay(1)
+        for outgoing in batch:
+            outgoing.status = 'pending'
+            outgoing.next_attempt_at = retry_at
+            outgoing.last_error = str(e)
+        OutboundEmail.objects.bulk_update(batch, ['status', 'next_attempt_at', 'last_error'])
+        raise OutboxConnectionError(f"Could not connect to the mail server: {e}") from e
+
+    try:
+        for outgoing in batch:
+            outgoing.attempts += 1
+            try:
+                connection.send_messages([EmailMessage(
+                    subject=outgoing.subject,
+                    body=outgoing.body,
+                    from_email=outgoing.from_email or settings.DEFAULT_FROM_EMAIL,
+                    to=outgoing.recipients,
+                    connection=connection,
+                )])
+            except Exception as e:
+                logger.warning(f"Outbox delivery of {outgoing.id} failed (attempt {outgoing.attempts}): {e}")
+                outgoing.last_error = str(e)
+                if outgoing.attempts >= max_attempts:
+                    outgoing.status = 'failed'
+                else:
+                    outgoing.status = 'pending'
+                    outgoing.next_attempt_at = timezone.now() + retry_delay(outgoing.attempts)
+                failed += 1
+            else:
+                outgoing.status = 'sent'
+                outgoing.sent_at = timezone.now()
+                outgoing.last_error = None
+                sent += 1
+    finally:
+        # Anything not reached (the worker errored mid-batch) goes back to the queue untouched
+        for outgoing in batch:
+            if outgoing.status == 'sending':
+                outgoing.status = 'pending'
+        OutboundEmail.objects.bulk_update(
+            batch, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at']
+        )
+        connection.close()
+
+    return sent, failed
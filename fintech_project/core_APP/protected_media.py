@@ -0,0 +1,84 @@
+import mimetypes
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+COPY_BLOCK_SIZE = 256 * 1024
+
+
+def parse_range(header, size):
+    """
+    (start, end), inclusive, for a single `bytes=` Range header, or None to send the whole file
+    (no header, or one we don't handle such as multiple ranges). Raises ValueError when unsatisfiable.
+    """
+    match = RANGE_RE.match((header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start >= size or end < start:
+            raise ValueError(header)
+    else:
+        # bytes=-N: the last N bytes
+        start, end = max(size - int(last), 0), size - 1
+        if int(last) == 0 or size == 0:
+            raise ValueError(header)
+    return start, end
+
+
+def _read_range(fh, remaining):
+    try:
+        while remaining > 0:
+            block = fh.read(min(COPY_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+    finally:
+        fh.close()
+
+
+def serve_protected(request, field_file, download_name, as_attachment=False):
+    """
+    Send a stored file to a user the caller has already authorised.
+
+    Behind nginx (PROTECTED_MEDIA_ACCEL_PREFIX set) only an X-Accel-Redirect to the internal
+    location is returned, and nginx streams the file with sendfile and answers Range requests itself.
+    Without it the file is streamed from here, honouring a single-range Range header.
+    """
+    content_type = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    disposition = content_disposition_header(as_attachment, download_name)
+
+    if settings.PROTECTED_MEDIA_ACCEL_PREFIX:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.PROTECTED_MEDIA_ACCEL_PREFIX + quote(field_file.name)
+        response['Content-Disposition'] = disposition
+        return response
+
+    size = field_file.size
+    try:
+        byte_range = parse_range(request.headers.get('Range'), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    fh = field_file.storage.open(field_file.name, 'rb')
+    if byte_range is None:
+        response = FileResponse(fh, content_type=content_type)
+    else:
+        start, end = byte_range
+        fh.seek(start)
+        response = StreamingHttpResponse(_read_range(fh, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = disposition
+    return response
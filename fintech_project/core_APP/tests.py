@@ -1,3 +1,1593 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import uuid
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core_APP.models import (
+    CustomUser, Department, GLAccount, ResponsibilityMatrix, TrialBalance, BalanceSheet,
+    GLReview, GLSupportingDocument, ReviewTrail, OutboundEmail, GLWorklistEntry, StoredBlob,
+    ChunkedUpload, LinkedData, SAPLink, SapImportJob, UploadedFile,
+)
+from core_APP.gl_index import GLCodeIndex
+from core_APP.hana_pool import HanaConnectionPool, PoolExhausted
+from core_APP.ingestion import ingest_pending, load_rows
+from core_APP.outbox import OutboxConnectionError, enqueue_mail, enqueue_notification, deliver_pending
+from core_APP.modules.gl_reviews.gl_reviews_worklist import build_user_gl_worklist, encode_cursor, rebuild_worklist
+from core_APP.modules.gl_reviews.gl_reviews_trails import fetch_trail_chains, summarize_trails
+from core_APP.modules.gl_reviews.gl_reviews_workflow import apply_transition
+from core_APP.modules.gl_reviews.gl_reviews_assignments import reconcile_bufc_assignments, reconcile_tower_assignments
+from core_APP.hana_standin import standin_mapping
+from core_APP.modules.link_data import link_data_sap
+from core_APP.modules.link_data.link_data_sap import import_sap_table, schema_columns, sync_sap_table
+from core_APP.modules.link_data.link_data_sap_jobs import claim_next_job, job_events, read_progress, run_import_job
+
+
+def insert_batches(model, count):
+    """INSERT statements bulk_create needs for `count` rows (backends cap parameters per statement)."""
+    fields = [f for f in model._meta.concrete_fields if f is not model._meta.auto_field]
+    return math.ceil(count / connection.ops.bulk_batch_size(fields, [None] * count))
+
+
+class GLWorklistBuilderTests(TestCase):
+
+    def setUp(self):
+        self.department = Department.objects.create(name="B2P")
+        self.preparer = CustomUser.objects.create_user(username="preparer", password="x", user_type=4)
+        self.reviewer = CustomUser.objects.create_user(username="reviewer", password="x", user_type=4)
+
+    def _seed(self, count):
+        """Give the preparer/reviewer `count` GLs each, with TB, BS, review and one document per GL."""
+        codes = [f"{i:08d}" for i in range(count)]
+        BalanceSheet.objects.bulk_create([
+            BalanceSheet(user=self.preparer, gl_acct=code, gl_account_name=f"GL {code}") for code in codes
+        ])
+        tbs = TrialBalance.objects.bulk_create([
+            TrialBalance(user=self.preparer, gl_code=code, amount=0) for code in codes
+        ])
+        reviews = GLReview.objects.bulk_create([
+            GLReview(trial_balance=tb, reviewer=self.preparer, status=2, reconciliation_notes="done") for tb in tbs
+        ])
+        GLSupportingDocument.objects.bulk_create([
+            GLSupportingDocument(gl_review=review, file=f"gl_supporting/{review.id}.pdf") for review in reviews
+        ])
+        GLAccount.objects.ids_for(codes, {code: f"GL {code}" for code in codes})
+        ResponsibilityMatrix.objects.bulk_create(
+            [ResponsibilityMatrix(user=self.preparer, department=self.department, user_role=4,
+                                  gl_code=code, gl_code_status=2) for code in codes]
+            + [ResponsibilityMatrix(user=self.reviewer, department=self.department, user_role=5,
+                                    gl_code=code, gl_code_status=1) for code in codes]
+        )
+
+    def _count_queries(self, func, *args):
+        with CaptureQueriesContext(connection) as ctx:
+            func(*args)
+        return len(ctx.captured_queries)
+
+    def test_query_count_is_constant(self):
+        self._seed(10)
+        small_refresh = self._count_queries(rebuild_worklist)
+        small_preparer = self._count_queries(build_user_gl_worklist, self.preparer)
+
+        GLSupportingDocument.objects.all().delete()
+        GLReview.objects.all().delete()
+        TrialBalance.objects.all().delete()
+        BalanceSheet.objects.all().delete()
+        ResponsibilityMatrix.objects.all().delete()
+        GLAccount.objects.all().delete()
+
+        self._seed(400)
+        # Only the GLWorklistEntry insert may be split into batches
+        extra_batches = insert_batches(GLWorklistEntry, 800) - insert_batches(GLWorklistEntry, 20)
+        self.assertEqual(self._count_queries(rebuild_worklist), small_refresh + extra_batches)
+        self.assertEqual(self._count_queries(build_user_gl_worklist, self.preparer), small_preparer)
+        self.assertEqual(self._count_queries(build_user_gl_worklist, self.reviewer), 1)
+        self.assertEqual(GLWorklistEntry.objects.count(), 800)
+
+    def test_rows_match_assignments(self):
+        self._seed(3)
+        rebuild_worklist()
+        preparer_gls, reviewer_gls = build_user_gl_worklist(self.preparer)
+        self.assertEqual(reviewer_gls, [])
+        self.assertEqual([gl['gl_code'] for gl in preparer_gls], ["00000000", "00000001", "00000002"])
+        first = preparer_gls[0]
+        self.assertEqual(first['gl_name'], "GL 00000000")
+        self.assertEqual(first['status_code'], 2)
+        self.assertEqual(first['reconciliation_notes'], "done")
+        self.assertEqual(len(first['supporting_documents']), 1)
+        self.assertIsNone(first['preparer_assignment_status'])
+
+        _, reviewer_gls = build_user_gl_worklist(self.reviewer)
+        self.assertEqual(reviewer_gls[0]['preparer_assignment_status'], 2)
+        self.assertIsNotNone(reviewer_gls[0]['gl_review_id'])
+        self.assertTrue(reviewer_gls[0]['is_actionable'])
+
+    def test_rebuild_command_repairs_stale_entries(self):
+        self._seed(2)
+        call_command("rebuild_worklist", stdout=StringIO())
+        GLWorklistEntry.objects.filter(user=self.reviewer).update(status_code=8, gl_name="stale")
+        ResponsibilityMatrix.objects.filter(user=self.preparer, gl_code="00000001").delete()
+
+        call_command("rebuild_worklist", stdout=StringIO())
+        _, reviewer_gls = build_user_gl_worklist(self.reviewer)
+        self.assertEqual({gl['status_code'] for gl in reviewer_gls}, {1})
+        self.assertEqual(reviewer_gls[0]['gl_name'], "GL 00000000")
+        self.assertEqual(GLWorklistEntry.objects.filter(user=self.preparer).count(), 1)
+
+    def test_balance_sheet_load_renaming_an_account_refreshes_its_entries(self):
+        self._seed(2)
+        rebuild_worklist()
+        load_rows("balance_sheet", self.preparer, [(0, "gl_acct"), (1, "gl_account_name")], [
+            ["00000000", "Cash at bank"], ["00000001", "GL 00000001"],
+        ])
+        self.assertEqual(
+            set(GLWorklistEntry.objects.values_list("gl_code", "gl_name").distinct()),
+            {("00000000", "Cash at bank"), ("00000001", "GL 00000001")},
+        )
+
+
+class GLAccountMasterTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="master", password="x", user_type=4)
+
+    def test_ids_for_creates_missing_accounts_and_fills_in_names(self):
+        GLAccount.objects.create(code="10000001", name="Cash")
+        GLAccount.objects.create(code="10000002")
+
+        ids, renamed = GLAccount.objects.ids_for(["10000001", "10000002", "10000003", ""], {
+            "10000001": "Cash at bank", "10000002": "Receivables", "10000003": "Payables",
+        })
+        self.assertEqual(renamed, ["10000002"])
+        self.assertEqual(set(ids), {"10000001", "10000002", "10000003"})
+        self.assertEqual(ids, dict(GLAccount.objects.values_list("code", "id")))
+        self.assertEqual(GLAccount.objects.names_for(ids), {
+            "10000001": "Cash", "10000002": "Receivables", "10000003": "Payables",
+        })
+
+        _, renamed = GLAccount.objects.ids_for(["10000001"], {"10000001": "Cash at bank"}, overwrite_names=True)
+        self.assertEqual(renamed, ["10000001"])
+        self.assertEqual(GLAccount.objects.name_for("10000001"), "Cash at bank")
+
+    def test_save_links_rows_and_balance_sheet_names_win(self):
+        tb = TrialBalance.objects.create(user=self.user, gl_code="21170200", gl_name="TB name", amount=0)
+        account = GLAccount.objects.get(code="21170200")
+        self.assertEqual((tb.gl_account_id, account.name), (account.id, "TB name"))
+
+        bs = BalanceSheet.objects.create(user=self.user, gl_acct="21170200", gl_account_name="Reco name")
+        self.assertEqual(bs.gl_account_id, account.id)
+        TrialBalance.objects.create(user=self.user, gl_code="21170200", gl_name="Other TB name", amount=0, fiscal_year="2024")
+        self.assertEqual(GLAccount.objects.name_for("21170200"), "Reco name")
+
+        ResponsibilityMatrix.objects.create(user=self.user, user_role=4, gl_code="21170200")
+        rebuild_worklist()
+        bs.gl_account_name = "Renamed in reco"
+        bs.save()
+        self.assertEqual(GLAccount.objects.name_for("21170200"), "Renamed in reco")
+        self.assertEqual(GLWorklistEntry.objects.get(gl_code="21170200").gl_name, "Renamed in reco")
+
+        # An unchanged GL code costs no lookup in the master
+        tb = TrialBalance.objects.get(pk=tb.pk)
+        tb.amount = 10
+        with self.assertNumQueries(1):
+            tb.save()
+
+        tb.gl_code = "21170300"
+        tb.save(update_fields=["gl_code"])
+        tb.refresh_from_db()
+        self.assertEqual(tb.gl_account.code, "21170300")
+
+    def test_backfill_builds_the_master_and_links_every_table(self):
+        TrialBalance.objects.bulk_create([
+            TrialBalance(user=self.user, gl_code="10000001", gl_name="TB cash", amount=0),
+            TrialBalance(user=self.user, gl_code="10000002", gl_name="TB receivables", amount=0),
+        ])
+        BalanceSheet.objects.bulk_create([BalanceSheet(user=self.user, gl_acct="10000001", gl_account_name="Cash")])
+        ResponsibilityMatrix.objects.bulk_create([ResponsibilityMatrix(user=self.user, gl_code="10000003")])
+        # Created by an earlier trial balance save with its name
+        GLAccount.objects.create(code="10000001", name="TB cash")
+
+        linked = GLAccount.objects.backfill()
+        self.assertEqual(linked["TrialBalance"], 2)
+        self.assertEqual((linked["BalanceSheet"], linked["ResponsibilityMatrix"]), (1, 1))
+        self.assertEqual(GLAccount.objects.names_for(["10000001", "10000002", "10000003"]), {
+            "10000001": "Cash", "10000002": "TB receivables", "10000003": None,
+        })
+        self.assertFalse(TrialBalance.objects.filter(gl_account__isnull=True).exists())
+        self.assertEqual(
+            ResponsibilityMatrix.objects.get().gl_account_id, GLAccount.objects.get(code="10000003").id,
+        )
+
+
+class QueryPlanTests(TestCase):
+    """Hot-path lookups in gl_reviews, dashboard and team_management must be served by an index."""
+
+    def setUp(self):
+        self.department = Department.objects.create(name="B2P")
+        self.user = CustomUser.objects.create_user(username="planner", password="x", user_type=4)
+        self.trial_balance = TrialBalance.objects.create(user=self.user, gl_code="21170200", amount=0)
+        self.gl_review = GLReview.objects.create(trial_balance=self.trial_balance, reviewer=self.user)
+
+    def fk_index(self, model, field):
+        """Name Django gives the implicit index on a ForeignKey column."""
+        column = model._meta.get_field(field).column
+        return connection.SchemaEditorClass(connection)._create_index_name(model._meta.db_table, [column])
+
+    def unique_index(self, model, *fields):
+        """Name Django gives the index backing a unique_together constraint."""
+        columns = [model._meta.get_field(field).column for field in fields]
+        return connection.SchemaEditorClass(connection)._create_index_name(model._meta.db_table, columns, suffix="_uniq")
+
+    def assertUsesIndex(self, queryset, index, model=None):
+        """The filtered table (queryset.model unless given) is searched through `index` and never scanned."""
+        table = (model or queryset.model)._meta.db_table
+        plan = queryset.explain()
+        lines = plan.splitlines()
+        if connection.vendor == "postgresql":
+            scans = [line for line in lines if f"Seq Scan on {table}" in line]
+            searches = [line for line in lines if f"Index Scan using {index} on {table}" in line
+                        or f"Index Only Scan using {index} on {table}" in line
+                        or f"Bitmap Index Scan on {index}" in line]
+        else:
+            scans = [line for line in lines if re.search(rf"\bSCAN {re.escape(table)}\b", line)]
+            searches = [
+                line for line in lines
+                if re.search(rf"\bSEARCH {re.escape(table)} USING (COVERING )?INDEX {re.escape(index)}\b", line)
+            ]
+        self.assertFalse(scans, f"Scan of {table} in plan for:\n{queryset.query}\n{plan}")
+        self.assertTrue(searches, f"{table} not searched through {index} in plan for:\n{queryset.query}\n{plan}")
+
+    def test_gl_reviews_queries(self):
+        gl_code = self.trial_balance.gl_code
+        self.assertUsesIndex(ResponsibilityMatrix.objects.filter(gl_code=gl_code, user_role=3), "rm_gl_code_role_idx")
+        self.assertUsesIndex(ResponsibilityMatrix.objects.filter(gl_code__in=[gl_code], user_role=4), "rm_gl_code_role_idx")
+        self.assertUsesIndex(
+            ResponsibilityMatrix.objects.filter(user=self.user, gl_code__isnull=False, user_role__in=[4, 5]),
+            self.unique_index(ResponsibilityMatrix, "user", "gl_code"),
+        )
+        self.assertUsesIndex(TrialBalance.objects.filter(gl_code=gl_code), "tb_gl_code_user_idx")
+        self.assertUsesIndex(TrialBalance.objects.filter(user=self.user, gl_code=gl_code), "tb_gl_code_user_idx")
+        self.assertUsesIndex(BalanceSheet.objects.filter(gl_acct=gl_code), "bs_gl_acct_idx")
+        self.assertUsesIndex(
+            GLReview.objects.filter(trial_balance=self.trial_balance, reviewer=self.user), "glr_tb_reviewer_idx"
+        )
+        self.assertUsesIndex(
+            ReviewTrail.objects.filter(gl_review=self.gl_review).order_by("-created_at"), "rt_review_created_idx"
+        )
+        self.assertUsesIndex(ReviewTrail.objects.filter(gl_code=gl_code).order_by("created_at"), "rt_gl_code_created_idx")
+
+    def test_dashboard_queries(self):
+        self.assertUsesIndex(GLReview.objects.filter(reviewer=self.user, status=1), self.fk_index(GLReview, "reviewer"))
+        self.assertUsesIndex(
+            GLReview.objects.filter(trial_balance__user=self.user).values("status").annotate(count=Count("id")),
+            self.fk_index(TrialBalance, "user"), model=TrialBalance,
+        )
+        self.assertUsesIndex(
+            TrialBalance.objects.filter(user=self.user).values("fs_main_head").annotate(total=Sum("amount")),
+            self.fk_index(TrialBalance, "user"),
+        )
+
+    def test_team_management_queries(self):
+        self.assertUsesIndex(
+            ResponsibilityMatrix.objects.filter(user=self.user, user_role=2),
+            self.unique_index(ResponsibilityMatrix, "user", "gl_code"),
+        )
+        self.assertUsesIndex(
+            ResponsibilityMatrix.objects.filter(department=self.department).exclude(user=self.user),
+            self.fk_index(ResponsibilityMatrix, "department"),
+        )
+        self.assertUsesIndex(
+            BalanceSheet.objects.filter(responsible_department=self.department).values_list("gl_acct", flat=True).distinct(),
+            "bs_dept_gl_acct_idx",
+        )
+        self.assertUsesIndex(
+            BalanceSheet.objects.filter(responsible_department=self.department, gl_acct="21170200"), "bs_dept_gl_acct_idx"
+        )
+
+
+class ReviewWorkflowTests(TestCase):
+
+    def setUp(self):
+        self.department = Department.objects.create(name="B2P")
+        self.tower = CustomUser.objects.create_user(username="tower", password="x", user_type=2)
+        self.fc = CustomUser.objects.create_user(username="fc", password="x", user_type=3)
+        self.preparer = CustomUser.objects.create_user(username="preparer", password="x", user_type=4)
+        self.reviewer = CustomUser.objects.create_user(username="reviewer", password="x", user_type=4)
+
+    def _seed(self, count, fc_status=3):
+        codes = [f"{i:08d}" for i in range(count)]
+        tbs = TrialBalance.objects.bulk_create([TrialBalance(user=self.preparer, gl_code=code) for code in codes])
+        reviews = GLReview.objects.bulk_create([GLReview(trial_balance=tb, reviewer=self.fc, status=2) for tb in tbs])
+        ReviewTrail.objects.bulk_create([
+            ReviewTrail(reviewer=self.preparer, gl_review=review, gl_code=code, action="Submitted")
+            for review, code in zip(reviews, codes)
+        ])
+        rows = []
+        for code in codes:
+            rows += [
+                ResponsibilityMatrix(user=self.tower, department=self.department, user_role=2, gl_code=code, gl_code_status=1),
+                ResponsibilityMatrix(user=self.fc, department=self.department, user_role=3, gl_code=code, gl_code_status=fc_status),
+                ResponsibilityMatrix(user=self.reviewer, department=self.department, user_role=5, gl_code=code, gl_code_status=5),
+                ResponsibilityMatrix(user=self.preparer, department=self.department, user_role=4, gl_code=code, gl_code_status=3),
+            ]
+        ResponsibilityMatrix.objects.bulk_create(rows)
+        return list(ResponsibilityMatrix.objects.filter(user=self.tower).values_list("id", flat=True))
+
+    def _count_queries(self, *args):
+        with CaptureQueriesContext(connection) as ctx:
+            result = apply_transition(*args)
+        return len(ctx.captured_queries), result
+
+    def test_tower_bulk_approval_query_count_is_constant(self):
+        small, result = self._count_queries(self.tower, "tower", "approve", self._seed(5), "Bulk Action: Approve")
+        self.assertEqual(len(result.processed), 5)
+        ReviewTrail.objects.all().delete()
+        GLReview.objects.all().delete()
+        TrialBalance.objects.all().delete()
+        ResponsibilityMatrix.objects.all().delete()
+
+        large, result = self._count_queries(self.tower, "tower", "approve", self._seed(500), "Bulk Action: Approve")
+        self.assertEqual(len(result.processed), 500)
+        # Only the ReviewTrail and GLWorklistEntry inserts may be split, when the backend caps parameters per statement
+        extra_batches = (
+            insert_batches(ReviewTrail, 500) - insert_batches(ReviewTrail, 5)
+            + insert_batches(GLWorklistEntry, 2000) - insert_batches(GLWorklistEntry, 20)
+        )
+        self.assertEqual(large, small + extra_batches)
+        self.assertEqual(ResponsibilityMatrix.objects.filter(user_role__in=[2, 3], gl_code_status=7).count(), 1000)
+        self.assertEqual(ReviewTrail.objects.filter(action="Approved", reviewer=self.tower).count(), 500)
+        self.assertEqual(GLWorklistEntry.objects.filter(user=self.tower, status_code=7).count(), 500)
+
+    def test_tower_skips_gls_not_approved_by_fc(self):
+        ids = self._seed(3, fc_status=1)
+        result = apply_transition(self.tower, "tower", "reject", ids, "Tower Head Review")
+        self.assertEqual(result.processed, [])
+        self.assertEqual(len(result.skipped), 3)
+        self.assertFalse(ResponsibilityMatrix.objects.filter(gl_code_status=8).exists())
+
+    def test_fc_reject_routes_back_to_previous_reviewer(self):
+        self._seed(1)
+        assignment = ResponsibilityMatrix.objects.get(user=self.fc)
+        result = apply_transition(self.fc, "fc", "reject", [assignment.id], "Missing bank statement")
+        outcome = result.processed[0]
+        self.assertEqual(outcome.notify, self.preparer)
+        self.assertEqual(ResponsibilityMatrix.objects.get(user=self.fc).gl_code_status, 4)
+        self.assertEqual(ResponsibilityMatrix.objects.get(user=self.reviewer).gl_code_status, 6)
+        review = GLReview.objects.get()
+        self.assertEqual(review.reviewer, self.preparer)
+        self.assertEqual(review.reconciliation_notes, "Missing bank statement")
+        self.assertEqual(ReviewTrail.objects.get(action="Rejected").previous_trail.action, "Submitted")
+
+    def test_reject_skips_gls_whose_previous_reviewer_was_deleted(self):
+        self._seed(1)
+        ReviewTrail.objects.update(reviewer=None)
+        assignment = ResponsibilityMatrix.objects.get(user=self.fc)
+        result = apply_transition(self.fc, "fc", "reject", [assignment.id], "Missing bank statement")
+        self.assertEqual(result.processed, [])
+        self.assertEqual(result.skipped, [(assignment.gl_code, "Previous reviewer no longer exists")])
+        self.assertEqual(ResponsibilityMatrix.objects.get(user=self.fc).gl_code_status, 3)
+        self.assertFalse(ReviewTrail.objects.filter(action="Rejected").exists())
+
+
+    def test_trail_chains_are_walked_in_one_query(self):
+        self._seed(2)
+        rejected, approved = ResponsibilityMatrix.objects.filter(user=self.fc).order_by("gl_code")
+        apply_transition(self.fc, "fc", "reject", [rejected.id], "Missing bank statement")
+        apply_transition(self.fc, "fc", "approve", [approved.id], "Fine")
+
+        with self.assertNumQueries(1):
+            summaries = summarize_trails([rejected.gl_code, approved.gl_code])
+        self.assertEqual([t.action for t in summaries[rejected.gl_code].chains[-1].trails], ["Submitted", "Rejected"])
+        self.assertEqual(summaries[rejected.gl_code].rejection_count, 1)
+        self.assertEqual(summaries[rejected.gl_code].current_stage, "GL Review-II (Reviewer)")
+        self.assertEqual(summaries[approved.gl_code].current_stage, "GL Review-III (Finance Controller)")
+        self.assertEqual(summaries[approved.gl_code].rejection_count, 0)
+
+        tip = summaries[approved.gl_code].chains[-1].tip
+        chain, = fetch_trail_chains(tip_ids=[tip.id])
+        self.assertEqual([t.action for t in chain.trails], ["Submitted", "Approved"])
+
+        # A corrupted, circular chain still terminates
+        ReviewTrail.objects.filter(id=chain.trails[0].id).update(previous_trail=tip)
+        chain, = fetch_trail_chains(tip_ids=[tip.id])
+        self.assertEqual(len(chain.trails), 2)
+
+
+class RoleAssignmentReconciliationTests(TestCase):
+
+    def setUp(self):
+        self.department = Department.objects.create(name="B2P")
+        self.tower = CustomUser.objects.create_user(username="tower", password="x", user_type=2)
+        self.fc = CustomUser.objects.create_user(username="fc", password="x", user_type=3)
+        self.preparer = CustomUser.objects.create_user(username="preparer", password="x", user_type=4)
+        self.reviewer = CustomUser.objects.create_user(username="reviewer", password="x", user_type=4)
+        self.codes = [f"{i:08d}" for i in range(4)]
+        tbs = TrialBalance.objects.bulk_create([TrialBalance(user=self.preparer, gl_code=code) for code in self.codes])
+        GLReview.objects.bulk_create([GLReview(trial_balance=tb, reviewer=self.fc, status=2) for tb in tbs])
+
+    def test_missing_assignments_are_created_once(self):
+        # Blank bootstrap row left by department management
+        bootstrap = ResponsibilityMatrix.objects.create(user=self.tower, department=self.department, user_role=2)
+        ResponsibilityMatrix.objects.create(
+            user=self.tower, department=self.department, user_role=2, gl_code=self.codes[0], gl_code_status=3,
+        )
+
+        self.assertEqual(reconcile_tower_assignments(self.tower), 3)
+        rows = ResponsibilityMatrix.objects.filter(user=self.tower)
+        self.assertEqual(sorted(rows.values_list("gl_code", flat=True)), self.codes)
+        self.assertEqual(rows.get(gl_code=self.codes[0]).gl_code_status, 3)
+        bootstrap.refresh_from_db()
+        self.assertIsNotNone(bootstrap.gl_code)
+        self.assertEqual(set(rows.exclude(gl_code=self.codes[0]).values_list("department", flat=True)), {self.department.id})
+        self.assertEqual(GLWorklistEntry.objects.filter(user=self.tower, gl_code__in=self.codes[1:]).count(), 3)
+
+        self.assertEqual(reconcile_tower_assignments(self.tower), 0)
+        self.assertEqual(rows.count(), 4)
+
+    def test_rows_created_by_a_concurrent_load_are_skipped(self):
+        ResponsibilityMatrix.objects.create(
+            user=self.fc, department=self.department, user_role=3, gl_code="99999999", gl_code_status=1,
+        )
+        ids_for = GLAccount.objects.ids_for
+
+        def racing_ids_for(codes, *args):
+            # Another request creates one of the missing rows between the diff and the insert
+            ResponsibilityMatrix.objects.bulk_create([
+                ResponsibilityMatrix(user=self.fc, user_role=3, gl_code=self.codes[2], gl_code_status=1)
+            ])
+            return ids_for(codes, *args)
+
+        with mock.patch.object(GLAccount.objects, "ids_for", side_effect=racing_ids_for):
+            # Four reviewed GLs, one of them added by the other request
+            self.assertEqual(reconcile_bufc_assignments(self.fc), 3)
+        self.assertEqual(
+            sorted(ResponsibilityMatrix.objects.filter(user=self.fc, gl_code__in=self.codes).values_list("gl_code", flat=True)),
+            self.codes,
+        )
+
+    def test_bootstrap_row_conflicting_with_a_concurrent_insert_falls_back_to_inserting(self):
+        bootstrap = ResponsibilityMatrix.objects.create(user=self.tower, department=self.department, user_role=2)
+        ids_for = GLAccount.objects.ids_for
+
+        def racing_ids_for(codes, *args):
+            # Another request gives the Tower Head the first missing GL before the bootstrap UPDATE
+            ResponsibilityMatrix.objects.bulk_create([
+                ResponsibilityMatrix(user=self.tower, user_role=2, gl_code=codes[0], gl_code_status=1)
+            ])
+            return ids_for(codes, *args)
+
+        with mock.patch.object(GLAccount.objects, "ids_for", side_effect=racing_ids_for):
+            self.assertEqual(reconcile_tower_assignments(self.tower), 3)
+        bootstrap.refresh_from_db()
+        self.assertIsNone(bootstrap.gl_code)
+        self.assertEqual(
+            sorted(ResponsibilityMatrix.objects.filter(user=self.tower, gl_code__isnull=False).values_list("gl_code", flat=True)),
+            self.codes,
+        )
+
+    def test_fc_assignments_reset_after_reviewer_approval(self):
+        approved, pending_review, already_pending, _ = self.codes
+        for code, fc_status, reviewer_status in [
+            (approved, 5, 3), (pending_review, 5, 2), (already_pending, 1, 3),
+        ]:
+            ResponsibilityMatrix.objects.create(
+                user=self.fc, department=self.department, user_role=3, gl_code=code, gl_code_status=fc_status,
+            )
+            ResponsibilityMatrix.objects.create(
+                user=self.reviewer, department=self.department, user_role=5, gl_code=code, gl_code_status=reviewer_status,
+            )
+
+        reconcile_bufc_assignments(self.fc)
+        statuses = dict(ResponsibilityMatrix.objects.filter(user=self.fc).values_list("gl_code", "gl_code_status"))
+        self.assertEqual(statuses[approved], 1)
+        self.assertEqual(statuses[pending_review], 5)
+        self.assertEqual(statuses[already_pending], 1)
+        self.assertEqual(GLWorklistEntry.objects.get(user=self.fc, gl_code=approved).status_code, 1)
+
+
+class GLReviewQueueApiTests(TestCase):
+
+    def setUp(self):
+        self.department = Department.objects.create(name="B2P")
+        self.other_department = Department.objects.create(name="R2R")
+        self.tower = CustomUser.objects.create_user(username="tower", password="x", user_type=2)
+        self.fc = CustomUser.objects.create_user(username="fc", password="x", user_type=3)
+        rows = []
+        # (fc status, tower status): actionable while FC has approved and the Tower Head hasn't acted
+        for i, (fc_status, tower_status) in enumerate([(3, 1), (1, 1), (7, 7), (3, 1), (1, 1), (8, 8), (3, 1)]):
+            code = f"{i:08d}"
+            department = self.department if i % 2 == 0 else self.other_department
+            rows += [
+                ResponsibilityMatrix(user=self.tower, department=department, user_role=2, gl_code=code, gl_code_status=tower_status),
+                ResponsibilityMatrix(user=self.fc, department=department, user_role=3, gl_code=code, gl_code_status=fc_status),
+            ]
+        ResponsibilityMatrix.objects.bulk_create(rows)
+        rebuild_worklist()
+        self.client.force_login(self.tower)
+
+    def _get(self, **params):
+        response = self.client.get(reverse("gl_review_queue_api"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def _all_pages(self, **params):
+        rows, cursor = [], None
+        while True:
+            page = self._get(limit=2, **({"cursor": cursor} if cursor else {}), **params)
+            rows += page["results"]
+            cursor = page["next_cursor"]
+            if not cursor:
+                return rows
+
+    def test_pages_cover_the_queue_in_tower_order(self):
+        rows = self._all_pages()
+        self.assertEqual(len({r["gl_code"] for r in rows}), 7)
+        buckets = [0 if r["is_actionable"] else 1 if r["status_code"] in (7, 8) else 2 for r in rows]
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(buckets.count(0), 3)
+
+    def test_filters(self):
+        self.assertEqual(len(self._all_pages(actionable="true")), 3)
+        self.assertEqual({r["gl_code"] for r in self._all_pages(status_code=8)}, {"00000005"})
+        self.assertTrue(all(r["department"] == "R2R" for r in self._all_pages(department="R2R")))
+        self.assertEqual(len(self._all_pages(department="R2R")), 3)
+
+    def test_page_query_count_does_not_depend_on_page_size(self):
+        with CaptureQueriesContext(connection) as small:
+            self._get(limit=1)
+        with CaptureQueriesContext(connection) as large:
+            self._get(limit=200)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(reverse("gl_review_queue_api"), {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_well_formed_cursor_with_wrong_value_types_is_rejected(self):
+        # The Tower Head queue is ordered by (sort_bucket, assigned_on, id)
+        valid = encode_cursor([0, "2025-01-01T00:00:00+00:00", 1])
+        self.assertEqual(self.client.get(reverse("gl_review_queue_api"), {"cursor": valid}).status_code, 200)
+        for values in (
+            [0, "yesterday", 1], [0, "2025-01-01T00:00:00+00:00", "one"], [0, None, 1], [[0], "2025-01-01T00:00:00+00:00", 1],
+        ):
+            response = self.client.get(reverse("gl_review_queue_api"), {"cursor": encode_cursor(values)})
+            self.assertEqual(response.status_code, 400, values)
+
+
+class BalanceSheetGridApiTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="preparer", password="x", user_type=4)
+        BalanceSheet.objects.bulk_create([
+            BalanceSheet(
+                user=self.user, gl_acct=f"{i:08d}", gl_account_name=f"Account {i}",
+                main_head=["Assets", "Liabilities", None][i % 3],
+                recon_status="Open" if i % 2 else "Closed",
+                flag_color="Red" if i % 4 == 0 else None,
+                analysis_required="Yes" if i % 5 == 0 else "No",
+            )
+            for i in range(23)
+        ])
+        self.client.force_login(self.user)
+
+    def _pages(self, **params):
+        rows, cursor, stats = [], None, None
+        while True:
+            response = self.client.get(reverse("balance_sheet_grid_api"), {"limit": 5, **params, **({"cursor": cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            stats = stats or page.get("stats")
+            rows += page["results"]
+            cursor = page["next_cursor"]
+            if not cursor:
+                return rows, stats
+
+    def test_sorted_pages_cover_every_row_once(self):
+        rows, stats = self._pages(sort="main_head,-gl_acct")
+        self.assertEqual(len({row["id"] for row in rows}), 23)
+        keys = [(row["main_head"] or "", row["gl_acct"]) for row in rows]
+        self.assertEqual([k[0] for k in keys], sorted(k[0] for k in keys))
+        self.assertEqual(stats, {"total": 23, "open_items": 11, "flagged": 6, "analysis_required": 5})
+
+    def test_filters_apply_to_rows_and_stats(self):
+        rows, stats = self._pages(filter_recon_status="open", filter_main_head="assets")
+        self.assertTrue(rows)
+        self.assertTrue(all(row["recon_status"] == "Open" and row["main_head"] == "Assets" for row in rows))
+        self.assertEqual(stats["total"], len(rows))
+
+    def _balance_sheet_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url, params or {})
+        return [q["sql"] for q in ctx.captured_queries if '"balance_sheet"' in q["sql"]]
+
+    def test_first_page_is_one_select_plus_one_stats_aggregate(self):
+        page, stats = self._balance_sheet_queries(reverse("balance_sheet_grid_api"), {"limit": 5})
+        self.assertIn("LIMIT 6", page)
+        self.assertIn("FILTER", stats)
+        self.assertEqual(self._balance_sheet_queries(reverse("reports_tier3")), [])
+
+    def test_bad_sort_filter_or_cursor_is_rejected(self):
+        url = reverse("balance_sheet_grid_api")
+        first = self.client.get(url, {"limit": 5, "sort": "gl_acct"}).json()
+        for params in (
+            {"sort": "password"}, {"filter_user": "1"}, {"cursor": first["next_cursor"], "sort": "-gl_acct"},
+            {"cursor": encode_cursor(["gl_acct", "21170200", "not-a-uuid"]), "sort": "gl_acct"},
+        ):
+            self.assertEqual(self.client.get(url, params).status_code, 400)
+
+
+class ReviewTrailCachingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username="preparer", password="x", user_type=4)
+        ReviewTrail.objects.create(reviewer=self.user, gl_code="10000001", gl_name="Cash", action="Submitted")
+        self.client.force_login(self.user)
+
+    def test_unchanged_timeline_returns_304(self):
+        url = reverse("get_review_trail", args=["10000001"])
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.has_header("Last-Modified"))
+
+        again = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(again.status_code, 304)
+
+        ReviewTrail.objects.create(reviewer=self.user, gl_code="10000001", action="Approved")
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(len(changed.json()["trails"]), 2)
+
+    def test_pending_messages_skip_the_conditional_response(self):
+        url = reverse("review_trail_page") + "?gl_code=10000001"
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # A failed action redirects with a message queued
+        self.client.post(reverse("upload_gl_supporting_document"), {})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("ETag"))
+
+    def _trail_codes(self):
+        response = self.client.get(reverse("gl_code_autocomplete"), {"scope": "trail"})
+        return [gl["code"] for gl in response.json()["results"]]
+
+    def test_trail_gl_codes_are_cached_until_a_trail_is_written(self):
+        GLAccount.objects.ids_for(["10000001", "10000002"])
+        self.assertEqual(self._trail_codes(), ["10000001"])
+        with CaptureQueriesContext(connection) as ctx:
+            self._trail_codes()
+        self.assertFalse(any("DISTINCT" in q["sql"] for q in ctx.captured_queries))
+
+        assignment = ResponsibilityMatrix.objects.create(user=self.user, user_role=4, gl_code="10000002", gl_code_status=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("submit_gl_review_preparer"), {
+                "assignment_id": assignment.id, "gl_code": "10000002", "reconciliation_notes": "Tied to bank",
+            })
+        self.assertEqual(self._trail_codes(), ["10000001", "10000002"])
+
+
+class SupportingDocumentStorageTests(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self.media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.user = CustomUser.objects.create_user(username="preparer", password="x", user_type=4)
+        self.assignments = [
+            ResponsibilityMatrix.objects.create(user=self.user, user_role=4, gl_code=code, gl_code_status=1)
+            for code in ("10000001", "10000002")
+        ]
+        self.client.force_login(self.user)
+
+    def _upload(self, assignment, content):
+        self.client.post(reverse("upload_gl_supporting_document"), {
+            "assignment_id": assignment.id,
+            "gl_code": assignment.gl_code,
+            "supporting_document": SimpleUploadedFile("statement.pdf", content),
+        })
+
+    def _remove(self, document):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("remove_gl_supporting_document", args=[document.id]))
+
+    def test_identical_uploads_share_one_blob_until_the_last_reference_goes(self):
+        content = b"%PDF-1.4 bank statement"
+        for assignment in self.assignments:
+            self._upload(assignment, content)
+
+        blob = StoredBlob.objects.get()
+        self.assertEqual(blob.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(blob.ref_count, 2)
+        first, second = GLSupportingDocument.objects.all()
+        self.assertEqual({first.file.name, second.file.name}, {blob.file.name})
+        self.assertEqual(first.file_name, "statement.pdf")
+        self.assertEqual(os.listdir(os.path.join(self.media.name, "blobs", blob.sha256[:2])), [os.path.basename(blob.file.name)])
+
+        self._remove(first)
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(default_storage.exists(blob.file.name))
+
+        self._remove(second)
+        self.assertFalse(StoredBlob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
+
+    def test_download_checks_gl_access_and_serves_ranges(self):
+        self._upload(self.assignments[0], b"0123456789")
+        document = GLSupportingDocument.objects.get()
+        url = reverse("download_gl_supporting_document", args=[document.id])
+
+        full = self.client.get(url)
+        self.assertEqual(b"".join(full.streaming_content), b"0123456789")
+        self.assertIn('filename="statement.pdf"', full["Content-Disposition"])
+        partial = self.client.get(url, HTTP_RANGE="bytes=2-5")
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial["Content-Range"], "bytes 2-5/10")
+        self.assertEqual(b"".join(partial.streaming_content), b"2345")
+        self.assertEqual(self.client.get(url, HTTP_RANGE="bytes=20-").status_code, 416)
+
+        with override_settings(PROTECTED_MEDIA_ACCEL_PREFIX="/protected-media/"):
+            accel = self.client.get(url)
+        self.assertEqual(accel["X-Accel-Redirect"], "/protected-media/" + document.file.name)
+
+        outsider = CustomUser.objects.create_user(username="outsider", password="x", user_type=4)
+        self.client.force_login(outsider)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_reupload_before_the_last_release_commits_keeps_the_bytes(self):
+        content = b"%PDF-1.4 bank statement"
+        self._upload(self.assignments[0], content)
+        document = GLSupportingDocument.objects.get()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(reverse("remove_gl_supporting_document", args=[document.id]))
+        self._upload(self.assignments[1], content)
+        for callback in callbacks:
+            callback()
+
+        blob = StoredBlob.objects.get()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(default_storage.exists(blob.file.name))
+
+    def test_unreferenced_blob_missing_its_bytes_gets_them_back(self):
+        content = b"%PDF-1.4 bank statement"
+        self._upload(self.assignments[0], content)
+        blob = StoredBlob.objects.get()
+        # What a _free_blob that deleted the file and then rolled back leaves behind
+        GLSupportingDocument.objects.all().delete()
+        StoredBlob.objects.update(ref_count=0)
+        default_storage.delete(blob.file.name)
+
+        self._upload(self.assignments[1], content)
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        with default_storage.open(blob.file.name) as fh:
+            self.assertEqual(fh.read(), content)
+
+    def test_different_content_gets_its_own_blob(self):
+        self._upload(self.assignments[0], b"january")
+        self._upload(self.assignments[1], b"february")
+        self.assertEqual(list(StoredBlob.objects.values_list("ref_count", flat=True)), [1, 1])
+
+
+class ChunkedUploadTests(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        tmp_settings = override_settings(
+            MEDIA_ROOT=os.path.join(self.tmp.name, "media"),
+            CHUNKED_UPLOAD_DIR=os.path.join(self.tmp.name, "parts"),
+        )
+        tmp_settings.enable()
+        self.addCleanup(tmp_settings.disable)
+
+        self.user = CustomUser.objects.create_user(username="uploader", password="x", user_type=4)
+        self.client.force_login(self.user)
+        self.content = b"gl_code,amount\n" + b"10000001,125.00\n" * 2000
+
+    def _start(self):
+        response = self.client.post(reverse("chunked_upload_start"), {
+            "file_name": "tb_export.csv", "table_type": "trial_balance", "total_size": len(self.content),
+        })
+        self.assertEqual(response.status_code, 201)
+        return response.json()["upload_id"]
+
+    def _send(self, upload_id, offset, chunk, **headers):
+        url = reverse("chunked_upload_chunk", args=[upload_id])
+        return self.client.post(f"{url}?offset={offset}", chunk, content_type="application/octet-stream", headers=headers)
+
+    def test_interrupted_upload_resumes_from_confirmed_offset(self):
+        upload_id = self._start()
+        half = len(self.content) // 2
+        self.assertEqual(self._send(upload_id, 0, self.content[:half]).json()["offset"], half)
+
+        # A retry of a chunk the server already has is told where to continue
+        stale = self._send(upload_id, 0, self.content[:half])
+        self.assertEqual(stale.status_code, 409)
+        self.assertEqual(stale.json()["offset"], half)
+
+        # A corrupted chunk is dropped without moving the offset
+        corrupt = self._send(upload_id, half, b"x" * 10, X_Chunk_SHA256=hashlib.sha256(b"y" * 10).hexdigest())
+        self.assertEqual(corrupt.status_code, 400)
+        state = self.client.get(reverse("chunked_upload_chunk", args=[upload_id])).json()
+        self.assertEqual(state["offset"], half)
+
+        rest = self.content[half:]
+        self.assertEqual(self._send(upload_id, half, rest, X_Chunk_SHA256=hashlib.sha256(rest).hexdigest()).status_code, 200)
+        sha256 = hashlib.sha256(self.content).hexdigest()
+        with self.captureOnCommitCallbacks(execute=True):
+            done = self.client.post(reverse("chunked_upload_complete", args=[upload_id]), {"sha256": sha256})
+        self.assertEqual(done.status_code, 200)
+
+        uploaded = UploadedFile.objects.get()
+        self.assertEqual(uploaded.file_name, "tb_export.csv")
+        self.assertEqual(uploaded.blob_id, sha256)
+        with uploaded.file.open("rb") as fh:
+            self.assertEqual(fh.read(), self.content)
+        self.assertTrue(LinkedData.objects.filter(data_id=str(uploaded.id), data_source="csv_file").exists())
+        self.assertEqual(os.listdir(os.path.join(self.tmp.name, "parts")), [])
+
+    def test_complete_rejects_unfinished_or_mismatched_uploads(self):
+        upload_id = self._start()
+        complete_url = reverse("chunked_upload_complete", args=[upload_id])
+        self._send(upload_id, 0, self.content[:100])
+        self.assertEqual(self.client.post(complete_url).status_code, 409)
+
+        self._send(upload_id, 100, self.content[100:])
+        self.assertEqual(self.client.post(complete_url, {"sha256": "0" * 64}).status_code, 422)
+        self.assertFalse(UploadedFile.objects.exists())
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+
+class UploadIngestionTests(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self.media.name, INGEST_BATCH_SIZE=100)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = CustomUser.objects.create_user(username="uploader", password="x", user_type=4)
+
+    def _queue(self, file_name, content, table_type):
+        name = default_storage.save(f"uploads/{file_name}", ContentFile(content))
+        return UploadedFile.objects.create(user=self.user, file=name, file_name=file_name, table_type=table_type)
+
+    def _sample(self, file_name):
+        with open(settings.BASE_DIR.parent / "data" / file_name, "rb") as fh:
+            return fh.read()
+
+    def test_sample_exports_are_ingested_in_batches(self):
+        tb = self._queue("TrialBalance_clean.csv", self._sample("TrialBalance_clean.csv"), "trial_balance")
+        bs = self._queue("reco.csv", self._sample("balance_sheet_reco_APL_5500_final.csv"), "balance_sheet")
+
+        self.assertEqual(ingest_pending(), (2, 0))
+        tb.refresh_from_db()
+        bs.refresh_from_db()
+        self.assertEqual((tb.status, tb.rows_ingested, tb.error), ("done", 556, ""))
+        self.assertEqual((bs.status, bs.rows_ingested, bs.error), ("done", 303, ""))
+
+        cash = TrialBalance.objects.get(gl_code="11100110")
+        self.assertEqual((cash.gl_name, cash.group_gl_code, cash.amount), ("Inventory-Raw Material-Domestic", "2021001001", 125437))
+        # The reco file's name is the one the GL pages display
+        self.assertEqual(cash.gl_account.name, "Stk of Raw Mat-Dom")
+        # Multi-line quoted headers ("Confirmation\n(Internal / External)", " Flag\n(Green / Red) ")
+        sheet = BalanceSheet.objects.filter(gl_acct="11100110").get()
+        self.assertEqual((sheet.confirmation_type, sheet.flag_color, sheet.analysis_required), ("Working / Documents based", "Green", "Yes"))
+        self.assertIn("\n", sheet.query_type_action_points)
+
+    def test_bad_file_fails_without_partial_rows(self):
+        rows = b"".join(b"%d,Cash,10\n" % (10000001 + i) for i in range(250))
+        bad = self._queue("tb.csv", b"GL,GL Name,Amount\n" + rows + b"20000002,Bank,ten\n", "trial_balance")
+        headerless = self._queue("notes.csv", b"just,some,text\n", "trial_balance")
+        self.assertEqual(ingest_pending(), (1, 1))
+
+        bad.refresh_from_db()
+        headerless.refresh_from_db()
+        # A bad amount skips the row only; a file without a GL column fails as a whole
+        self.assertEqual((bad.status, bad.rows_ingested, bad.error), ("done", 250, "1 rows skipped"))
+        self.assertEqual(headerless.status, "failed")
+        self.assertIn("gl_code", headerless.error)
+        self.assertEqual(TrialBalance.objects.count(), 250)
+
+    def test_reingesting_a_period_updates_rows_in_place(self):
+        self._queue("tb.csv", b"GL,GL Name,Amount,Fiscal Year\n10000001,Cash,10,2025\n10000002,Bank,20,\n", "trial_balance")
+        self._queue("tb2.csv", b"GL,GL Name,Amount,Fiscal Year\n10000001,Cash,15,2025\n10000002,Bank,25,\n"
+                               b"10000001,Cash,5,2024\n", "trial_balance")
+        self.assertEqual(ingest_pending(), (2, 0))
+
+        amounts = dict(TrialBalance.objects.values_list("fiscal_year", "amount").filter(gl_code__in=["10000001", "10000002"]))
+        self.assertEqual(TrialBalance.objects.count(), 3)
+        self.assertEqual(amounts, {"2025": 15, None: 25, "2024": 5})
+
+        # The table stays the size of the chart of accounts however often a period is loaded
+        sizes = []
+        for _ in range(2):
+            self._queue("tb.csv", self._sample("TrialBalance_clean.csv"), "trial_balance")
+            self.assertEqual(ingest_pending(), (1, 0))
+            sizes.append(TrialBalance.objects.count())
+        self.assertEqual(sizes[0], sizes[1])
+
+    def test_rows_repeating_a_natural_key_are_counted_once(self):
+        upload = self._queue(
+            "tb.csv", b"GL,GL Name,Amount\n10000001,Cash,10\n10000001,Cash,15\n10000002,Bank,20\n", "trial_balance",
+        )
+        self.assertEqual(ingest_pending(), (1, 0))
+        upload.refresh_from_db()
+        self.assertEqual((upload.rows_ingested, TrialBalance.objects.count()), (2, 2))
+        self.assertEqual(TrialBalance.objects.get(gl_code="10000001").amount, 15)
+
+    def test_worker_command_drains_the_queue(self):
+        self._queue("tb.csv", b"GL,GL Name,Amount\n10000001,Cash,10\n", "trial_balance")
+        out = StringIO()
+        call_command("ingest_uploads", stdout=out)
+        self.assertIn("1 ingested, 0 failed", out.getvalue())
+        self.assertFalse(UploadedFile.objects.filter(status="pending").exists())
+
+
+    def test_upload_abandoned_by_a_dead_worker_is_requeued(self):
+        upload = self._queue("tb.csv", b"GL,GL Name,Amount\n10000001,Cash,10\n", "trial_balance")
+        UploadedFile.objects.filter(id=upload.id).update(status="processing", claimed_at=timezone.now(), attempts=1)
+        self.assertEqual(ingest_pending(), (0, 0))
+
+        UploadedFile.objects.filter(id=upload.id).update(
+            claimed_at=timezone.now() - datetime.timedelta(seconds=settings.INGEST_CLAIM_TIMEOUT_SECONDS + 1),
+        )
+        self.assertEqual(ingest_pending(), (1, 0))
+        upload.refresh_from_db()
+        self.assertEqual((upload.status, upload.attempts, upload.rows_ingested), ("done", 2, 1))
+
+    @override_settings(INGEST_MAX_ATTEMPTS=2)
+    def test_upload_that_keeps_killing_the_worker_is_failed(self):
+        upload = self._queue("tb.csv", b"GL,GL Name,Amount\n10000001,Cash,10\n", "trial_balance")
+        UploadedFile.objects.filter(id=upload.id).update(
+            status="processing", attempts=2,
+            claimed_at=timezone.now() - datetime.timedelta(seconds=settings.INGEST_CLAIM_TIMEOUT_SECONDS + 1),
+        )
+        self.assertEqual(ingest_pending(), (0, 0))
+        upload.refresh_from_db()
+        self.assertEqual(upload.status, "failed")
+        self.assertIn("2 times", upload.error)
+        self.assertFalse(TrialBalance.objects.exists())
+
+
+class SapStreamingImportTests(TestCase):
+    """import_sap_table against sqlite3 standing in for the hdbcli DB-API connection."""
+
+    class CountingConnection:
+        def __init__(self, conn):
+            self.conn = conn
+            self.fetch_sizes = []
+
+        def cursor(self):
+            outer, cursor = self, self.conn.cursor()
+
+            class Cursor:
+                def execute(self, sql, params=()):
+                    outer.sql = sql
+                    return cursor.execute(sql, params)
+
+                def fetchmany(self, size):
+                    outer.fetch_sizes.append(size)
+                    return cursor.fetchmany(size)
+
+                def fetchall(self):
+                    raise AssertionError("the import must not fetch the whole table")
+
+                def close(self):
+                    cursor.close()
+
+            return Cursor()
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="sap", password="x", user_type=4)
+        sqlite = sqlite3.connect(":memory:")
+        sqlite.execute("ATTACH ':memory:' AS \"FINANCE\"")
+        sqlite.execute('CREATE TABLE "FINANCE"."TRIAL_BALANCE" (GL TEXT, GL_TEXT TEXT, AMT NUMERIC, FY TEXT, NOTES TEXT)')
+        sqlite.executemany(
+            'INSERT INTO "FINANCE"."TRIAL_BALANCE" VALUES (?, ?, ?, ?, ?)',
+            [(f"{10000000 + i}", f"Account {i}", i * 1.5, "2025", "x" * 100) for i in range(1234)],
+        )
+        self.addCleanup(sqlite.close)
+        self.conn = self.CountingConnection(sqlite)
+
+    def test_table_is_streamed_in_fetchmany_batches(self):
+        mapping = {"gl_code": "GL", "gl_name": "GL_TEXT", "amount": "AMT", "fiscal_year": "FY", "fs_main_head": ""}
+        with transaction.atomic():
+            inserted, skipped = import_sap_table(self.conn, "FINANCE", "trial_balance", mapping, self.user, fetch_size=100, batch_size=250)
+
+        self.assertEqual((inserted, skipped), (1234, 0))
+        self.assertEqual(self.conn.fetch_sizes, [100] * 14)
+        # Only the mapped columns are selected
+        self.assertNotIn("NOTES", self.conn.sql)
+        row = TrialBalance.objects.get(gl_code="10000010")
+        self.assertEqual((row.gl_name, row.amount, row.fiscal_year), ("Account 10", 15, "2025"))
+        self.assertEqual(row.gl_account.code, "10000010")
+
+    def test_incremental_sync_upserts_rows_changed_since_the_watermark(self):
+        sqlite = self.conn.conn
+        sqlite.execute('ALTER TABLE "FINANCE"."TRIAL_BALANCE" ADD COLUMN CHANGED_AT TEXT')
+        sqlite.execute('UPDATE "FINANCE"."TRIAL_BALANCE" SET CHANGED_AT = '
+                       "'2025-01-01 ' || printf('%02d:%02d', rowid / 60, rowid % 60)")
+        saplink = SAPLink.objects.create(
+            link=LinkedData.objects.create(user=self.user, data_source="sap_erp"),
+            system_type="sap_hana", hana_database="FINANCE",
+        )
+        mapping = {"gl_code": "GL", "gl_name": "GL_TEXT", "amount": "AMT", "fiscal_year": "FY"}
+        with transaction.atomic():
+            first = sync_sap_table(self.conn, saplink, "trial_balance", mapping, self.user, watermark_column="CHANGED_AT")
+        self.assertEqual((first["mode"], first["rows_written"], first["watermark"]), ("full", 1234, "2025-01-01 20:34"))
+
+        sqlite.execute('UPDATE "FINANCE"."TRIAL_BALANCE" SET AMT = 99, CHANGED_AT = \'2025-01-02 00:00\' WHERE rowid <= 3')
+        sqlite.executemany('INSERT INTO "FINANCE"."TRIAL_BALANCE" VALUES (?, ?, ?, ?, ?, ?)', [
+            ("20000001", "New 1", 1, "2025", "", "2025-01-02 00:01"),
+            ("20000002", "New 2", 2, "2025", "", "2025-01-02 00:01"),
+        ])
+        with transaction.atomic():
+            # The Sync button sends no mapping: the saved one is reused
+            second = sync_sap_table(self.conn, saplink, "trial_balance", {}, self.user)
+
+        # 3 changed + 2 new + the row sitting on the old watermark
+        self.assertEqual((second["mode"], second["rows_read"], second["watermark"]), ("incremental", 6, "2025-01-02 00:01"))
+        self.assertEqual(TrialBalance.objects.filter(user=self.user).count(), 1236)
+        self.assertEqual(TrialBalance.objects.get(gl_code="10000000").amount, 99)
+        saplink.refresh_from_db()
+        self.assertEqual(saplink.status["trial_balance"], "imported")
+        self.assertEqual(saplink.status["sync"]["trial_balance"]["rows_written"], 6)
+        self.assertIsNotNone(saplink.last_synced_at)
+
+    def test_gl_code_must_be_mapped(self):
+        with self.assertRaises(ValueError):
+            import_sap_table(self.conn, "FINANCE", "trial_balance", {"gl_name": "GL_TEXT"}, self.user)
+        self.assertEqual(self.conn.fetch_sizes, [])
+
+
+@override_settings(SAP_PROGRESS_CACHE="default")
+class SapImportJobTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="sapjobs", password="x", user_type=4)
+        self.client.force_login(self.user)
+        self.saplink = SAPLink.objects.create(
+            link=LinkedData.objects.create(user=self.user, data_source="sap_erp"),
+            system_type="sap_hana", hana_host="hana.example.com:443", hana_port="443", hana_database="FINANCE",
+            status={
+                "trial_balance": "imported",
+                "balance_sheet": "imported",
+                "sync": {
+                    "trial_balance": {"mapping": {"gl_code": "GL", "amount": "AMT"}},
+                    "balance_sheet": {"mapping": {"gl_acct": "GL_ACCT", "recon_status": "RECON"}},
+                },
+            },
+        )
+        sqlite = sqlite3.connect(":memory:")
+        sqlite.execute("ATTACH ':memory:' AS \"FINANCE\"")
+        sqlite.execute('CREATE TABLE "FINANCE"."TRIAL_BALANCE" (GL TEXT, AMT NUMERIC)')
+        sqlite.execute('CREATE TABLE "FINANCE"."BALANCE_SHEET" (GL_ACCT TEXT, RECON TEXT)')
+        sqlite.executemany('INSERT INTO "FINANCE"."TRIAL_BALANCE" VALUES (?, ?)', [(f"{10000000 + i}", i) for i in range(300)])
+        sqlite.executemany('INSERT INTO "FINANCE"."BALANCE_SHEET" VALUES (?, ?)', [(f"{10000000 + i}", "Open") for i in range(120)])
+        self.addCleanup(sqlite.close)
+        self.sqlite = sqlite
+        patcher = mock.patch(
+            "core_APP.modules.link_data.link_data_sap_jobs.hana_pool", HanaConnectionPool(connect=lambda **params: sqlite),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(SAP_IMPORT_WORKERS=1)
+    def test_import_all_job_syncs_every_connected_table(self):
+        response = self.client.post(reverse("sap_import_all", args=[self.saplink.id]))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["tables"], ["trial_balance", "balance_sheet"])
+        self.saplink.refresh_from_db()
+        self.assertEqual(self.saplink.status["sync"]["balance_sheet"]["state"], "queued")
+
+        out = StringIO()
+        call_command("run_sap_imports", stdout=out)
+        self.assertIn("1 done, 0 failed", out.getvalue())
+
+        job = self.client.get(response.json()["status_url"]).json()
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["tables"]["trial_balance"]["state"], "done")
+        self.assertEqual(job["tables"]["balance_sheet"]["rows_written"], 120)
+        self.assertEqual(TrialBalance.objects.count(), 300)
+        self.assertEqual(BalanceSheet.objects.filter(recon_status="Open").count(), 120)
+
+    @override_settings(SAP_IMPORT_WORKERS=4)
+    def test_tables_run_in_parallel_and_fail_independently(self):
+        def slow_sync(job, table_name, progress):
+            time.sleep(0.5)
+            if table_name == "balance_sheet":
+                raise RuntimeError("HANA went away")
+
+        SapImportJob.objects.create(saplink=self.saplink, user=self.user, tables=["trial_balance", "balance_sheet"])
+        job = claim_next_job()
+        with mock.patch("core_APP.modules.link_data.link_data_sap_jobs._sync_table", side_effect=slow_sync):
+            started = time.monotonic()
+            self.assertFalse(run_import_job(job))
+            elapsed = time.monotonic() - started
+
+        # About the slowest table, not the sum
+        self.assertLess(elapsed, 0.9)
+        self.assertEqual((job.status, job.error), ("failed", "balance_sheet: HANA went away"))
+        self.saplink.refresh_from_db()
+        self.assertEqual(self.saplink.status["sync"]["balance_sheet"]["state"], "failed")
+        self.assertNotEqual(self.saplink.status["sync"]["trial_balance"].get("state"), "failed")
+
+    @override_settings(SAP_IMPORT_WORKERS=1)
+    def test_table_import_is_queued_and_streams_its_progress(self):
+        cache.clear()
+        response = self.client.post(
+            reverse("link_sap_erp_to_unified_db", args=[self.saplink.id, "trial_balance"]),
+            data={"mapping": {"gl_code": "GL", "amount": "AMT"}, "mode": "full"}, content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 202)
+        job = SapImportJob.objects.get(id=response.json()["job_id"])
+        self.assertEqual((job.tables, job.full), (["trial_balance"], True))
+        self.assertFalse(TrialBalance.objects.exists())
+
+        events = job_events(job.id, poll_seconds=0.01)
+        self.assertEqual(next(events), "retry: 2000\n\n")
+        # Streams read the progress cache, not the database
+        with self.assertNumQueries(0):
+            self.assertIn('"status": "queued"', next(events))
+
+        run_import_job(claim_next_job())
+        self.assertEqual(read_progress(job.id)["status"], "done")
+        progress = read_progress(job.id)["tables"]["trial_balance"]
+        self.assertEqual((progress["state"], progress["total_rows"], progress["rows_written"]), ("done", 300, 300))
+        self.assertEqual(progress["eta_seconds"], 0)
+
+        done = next(events)
+        self.assertTrue(done.startswith("event: done\n"))
+        self.assertIn('"rows_written": 300', done)
+        self.assertEqual(list(events), [])
+
+        stream = self.client.get(response.json()["events_url"])
+        self.assertEqual(stream["Content-Type"], "text/event-stream")
+        self.assertIn("event: done", b"".join(stream.streaming_content).decode())
+
+    def test_table_import_needs_a_mapped_gl_code(self):
+        response = self.client.post(
+            reverse("link_sap_erp_to_unified_db", args=[self.saplink.id, "trial_balance"]),
+            data={"mapping": {"amount": "AMT"}}, content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(SapImportJob.objects.exists())
+
+    @override_settings(SAP_IMPORT_WORKERS=1, INGEST_BATCH_SIZE=100)
+    def test_table_batches_commit_as_they_go_and_a_rerun_resumes(self):
+        self.sqlite.execute('ALTER TABLE "FINANCE"."TRIAL_BALANCE" ADD COLUMN CHANGED_AT TEXT')
+        # Stored out of order: the sync reads them in watermark order
+        self.sqlite.execute('UPDATE "FINANCE"."TRIAL_BALANCE" SET CHANGED_AT = printf(\'2025-01-01 %04d\', 299 - GL + 10000000)')
+        self.saplink.status["sync"]["trial_balance"]["watermark_column"] = "CHANGED_AT"
+        self.saplink.save(update_fields=["status"])
+        # Answers the pool's ping, so the shared sqlite connection survives the failed job
+        self.sqlite.execute("CREATE TABLE DUMMY (X)")
+        stream_rows = link_data_sap.stream_rows
+
+        def dropped_connection(*args, **kwargs):
+            for n, row in enumerate(stream_rows(*args, **kwargs)):
+                if n == 150:
+                    raise OSError("connection reset")
+                yield row
+
+        SapImportJob.objects.create(saplink=self.saplink, user=self.user, tables=["trial_balance"])
+        with mock.patch.object(link_data_sap, "stream_rows", dropped_connection):
+            self.assertFalse(run_import_job(claim_next_job()))
+        # The first batch and the worklist stay, with the watermark after them; the table is marked failed
+        self.assertEqual(TrialBalance.objects.count(), 100)
+        self.assertEqual(min(TrialBalance.objects.values_list("gl_code", flat=True)), "10000200")
+        self.saplink.refresh_from_db()
+        entry = self.saplink.status["sync"]["trial_balance"]
+        self.assertEqual((entry["state"], entry.get("synced_at")), ("failed", None))
+        self.assertEqual(entry["watermark"], "2025-01-01 0099")
+        self.assertIn("partially imported: 100 rows", entry["error"])
+        self.assertIn("partially imported: 100 rows", SapImportJob.objects.get().error)
+
+        SapImportJob.objects.create(saplink=self.saplink, user=self.user, tables=["trial_balance"])
+        self.assertTrue(run_import_job(claim_next_job()))
+        self.saplink.refresh_from_db()
+        entry = self.saplink.status["sync"]["trial_balance"]
+        # From the row on the saved watermark onwards
+        self.assertEqual((entry["state"], entry["mode"], entry["rows_read"]), ("done", "incremental", 201))
+        self.assertEqual(TrialBalance.objects.count(), 300)
+
+    def test_job_left_running_by_a_dead_worker_is_claimed_again(self):
+        job = SapImportJob.objects.create(
+            saplink=self.saplink, user=self.user, tables=["trial_balance"], status="running",
+            started_at=timezone.now(), attempts=1,
+        )
+        self.assertIsNone(claim_next_job())
+
+        SapImportJob.objects.filter(id=job.id).update(
+            started_at=timezone.now() - datetime.timedelta(seconds=settings.SAP_IMPORT_JOB_TIMEOUT_SECONDS + 1),
+        )
+        claimed = claim_next_job()
+        self.assertEqual((claimed.id, claimed.status, claimed.attempts), (job.id, "running", 2))
+
+    def test_event_stream_ends_at_its_deadline_and_falls_back_to_the_database(self):
+        job = SapImportJob.objects.create(saplink=self.saplink, user=self.user, tables=["trial_balance"])
+        events = list(job_events(job.id, poll_seconds=0.01, max_seconds=0.05))
+        self.assertEqual(len(events), 2)
+        self.assertIn('"status": "queued"', events[1])
+
+    @override_settings(SAP_IMPORT_MAX_ATTEMPTS=2)
+    def test_job_that_keeps_killing_the_worker_is_failed(self):
+        job = SapImportJob.objects.create(
+            saplink=self.saplink, user=self.user, tables=["trial_balance"], status="running", attempts=2,
+            started_at=timezone.now() - datetime.timedelta(seconds=settings.SAP_IMPORT_JOB_TIMEOUT_SECONDS + 1),
+        )
+        self.assertIsNone(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(read_progress(job.id)["status"], "failed")
+        self.saplink.refresh_from_db()
+        self.assertEqual(self.saplink.status["sync"]["trial_balance"]["state"], "failed")
+
+    def test_import_all_needs_a_connected_table(self):
+        self.saplink.status = {"trial_balance": "pending", "balance_sheet": "pending"}
+        self.saplink.save()
+        response = self.client.post(reverse("sap_import_all", args=[self.saplink.id]))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(SapImportJob.objects.exists())
+
+
+class HanaStandinTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        standin = override_settings(HANA_CONNECTION_FACTORY="core_APP.hana_standin.connect", HANA_STANDIN_DIR=self.directory.name)
+        standin.enable()
+        self.addCleanup(standin.disable)
+        self.user = CustomUser.objects.create_user(username="standin", password="x", user_type=4)
+        self.saplink = SAPLink.objects.create(
+            link=LinkedData.objects.create(user=self.user, data_source="sap_erp"),
+            system_type="sap_hana", hana_host="localhost:443", hana_port="443", hana_database="FINANCE",
+        )
+        self.pool = HanaConnectionPool()
+        patcher = mock.patch("core_APP.modules.link_data.link_data_sap.hana_pool", self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.pool.close_all)
+
+    def test_generated_tables_are_discovered_and_imported_through_the_pool(self):
+        call_command("hana_standin", rows=1200, stdout=StringIO())
+
+        tables = schema_columns(self.saplink, "FINANCE")
+        self.assertEqual(sorted(tables), ["BALANCE_SHEET", "TRIAL_BALANCE"])
+        self.assertIn({"name": "AMOUNT", "type": "DECIMAL"}, tables["TRIAL_BALANCE"])
+        self.assertEqual(tables["TRIAL_BALANCE"][-1], {"name": "CHANGED_AT", "type": "TIMESTAMP"})
+
+        with self.pool.connection(self.saplink) as conn, transaction.atomic():
+            sync = sync_sap_table(
+                conn, self.saplink, "trial_balance", standin_mapping("trial_balance"), self.user, watermark_column="CHANGED_AT",
+            )
+        # Every generated row has its own (GL code, fiscal year)
+        self.assertEqual((sync["rows_written"], TrialBalance.objects.count()), (1200, 1200))
+        self.assertEqual(TrialBalance.objects.values("fiscal_year").distinct().count(), 3)
+
+    def test_benchmark_reports_each_size_and_rolls_back(self):
+        out = StringIO()
+        call_command("benchmark_sap_import", rows=[300, 100], batch_size=50, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split()[:2] for line in lines[2:]], [["100", "100"], ["300", "300"]])
+        self.assertFalse(TrialBalance.objects.exists())
+
+
+class FakeHanaConnection:
+    def __init__(self, **params):
+        self.params = params
+        self.alive = True
+        self.closed = False
+
+    def isconnected(self):
+        return self.alive and not self.closed
+
+    def close(self):
+        self.closed = True
+
+
+@override_settings(HANA_POOL_MAX_SIZE=2, HANA_POOL_TIMEOUT=0, HANA_POOL_IDLE_TIMEOUT=300, HANA_POOL_CHECK_AFTER=0)
+class HanaConnectionPoolTests(TestCase):
+    def setUp(self):
+        self.opened = []
+        self.pool = HanaConnectionPool(connect=self.connect)
+        self.saplink = SAPLink(
+            id=uuid.uuid4(), hana_host="hana.example.com:443", hana_port="443", username="SYSTEM", password="secret",
+        )
+
+    def connect(self, **params):
+        conn = FakeHanaConnection(**params)
+        self.opened.append(conn)
+        return conn
+
+    def test_connections_are_reused_up_to_max_size(self):
+        with self.pool.connection(self.saplink) as first:
+            pass
+        with self.pool.connection(self.saplink) as again:
+            self.assertIs(again, first)
+            with self.pool.connection(self.saplink) as second:
+                self.assertIsNot(second, first)
+                with self.assertRaises(PoolExhausted):
+                    self.pool.acquire(self.saplink)
+        self.assertEqual(len(self.opened), 2)
+        self.assertEqual(self.opened[0].params["address"], "hana.example.com")
+
+    def test_dead_and_idle_connections_are_replaced(self):
+        with self.pool.connection(self.saplink) as first:
+            pass
+        first.alive = False
+        with self.pool.connection(self.saplink) as second:
+            self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+
+        with override_settings(HANA_POOL_IDLE_TIMEOUT=-1):
+            with self.pool.connection(self.saplink) as third:
+                self.assertIsNot(third, second)
+        self.assertTrue(second.closed)
+
+    def test_broken_connection_is_discarded_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with self.pool.connection(self.saplink) as conn:
+                conn.alive = False
+                raise RuntimeError("connection reset")
+        self.assertTrue(conn.closed)
+
+    def test_credential_change_retires_connections(self):
+        with self.pool.connection(self.saplink) as in_use:
+            with self.pool.connection(self.saplink) as idle:
+                pass
+            self.saplink.password = "rotated"
+            with self.pool.connection(self.saplink) as fresh:
+                self.assertEqual(fresh.params["password"], "rotated")
+            self.assertTrue(idle.closed)
+        # Opened with the old password, so it's closed on return instead of pooled
+        self.assertTrue(in_use.closed)
+        self.assertFalse(fresh.closed)
+
+        self.pool.invalidate(self.saplink.id)
+        self.assertTrue(fresh.closed)
+
+    def test_idle_connections_of_other_links_are_closed_outside_the_lock(self):
+        other = SAPLink(
+            id=uuid.uuid4(), hana_host="hana2.example.com:443", hana_port="443", username="SYSTEM", password="secret",
+        )
+        locked_on_close = []
+        with self.pool.connection(self.saplink) as idle:
+            idle.close = lambda: locked_on_close.append(self.pool._lock.locked())
+
+        with override_settings(HANA_POOL_IDLE_TIMEOUT=-1):
+            with self.pool.connection(other):
+                pass
+        self.assertEqual(locked_on_close, [False])
+
+        with self.pool.connection(self.saplink) as conn:
+            conn.close = lambda: locked_on_close.append(self.pool._lock.locked())
+        self.pool.close_all()
+        self.assertEqual(locked_on_close, [False, False])
+
+
+class SapMetadataCacheTests(TestCase):
+    """Column discovery against sqlite3 with an attached SYS schema standing in for HANA."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username="sapmeta", password="x", user_type=4)
+        self.client.force_login(self.user)
+        link = LinkedData.objects.create(user=self.user, data_source="sap_erp")
+        self.saplink = SAPLink.objects.create(
+            link=link, system_type="sap_hana", hana_host="hana.example.com:443", hana_port="443",
+            hana_database="FINANCE", username="SYSTEM", password="secret",
+        )
+        self.sqlite = sqlite3.connect(":memory:", check_same_thread=False)
+        self.sqlite.execute("ATTACH ':memory:' AS \"SYS\"")
+        self.sqlite.execute('CREATE TABLE "SYS"."TABLE_COLUMNS" '
+                            '(SCHEMA_NAME TEXT, TABLE_NAME TEXT, COLUMN_NAME TEXT, DATA_TYPE_NAME TEXT, POSITION INT)')
+        self.sqlite.executemany('INSERT INTO "SYS"."TABLE_COLUMNS" VALUES (?, ?, ?, ?, ?)', [
+            ("FINANCE", "TRIAL_BALANCE", "ID", "INTEGER", 1),
+            ("FINANCE", "TRIAL_BALANCE", "GL", "NVARCHAR", 2),
+            ("FINANCE", "TRIAL_BALANCE", "AMT", "DECIMAL", 3),
+            ("FINANCE", "BALANCE_SHEET", "GL_ACCT", "NVARCHAR", 1),
+            ("OTHER", "TRIAL_BALANCE", "X", "NVARCHAR", 1),
+        ])
+        self.addCleanup(self.sqlite.close)
+        self.queries = []
+        self.sqlite.set_trace_callback(self.queries.append)
+        pool = HanaConnectionPool(connect=lambda **params: self.sqlite)
+        patcher = mock.patch("core_APP.modules.link_data.link_data_sap.hana_pool", pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def metadata_queries(self):
+        return [sql for sql in self.queries if sql.startswith("SELECT") and "TABLE_COLUMNS" in sql]
+
+    def test_table_columns_are_cached_until_refreshed(self):
+        url = reverse("get_sap_columns", args=[self.saplink.id, "trial_balance"])
+        for _ in range(3):
+            response = self.client.get(url)
+        self.assertEqual(response.json()["columns"], [{"name": "GL", "type": "NVARCHAR"}, {"name": "AMT", "type": "DECIMAL"}])
+        self.assertEqual(len(self.metadata_queries()), 1)
+
+        self.sqlite.execute('INSERT INTO "SYS"."TABLE_COLUMNS" VALUES (\'FINANCE\', \'TRIAL_BALANCE\', \'FY\', \'NVARCHAR\', 4)')
+        self.assertEqual(len(self.client.get(url).json()["columns"]), 2)
+        self.assertEqual(len(self.client.get(url + "?refresh=1").json()["columns"]), 3)
+        self.assertEqual(len(self.metadata_queries()), 2)
+
+    def test_schema_discovery_fills_table_entries_in_one_round_trip(self):
+        data = self.client.get(reverse("get_sap_schema_columns", args=[self.saplink.id])).json()
+        self.assertEqual(sorted(data["tables"]), ["BALANCE_SHEET", "TRIAL_BALANCE"])
+        self.assertEqual([c["name"] for c in data["tables"]["TRIAL_BALANCE"]], ["GL", "AMT"])
+        self.assertIn("gl_code", data["local_fields"]["trial_balance"])
+
+        self.client.get(reverse("get_sap_columns", args=[self.saplink.id, "balance_sheet"]))
+        self.client.get(reverse("link_sap_erp_to_unified_db", args=[self.saplink.id, "trial_balance"]))
+        self.assertEqual(len(self.metadata_queries()), 1)
+
+
+class GLCodeIndexTests(TestCase):
+
+    def setUp(self):
+        GLAccount.objects.ids_for(
+            ["100100", "100200", "200100", "310000"],
+            {"100100": "Cash at Bank", "100200": "Petty Cash", "200100": "Trade Payables", "310000": "Bank Charges"},
+        )
+        self.index = GLCodeIndex()
+
+    def test_prefix_matches_come_before_substring_matches(self):
+        self.assertEqual([code for code, _ in self.index.search("1001")], ["100100"])
+        self.assertEqual({code for code, _ in self.index.search("bank")}, {"100100", "310000"})
+        codes = [code for code, _ in self.index.search("100")]
+        self.assertEqual(codes[:2], ["100100", "100200"])
+        self.assertEqual(set(codes[2:]), {"200100", "310000"})
+        self.assertEqual(len(self.index.search("", limit=2)), 2)
+        self.assertEqual(self.index.search("cash", within={"100200"}), [("100200", "Petty Cash")])
+
+    def test_new_codes_are_picked_up_incrementally(self):
+        self.index.search("1")
+        GLAccount.objects.ids_for(["100300"], {"100300": "Cash in Transit"})
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.index.search("1003")), 0)
+
+        self.index.expire()
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.index.search("1003"), [("100300", "Cash in Transit")])
+        self.assertIn('"gl_accounts"."updated_at" >=', ctx.captured_queries[0]["sql"])
+
+    def test_renamed_accounts_are_reindexed(self):
+        self.index.search("1")
+        GLAccount.objects.ids_for(["100200"], {"100200": "Imprest Float"}, overwrite_names=True)
+        self.index.expire()
+        self.assertEqual(self.index.search("imprest"), [("100200", "Imprest Float")])
+        self.assertEqual(self.index.search("petty"), [])
+        self.assertEqual(self.index.search("1002"), [("100200", "Imprest Float")])
+
+    def test_deleted_accounts_are_dropped(self):
+        self.index.search("1")
+        GLAccount.objects.filter(code="100100").delete()
+        self.index.expire()
+        self.assertEqual(self.index.search("1001"), [])
+        self.assertEqual(self.index.search("bank"), [("310000", "Bank Charges")])
+
+    def test_short_queries_use_their_own_postings(self):
+        self.assertEqual({code for code, _ in self.index.search("ch")}, {"310000"})
+        self.assertEqual({code for code, _ in self.index.search("k")}, {"100100", "310000"})
+        self.assertEqual(self.index._candidates("ch"), self.index._grams["ch"])
+
+
+class EmailOutboxTests(TestCase):
+
+    def test_worker_delivers_queued_mail_over_one_connection(self):
+        for i in range(3):
+            enqueue_mail(f"GL Review {i}", "body", "noreply@example.com", [f"user{i}@example.com", None])
+        self.assertEqual(len(mail.outbox), 0)
+
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.open") as opened:
+            call_command("send_outbox", stdout=StringIO())
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual([m.to for m in mail.outbox], [[f"user{i}@example.com"] for i in range(3)])
+        self.assertEqual(OutboundEmail.objects.filter(status="sent").count(), 3)
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        queued = enqueue_mail("GL Review Rejected", "body", None, ["user@example.com"])
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=OSError("timeout")):
+            self.assertEqual(deliver_pending(max_attempts=2), (0, 1))
+            queued.refresh_from_db()
+            self.assertEqual((queued.status, queued.attempts), ("pending", 1))
+            self.assertGreater(queued.next_attempt_at, timezone.now())
+
+            # Not due yet, so nothing is picked up
+            self.assertEqual(deliver_pending(max_attempts=2), (0, 0))
+            OutboundEmail.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(deliver_pending(max_attempts=2), (0, 1))
+
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.last_error), ("failed", "timeout"))
+
+    def test_unreachable_server_backs_off_without_using_attempts(self):
+        queued = enqueue_mail("GL Review Rejected", "body", None, ["user@example.com"])
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.open", side_effect=OSError("refused")):
+            with self.assertRaises(OutboxConnectionError):
+                deliver_pending()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts, queued.last_error), ("pending", 0, "refused"))
+        self.assertGreater(queued.next_attempt_at, timezone.now())
+
+    def test_loop_worker_survives_a_mail_server_outage(self):
+        enqueue_mail("GL Review Rejected", "body", None, ["user@example.com"])
+        open_calls = []
+
+        def flaky_open(backend):
+            open_calls.append(1)
+            if len(open_calls) == 1:
+                raise OSError("refused")
+
+        def sleep(seconds):
+            if len(open_calls) > 1:
+                # Delivered after the outage; stop the loop
+                raise KeyboardInterrupt
+            OutboundEmail.objects.update(next_attempt_at=timezone.now())
+
+        stderr = StringIO()
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.open", flaky_open), \
+                mock.patch("core_APP.management.commands.send_outbox.time.sleep", side_effect=sleep) as slept:
+            with self.assertRaises(KeyboardInterrupt):
+                call_command("send_outbox", loop=True, stdout=StringIO(), stderr=stderr)
+        self.assertIn("retrying in 30s", stderr.getvalue())
+        self.assertEqual(slept.call_args_list[0].args, (30.0,))
+        self.assertEqual(OutboundEmail.objects.get().status, "sent")
+
+    def test_mail_left_sending_by_a_dead_worker_is_reclaimed(self):
+        queued = enqueue_mail("GL Review Rejected", "body", None, ["user@example.com"])
+        OutboundEmail.objects.update(status="sending", claimed_at=timezone.now())
+        self.assertEqual(deliver_pending(), (0, 0))
+
+        OutboundEmail.objects.update(claimed_at=timezone.now() - datetime.timedelta(seconds=settings.EMAIL_OUTBOX_LEASE_SECONDS + 1))
+        self.assertEqual(deliver_pending(), (1, 0))
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ("sent", 1))
+
+    @override_settings(EMAIL_DIGEST_WINDOW_SECONDS=300)
+    def test_notifications_are_folded_into_one_digest_per_recipient(self):
+        for i in range(50):
+            enqueue_notification("fc@example.com", f"{i:08d}", "Approved by Tower Head", "GL Review Approved", "body")
+        enqueue_notification("head@example.com", "00000001", "Available for your approval", "GL Review Available", "single")
+
+        # Held until the window closes
+        self.assertEqual(deliver_pending(), (0, 0))
+
+        OutboundEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(deliver_pending(), (2, 0))
+        by_recipient = {m.to[0]: m for m in mail.outbox}
+        self.assertEqual(by_recipient["head@example.com"].body, "single")
+        digest = by_recipient["fc@example.com"]
+        self.assertEqual(digest.subject, "GL Review updates (50)")
+        self.assertIn("00000049: Approved by Tower Head", digest.body)
+        self.assertEqual(OutboundEmail.objects.filter(status="digested").count(), 50)
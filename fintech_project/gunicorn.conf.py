@@ -0,0 +1,11 @@
+# Picked up by `gunicorn core.wsgi` run from this directory.
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", 2))
+# Threaded workers: a Link Data page following an SAP import keeps an event stream open, which
+# ties up one thread instead of a whole worker. Sync workers only heartbeat between requests,
+# so they would also be killed by `timeout` in the middle of a stream.
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))